@@ -0,0 +1,299 @@
+"""
+Compact in-memory activities.
+
+Activity holds the trackpoints of an activity as a struct of
+narrow NumPy arrays, about half the memory of the float64
+and object DataFrames of load_workout, so that a season of
+activities can be kept in memory:
+
+- timestamp          : int64 nanoseconds since the unix epoch (UTC)
+- lat_delta, lon_delta : float32 degrees from origin, the first position
+- altitude, distance, speed : float32 meters and meters per second
+- heart_rate, cadence : int16, MISSING when absent
+- power              : uint16, POWER_MISSING when absent
+
+Columns the file does not record are None. Lap boundaries are
+the index offsets of the first trackpoint of every lap, plus the
+number of trackpoints. view() wraps the arrays in a DataFrame
+without copying them, to_dataframe() decodes them into the
+load_workout columns.
+"""
+
+import numpy as np
+import pandas as pd
+
+import fitrecords
+from tcxtools import TCXPandas
+
+MISSING = -1  # Absent heart rate or cadence
+POWER_MISSING = 0xFFFF
+NAT = np.iinfo(np.int64).min  # NaT as int64
+
+# FIT positions are in semicircles
+SEMICIRCLE_DEGREES = 180.0 / 2 ** 31
+
+# Name and dtype of the trackpoint columns
+COLUMNS = (
+    ('timestamp', np.int64),
+    ('lat_delta', np.float32),
+    ('lon_delta', np.float32),
+    ('altitude', np.float32),
+    ('distance', np.float32),
+    ('speed', np.float32),
+    ('heart_rate', np.int16),
+    ('cadence', np.int16),
+    ('power', np.uint16),
+)
+
+# TCXPandas traverse_dataframe columns translated to the Activity ones
+TCX_COLUMNS = {
+    'latitude': 'latitude',
+    'longitude': 'longitude',
+    'altitude': 'altitude',
+    'distance': 'distance',
+    'speed (m/s)': 'speed',
+    'hr': 'heart_rate',
+    'cadence': 'cadence',
+    'power': 'power',
+}
+
+# FIT record fields read for an Activity, the enhanced ones first
+FIT_FIELDS = {
+    'latitude': ['position_lat'],
+    'longitude': ['position_long'],
+    'altitude': ['enhanced_altitude', 'altitude'],
+    'distance': ['distance'],
+    'speed': ['enhanced_speed', 'speed'],
+    'heart_rate': ['heart_rate'],
+    'cadence': ['cadence'],
+    'power': ['power'],
+}
+
+
+class Activity(object):
+    """
+    Trackpoints of an activity as narrow typed arrays.
+
+    Parameters
+    ----------
+    timestamp : int64 array, nanoseconds since the unix epoch
+    laps : int array, index of the first trackpoint of every lap
+           and the number of trackpoints, one lap if None
+    sport : string, e.g. the Sport attribute of a TCX Activity
+    origin : (latitude, longitude) of lat_delta and lon_delta
+    columns : the other COLUMNS, already encoded, None when absent
+
+    Use from_columns to encode decoded (float) columns.
+    """
+
+    __slots__ = ('sport', 'origin', 'laps') + tuple(name for name, _ in COLUMNS)
+
+    def __init__(self, timestamp, laps=None, sport=None, origin=(np.nan, np.nan), **columns):
+        unknown = set(columns) - set(name for name, _ in COLUMNS)
+        if unknown:
+            raise ValueError("Unknown activity columns %s" % sorted(unknown))
+
+        size = len(timestamp)
+        for name, dtype in COLUMNS:
+            values = timestamp if name == 'timestamp' else columns.get(name)
+            if values is not None:
+                values = np.asarray(values, dtype=dtype)
+                if len(values) != size:
+                    raise ValueError("Column %s has %d values for %d trackpoints" % (name, len(values), size))
+            setattr(self, name, values)
+
+        self.laps = np.asarray([0, size] if laps is None else laps, dtype=np.int64)
+        self.sport = sport
+        self.origin = origin
+
+    @classmethod
+    def from_columns(cls, timestamp, columns, laps=None, sport=None):
+        """
+        Encode decoded columns: timestamp as datetimes (naive UTC or
+        timezone aware), and arrays with NaN for absent values named
+        latitude, longitude (degrees), altitude, distance, speed,
+        heart_rate, cadence and power.
+        """
+        timestamp = pd.DatetimeIndex(timestamp)
+        if timestamp.tz is not None:
+            timestamp = timestamp.tz_convert(None)
+
+        encoded = {}
+        origin = [np.nan, np.nan]
+        for axis, name in enumerate(['latitude', 'longitude']):
+            values = columns.get(name)
+            if values is None:
+                continue
+            values = np.asarray(values, dtype=np.float64)
+            valid = np.flatnonzero(~np.isnan(values))
+            if len(valid) == 0:
+                continue
+            origin[axis] = values[valid[0]]
+            encoded[name[:3] + '_delta'] = (values - origin[axis]).astype(np.float32)
+
+        for name in ['altitude', 'distance', 'speed']:
+            if columns.get(name) is not None:
+                encoded[name] = np.asarray(columns[name], dtype=np.float32)
+        for name, missing in [('heart_rate', MISSING), ('cadence', MISSING), ('power', POWER_MISSING)]:
+            if columns.get(name) is not None:
+                encoded[name] = _encode_int_(columns[name], dict(COLUMNS)[name], missing)
+
+        return cls(timestamp.asi8, laps=laps, sport=sport, origin=tuple(origin), **encoded)
+
+    @classmethod
+    def from_tcx(cls, source):
+        """
+        Parse a TCX file (see TCXPandas) into an Activity.
+        """
+        tcx = TCXPandas(source)
+        traverse_dataframe, _ = tcx.parse()
+        columns = {target: traverse_dataframe[name].to_numpy(dtype=np.float64)
+                   for name, target in TCX_COLUMNS.items() if name in traverse_dataframe}
+        return cls.from_columns(traverse_dataframe['time'], columns, laps=tcx.lap_offsets, sport=tcx.get_sport())
+
+    @classmethod
+    def from_fit(cls, source):
+        """
+        Decode the record and lap messages of a FIT file into an Activity.
+        """
+        fields = ['timestamp'] + [field for names in FIT_FIELDS.values() for field in names]
+        messages = fitrecords.read_messages(source, {fitrecords.RECORD: fields,
+                                                     fitrecords.LAP: ['start_time'],
+                                                     fitrecords.SESSION: ['sport']})
+        records, laps = messages[fitrecords.RECORD], messages[fitrecords.LAP]
+        if 'timestamp' not in records:
+            raise ValueError("FIT records without timestamps")
+
+        columns = {}
+        for name, candidates in FIT_FIELDS.items():
+            for field in candidates:
+                if field in records and not np.isnan(records[field]).all():
+                    columns[name] = records[field]
+                    break
+        for name in ['latitude', 'longitude']:
+            if name in columns:
+                columns[name] = columns[name] * SEMICIRCLE_DEGREES
+
+        timestamp = records['timestamp'].astype('datetime64[ns]')
+        offsets = None
+        if 'start_time' in laps and len(laps['start_time']):
+            starts = laps['start_time'].astype('datetime64[ns]')
+            offsets = np.searchsorted(timestamp, starts[~np.isnat(starts)])
+            offsets = np.unique(np.concatenate(([0], offsets, [len(timestamp)])))
+
+        # As the TCX Sport attribute, Other for the sports TCX has no name for
+        sport = None
+        sports = messages[fitrecords.SESSION].get('sport', np.array([]))
+        sports = sports[~np.isnan(sports)]
+        if len(sports):
+            sport = fitrecords.SPORTS.get(int(sports[0]), 'Other')
+        return cls.from_columns(timestamp, columns, laps=offsets, sport=sport)
+
+    def __len__(self):
+        return len(self.timestamp)
+
+    def __repr__(self):
+        return '<Activity %s%d trackpoints, %d laps, %d bytes>' % (
+            '' if self.sport is None else self.sport + ', ', len(self), self.lap_count, self.nbytes)
+
+    @property
+    def columns(self):
+        """
+        Names of the recorded columns.
+        """
+        return [name for name, _ in COLUMNS if getattr(self, name) is not None]
+
+    @property
+    def nbytes(self):
+        return sum(getattr(self, name).nbytes for name in self.columns) + self.laps.nbytes
+
+    @property
+    def lap_count(self):
+        return len(self.laps) - 1
+
+    @property
+    def start(self):
+        """
+        The first timestamp, or None.
+        """
+        valid = self.timestamp[self.timestamp != NAT]
+        return pd.Timestamp(valid[0]) if len(valid) else None
+
+    def lap_index(self):
+        """
+        The lap number of every trackpoint.
+        """
+        return np.repeat(np.arange(self.lap_count, dtype=np.int32), np.diff(self.laps))
+
+    def lap(self, number):
+        """
+        The trackpoints of one lap as an Activity sharing the arrays.
+        """
+        if not -self.lap_count <= number < self.lap_count:
+            raise IndexError("Lap %d of %d laps" % (number, self.lap_count))
+        first, last = self.laps[number % self.lap_count], self.laps[number % self.lap_count + 1]
+        columns = {name: getattr(self, name)[first:last] for name in self.columns if name != 'timestamp'}
+        return Activity(self.timestamp[first:last], sport=self.sport, origin=self.origin, **columns)
+
+    def view(self):
+        """
+        Return the arrays as a DataFrame without copying them: the
+        timestamp as datetime64[ns], the positions as deltas from
+        origin and the MISSING and POWER_MISSING sentinels as is.
+        """
+        data = {name: getattr(self, name) for name in self.columns}
+        data['timestamp'] = self.timestamp.view('datetime64[ns]')
+        return pd.DataFrame(data, copy=False)
+
+    def to_dataframe(self):
+        """
+        Return the decoded trackpoints with the load_workout columns:
+        naive UTC timestamp, latitude and longitude degrees, and
+        float64 columns with NaN for absent values.
+        """
+        data = {'timestamp': self.timestamp.view('datetime64[ns]')}
+        for name in self.columns[1:]:
+            values = getattr(self, name)
+            if name in ('lat_delta', 'lon_delta'):
+                axis = 0 if name == 'lat_delta' else 1
+                data[('latitude', 'longitude')[axis]] = self.origin[axis] + values.astype(np.float64)
+            elif values.dtype.kind in 'iu':
+                missing = POWER_MISSING if name == 'power' else MISSING
+                data[name] = np.where(values == missing, np.nan, values)
+            else:
+                data[name] = values.astype(np.float64)
+        return pd.DataFrame(data)
+
+    def laps_dataframe(self):
+        """
+        Return a summary of every lap: start, duration (s), distance (m),
+        average and maximum heart rate, average power and cadence.
+        """
+        workout = self.to_dataframe()
+        rows = []
+        for first, last in zip(self.laps[:-1], self.laps[1:]):
+            lap = workout.iloc[first:last]
+            row = {'start': lap['timestamp'].min(),
+                   'duration (s)': (lap['timestamp'].max() - lap['timestamp'].min()).total_seconds()}
+            if 'distance' in lap:
+                row['distance (m)'] = lap['distance'].max() - lap['distance'].min()
+            if 'heart_rate' in lap:
+                row['avg hr'] = lap['heart_rate'].mean()
+                row['max hr'] = lap['heart_rate'].max()
+            if 'power' in lap:
+                row['avg power'] = lap['power'].mean()
+            if 'cadence' in lap:
+                row['avg cadence'] = lap['cadence'].mean()
+            rows.append(row)
+        return pd.DataFrame(rows)
+
+
+def _encode_int_(values, dtype, missing):
+
+    values = np.asarray(values, dtype=np.float64)
+    # Sensor values are not negative, and never the sentinel
+    high = np.iinfo(dtype).max - (missing == np.iinfo(dtype).max)
+    absent = np.isnan(values)
+    encoded = np.clip(np.rint(np.where(absent, 0, values)), 0, high).astype(dtype)
+    encoded[absent] = missing
+    return encoded
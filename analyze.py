@@ -1,29 +1,14 @@
-from fitparse import FitFile
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 
-# Load the fitfile
-fitfile = FitFile('./stair/5272936472.fit')
+import fitrecords
 
-# This is a ugly hack
-# to avoid timing issues
-while True:
-    try:
-        fitfile.messages
-        break
-    except KeyError:
-        continue
-
-# Get all data messages that are of type record
-workout = []
-for record in fitfile.get_messages('record'):
-    r = {}
-    # Go through all the data entries in this record
-    for record_data in record:
-        r[record_data.name] = record_data.value
-
-    workout.append(r)
+# Load the record messages of the fitfile,
+# which may also be a .fit.gz or an original
+# Garmin zip, decoding only the wanted fields
+workout = fitrecords.read_records('./stair/5272936472.fit',
+                                  ['timestamp', 'heart_rate', 'cadence', 'distance'])
 
 df = pd.DataFrame(workout)
 
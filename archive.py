@@ -0,0 +1,344 @@
+"""
+Partitioned columnar archive of activities.
+
+ingest() parses the TCX and FIT activities of a directory once
+(see loader.load_activity) and writes their trackpoints and laps as
+Parquet files, one per activity, partitioned by athlete, sport and
+month of the activity start:
+
+    <root>/trackpoints/athlete=me/sport=Biking/month=2020-07/5173186556.parquet
+    <root>/laps/athlete=me/sport=Biking/month=2020-07/5173186556.parquet
+
+A manifest of the ingested sources, like the PMC ledger, lets later
+runs skip the files whose size and modification time are unchanged.
+
+query() reads the memory mapped dataset with column projection and
+predicate pushdown: the date range and sport prune whole partitions,
+and the heart rate and power bounds skip the files whose Parquet
+statistics are out of range, e.g. all rides above 300 W in 2020:
+
+    query(root, ['activity_id', 'timestamp', 'power'], sport='Biking',
+          start='2020-01-01', end='2020-12-31', power=(300, None))
+
+pyarrow is only imported by the functions using it.
+"""
+
+import functools
+import operator
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+import instrument
+from activity import MISSING, POWER_MISSING
+from loader import find_activities, load_activity
+
+TRACKPOINTS = 'trackpoints'
+LAPS = 'laps'
+PARTITIONS = ['athlete', 'sport', 'month']
+MANIFEST = 'manifest.csv'
+MANIFEST_COLUMNS = ['path', 'size', 'mtime', 'activity_id'] + PARTITIONS
+UNKNOWN_SPORT = 'Other'
+
+# Columns of the tables, by name: (Arrow type name, NumPy dtype)
+TRACKPOINT_COLUMNS = {
+    'activity_id': ('string', object),
+    'timestamp': ('timestamp[ns]', 'datetime64[ns]'),
+    'lap': ('int16', np.int16),
+    'latitude': ('float64', np.float64),
+    'longitude': ('float64', np.float64),
+    'altitude': ('float32', np.float32),
+    'distance': ('float32', np.float32),
+    'speed': ('float32', np.float32),
+    'heart_rate': ('int16', np.int16),
+    'cadence': ('int16', np.int16),
+    'power': ('uint16', np.uint16),
+}
+LAP_COLUMNS = {
+    'activity_id': ('string', object),
+    'lap': ('int16', np.int16),
+    'start': ('timestamp[ns]', 'datetime64[ns]'),
+    'duration': ('float32', np.float32),
+    'distance': ('float32', np.float32),
+    'avg_heart_rate': ('float32', np.float32),
+    'max_heart_rate': ('float32', np.float32),
+    'avg_power': ('float32', np.float32),
+    'avg_cadence': ('float32', np.float32),
+}
+# Activity.laps_dataframe columns translated to the LAP_COLUMNS
+LAP_NAMES = {
+    'start': 'start',
+    'duration (s)': 'duration',
+    'distance (m)': 'distance',
+    'avg hr': 'avg_heart_rate',
+    'max hr': 'max_heart_rate',
+    'avg power': 'avg_power',
+    'avg cadence': 'avg_cadence',
+}
+
+# Columns of the date range and of the heart rate and power bounds
+FILTER_COLUMNS = {
+    TRACKPOINTS: {'time': 'timestamp', 'heart_rate': 'heart_rate', 'power': 'power'},
+    LAPS: {'time': 'start', 'heart_rate': 'avg_heart_rate', 'power': 'avg_power'},
+}
+
+athlete = 'me'
+workers = os.cpu_count()  # Processes parsing the activities
+chunksize = 4  # Activities submitted to a worker at once
+
+
+def _schema_(columns):
+
+    import pyarrow as pa
+
+    return pa.schema([(name, pa.type_for_alias(arrow_type)) for name, (arrow_type, _) in columns.items()])
+
+
+def _partitioning_():
+
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    return ds.partitioning(pa.schema([(name, pa.string()) for name in PARTITIONS]), flavor='hive')
+
+
+def trackpoints_table(activity, activity_id):
+    """
+    Return the trackpoints of an Activity as an Arrow table of
+    TRACKPOINT_COLUMNS, the absent values as nulls.
+    """
+    import pyarrow as pa
+
+    size = len(activity)
+    arrays = {
+        'activity_id': pa.array(np.full(size, activity_id, dtype=object), pa.string()),
+        'timestamp': pa.array(activity.timestamp.view('datetime64[ns]'), pa.timestamp('ns'), from_pandas=True),
+        'lap': pa.array(activity.lap_index().astype(np.int16)),
+    }
+    decoded = activity.to_dataframe()
+    for name, (arrow_type, dtype) in TRACKPOINT_COLUMNS.items():
+        if name in arrays:
+            continue
+        if name in ('heart_rate', 'cadence', 'power') and getattr(activity, name) is not None:
+            # The narrow arrays, with their sentinels as nulls
+            values = getattr(activity, name)
+            missing = POWER_MISSING if name == 'power' else MISSING
+            arrays[name] = pa.array(values, pa.type_for_alias(arrow_type), mask=values == missing)
+        elif name in decoded:
+            values = decoded[name].to_numpy(dtype=dtype)
+            arrays[name] = pa.array(values, pa.type_for_alias(arrow_type), mask=np.isnan(values))
+        else:
+            arrays[name] = pa.nulls(size, pa.type_for_alias(arrow_type))
+    return pa.table(arrays, schema=_schema_(TRACKPOINT_COLUMNS))
+
+
+def laps_table(activity, activity_id):
+    """
+    Return the lap summaries of an Activity as an Arrow table of LAP_COLUMNS.
+    """
+    import pyarrow as pa
+
+    laps = activity.laps_dataframe().rename(columns=LAP_NAMES)
+    laps.insert(0, 'lap', np.arange(len(laps), dtype=np.int16))
+    laps.insert(0, 'activity_id', activity_id)
+    for name, (_, dtype) in LAP_COLUMNS.items():
+        laps[name] = laps[name].astype(dtype) if name in laps else pd.Series(np.nan, laps.index, dtype)
+    return pa.Table.from_pandas(laps[list(LAP_COLUMNS)], schema=_schema_(LAP_COLUMNS), preserve_index=False)
+
+
+def _write_parquet_(table, path):
+
+    import pyarrow.parquet as pq
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Dot files are ignored by the dataset discovery
+    tmp_path = os.path.join(os.path.dirname(path), '.' + os.path.basename(path) + '.tmp')
+    pq.write_table(table, tmp_path, compression='zstd')
+    os.replace(tmp_path, path)
+
+
+def partition_path(root, table, activity_id, athlete, sport, month):
+    """
+    The Parquet file of an activity in a table of the archive.
+    """
+    return os.path.join(root, table, 'athlete=%s' % athlete, 'sport=%s' % sport, 'month=%s' % month,
+                        '%s.parquet' % activity_id)
+
+
+def ingest_activity(item, root, athlete=athlete, sport=None):
+    """
+    Write the trackpoints and laps of one activity into the archive.
+    Runs in the worker processes of ingest.
+    :param item: (activity id, path of its TCX or FIT file)
+    :param sport: overrides the sport of the file
+    :return (activity id, path, sport, month, error or None):
+    """
+    activity_id, path = item
+    try:
+        activity = load_activity(path)
+        start = activity.start
+        if start is None:
+            raise ValueError("No timestamps")
+        sport = sport or activity.sport or UNKNOWN_SPORT
+        month = start.strftime('%Y-%m')
+        with instrument.span('archive.write'):
+            _write_parquet_(trackpoints_table(activity, activity_id),
+                            partition_path(root, TRACKPOINTS, activity_id, athlete, sport, month))
+            _write_parquet_(laps_table(activity, activity_id),
+                            partition_path(root, LAPS, activity_id, athlete, sport, month))
+    except Exception as err:  # pylint: disable=broad-except
+        return activity_id, path, None, None, '%s: %s' % (type(err).__name__, err)
+    instrument.count('archive.trackpoints', len(activity))
+    return activity_id, path, sport, month, None
+
+
+def load_manifest(root):
+    """
+    Loads the manifest of the ingested sources, indexed by file path.
+    """
+    path = os.path.join(root, MANIFEST)
+    if not os.path.exists(path):
+        return pd.DataFrame(columns=MANIFEST_COLUMNS).set_index('path')
+    return pd.read_csv(path, index_col='path', dtype={'activity_id': str, 'month': str})
+
+
+def ingest(directory, root, athlete=athlete, sport=None, max_workers=None, chunksize=chunksize):
+    """
+    Incrementally ingest the TCX and FIT activities of a directory
+    (a FIT preferred to the TCX of the same activity, as the PMC reads
+    them) into the archive at root. Sources whose size or modification
+    time changed replace their previous files, as does the new source
+    of an activity ingested from another file; sources no longer in
+    the directory are kept.
+    :return list of ingest_activity results of the new or changed sources:
+    """
+    manifest = load_manifest(root)
+    files = {}
+    for activity_id, sources in find_activities(directory, prefer='.fit').items():
+        if 'track' in sources:
+            stat = os.stat(sources['track'])
+            files[sources['track']] = (activity_id, stat.st_size, stat.st_mtime_ns)
+
+    stale = [(activity_id, path) for path, (activity_id, size, mtime) in sorted(files.items())
+             if path not in manifest.index
+             or (manifest.loc[path, 'size'], manifest.loc[path, 'mtime']) != (size, mtime)
+             or manifest.loc[path, 'athlete'] != athlete]
+    instrument.count('archive.files_unchanged', len(files) - len(stale))
+    # Activities now read from another of their files
+    replaced = manifest.index[manifest['activity_id'].isin([activity_id for activity_id, _ in stale])
+                              & ~manifest.index.isin(list(files))]
+    dropped = [path for _, path in stale if path in manifest.index] + list(replaced)
+    for path in dropped:
+        previous = manifest.loc[path]
+        for table in (TRACKPOINTS, LAPS):
+            old = partition_path(root, table, previous['activity_id'], *previous[PARTITIONS])
+            if os.path.exists(old):
+                os.remove(old)
+    manifest = manifest.drop(dropped)
+
+    write = functools.partial(ingest_activity, root=root, athlete=athlete, sport=sport)
+    with instrument.span('archive.ingest'):
+        if max_workers == 1:
+            results = list(tqdm(map(write, stale), total=len(stale)))
+        else:
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                results = list(tqdm(executor.map(write, stale, chunksize=chunksize), total=len(stale)))
+
+    added = [(path, files[path][1], files[path][2], activity_id, athlete, activity_sport, month)
+             for activity_id, path, activity_sport, month, error in results if error is None]
+    if added:
+        added = pd.DataFrame(added, columns=MANIFEST_COLUMNS).set_index('path')
+        manifest = pd.concat([manifest, added]).sort_index()
+    instrument.count('archive.files_ingested', len(added))
+
+    os.makedirs(root, exist_ok=True)
+    tmp_path = os.path.join(root, MANIFEST + '.tmp')
+    manifest.to_csv(tmp_path)
+    os.replace(tmp_path, os.path.join(root, MANIFEST))
+    return results
+
+
+def dataset(root, table=TRACKPOINTS):
+    """
+    Return a table of the archive as a memory mapped pyarrow Dataset,
+    with the athlete, sport and month partition columns.
+    """
+    import pyarrow.dataset as ds
+    from pyarrow import fs
+
+    if table not in FILTER_COLUMNS:
+        raise ValueError("Unknown archive table %s" % table)
+    path = os.path.join(root, table)
+    if not os.path.isdir(path):
+        raise FileNotFoundError("No %s in the archive %s" % (table, root))
+    # Every file is written with the same schema
+    return ds.dataset(path, format='parquet', partitioning=_partitioning_(),
+                      filesystem=fs.LocalFileSystem(use_mmap=True))
+
+
+def _bounds_(field, bounds):
+
+    low, high = bounds
+    expressions = []
+    if low is not None:
+        expressions.append(field >= low)
+    if high is not None:
+        expressions.append(field <= high)
+    return expressions
+
+
+def query(root, columns=None, start=None, end=None, sport=None, athlete=None,
+          heart_rate=None, power=None, table=TRACKPOINTS, where=None):
+    """
+    Read rows of the archive with projection and predicate pushdown.
+
+    Parameters
+    ----------
+    root : string, the archive directory
+    columns : list of the columns to read, all of them if None
+    start, end : dates (or strings), the inclusive date range
+    sport, athlete : string or list of strings
+    heart_rate, power : (low, high) inclusive bounds, None for no bound,
+                        of the samples, or of the lap averages for laps
+    table : TRACKPOINTS or LAPS
+    where : an additional pyarrow.dataset expression
+
+    Returns
+    -------
+    DataFrame of the matching rows, timestamps in naive UTC
+    """
+    import pyarrow.dataset as ds
+
+    names = FILTER_COLUMNS.get(table)
+    if names is None:
+        raise ValueError("Unknown archive table %s" % table)
+
+    expressions = []
+    for name, values in [('sport', sport), ('athlete', athlete)]:
+        if values is not None:
+            values = [values] if isinstance(values, str) else list(values)
+            expressions.append(ds.field(name).isin(values))
+    time = ds.field(names['time'])
+    if start is not None:
+        start = pd.Timestamp(start)
+        expressions += [ds.field('month') >= start.strftime('%Y-%m'), time >= start.to_datetime64()]
+    if end is not None:
+        end = pd.Timestamp(end)
+        # The whole end day is in the range
+        expressions += [ds.field('month') <= end.strftime('%Y-%m'),
+                        time < (end.normalize() + pd.Timedelta(days=1)).to_datetime64()]
+    if heart_rate is not None:
+        expressions += _bounds_(ds.field(names['heart_rate']), heart_rate)
+    if power is not None:
+        expressions += _bounds_(ds.field(names['power']), power)
+    if where is not None:
+        expressions.append(where)
+    expression = functools.reduce(operator.and_, expressions) if expressions else None
+
+    with instrument.span('archive.query'):
+        result = dataset(root, table).to_table(columns=columns, filter=expression)
+    instrument.count('archive.rows', result.num_rows)
+    return result.to_pandas()
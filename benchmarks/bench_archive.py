@@ -0,0 +1,32 @@
+"""
+Queries of the Parquet archive of activities.
+"""
+
+import os
+
+import archive
+
+from . import synthetic
+
+# Activities of the archive, 5000 for production sized runs
+ARCHIVE_FILES = int(os.environ.get('BENCH_ARCHIVE_FILES', 200))
+
+
+class ArchiveQuery(object):
+    timeout = 600
+
+    def setup(self):
+        self.root = os.path.join(synthetic.DATA_DIR, 'store_%d' % ARCHIVE_FILES)
+        # Unchanged files are skipped after the first run
+        archive.ingest(synthetic.cached_archive(ARCHIVE_FILES), self.root)
+
+    def time_power_above(self):
+        # All the rides above 300 W in 2020
+        archive.query(self.root, ['activity_id', 'timestamp', 'power'], start='2020-01-01', end='2020-12-31',
+                      sport='Biking', power=(300, None))
+
+    def time_heart_rate_laps(self):
+        archive.query(self.root, table=archive.LAPS, heart_rate=(150, None))
+
+    def time_projection(self):
+        archive.query(self.root, ['timestamp', 'heart_rate'])
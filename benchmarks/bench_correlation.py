@@ -0,0 +1,36 @@
+"""
+Online correlation of the activity metrics of an archive.
+"""
+
+import pandas as pd
+
+import correlation
+
+from . import synthetic
+
+COLUMNS = ['hr', 'speed', 'power', 'cadence']
+
+
+class OnlineCorrelation(object):
+    params = [50, 500]
+    param_names = ['activities']
+
+    def setup(self, activities):
+        self.frames = [pd.DataFrame({name: synthetic.ride(3600, seed)[name] for name in COLUMNS})
+                       for seed in range(activities)]
+        self.accumulators = [correlation.Correlation(COLUMNS).update(frame) for frame in self.frames]
+        self.times = pd.date_range('2020-01-01', periods=activities, freq='D')
+        self.total = correlation.combine(self.accumulators)
+
+    def time_concat_corr(self, activities):
+        # Everything recomputed, as get_number would
+        pd.concat(self.frames).corr()
+
+    def time_update_one(self, activities):
+        self.total.copy().update(self.frames[-1])
+
+    def time_combine(self, activities):
+        correlation.combine(self.accumulators).corr()
+
+    def time_rolling_corr(self, activities):
+        correlation.rolling_corr(zip(self.times, self.accumulators), '42D')
@@ -0,0 +1,55 @@
+"""
+Rendering of the graph.py charts with the Agg backend.
+"""
+
+import io
+
+import matplotlib
+import numpy as np
+import pandas as pd
+
+import correlation
+import graph
+import report
+
+from . import synthetic
+
+matplotlib.use('Agg')
+
+
+def _render_(chart):
+
+    report.render(chart, io.BytesIO(), report.WIDE)
+
+
+class Graph(object):
+    params = [3600, 100000]
+    param_names = ['trackpoints']
+
+    def setup(self, trackpoints):
+        data = synthetic.ride(trackpoints)
+        index = pd.to_datetime(data['time'], unit='s')
+        self.tracks = pd.DataFrame({name: data[name] for name in ('hr', 'speed', 'power', 'cadence')},
+                                   index=index)
+
+    def time_heartrate(self, trackpoints):
+        _render_(lambda ax: graph.heartrate(self.tracks['hr'], ax=ax))
+
+    def time_overlay_timeseries(self, trackpoints):
+        _render_(lambda ax: graph.overlay_timeseries(self.tracks[['hr', 'power']], ax=ax))
+
+    def time_scatter(self, trackpoints):
+        _render_(lambda ax: graph.scatter(self.tracks['speed'], self.tracks['hr'], ax=ax))
+
+
+class LapGraph(object):
+
+    def setup(self):
+        self.laps = pd.DataFrame(np.random.RandomState(0).rand(30, 6) + 1,
+                                 columns=['Avg HR', 'Max HR', 'Calories', 'Avg Speed', 'Power (w)', 'Energy (kj)'])
+
+    def time_mean(self):
+        _render_(lambda ax: graph.mean(self.laps, ax=ax))
+
+    def time_heatmap(self):
+        _render_(lambda ax: correlation.heatmap(correlation.get_number(self.laps), ax=ax))
@@ -0,0 +1,64 @@
+"""
+Parsing of TCX, FIT and lap CSV files.
+"""
+
+import pandas as pd
+
+import fitrecords
+import helper
+import lapcsv
+from loader import load_activity, load_workout
+from tcxtools import TCXPandas
+
+from . import synthetic
+
+
+class TCXParse(object):
+    params = [1000, 10000, 100000]
+    param_names = ['trackpoints']
+
+    def setup(self, trackpoints):
+        self.path = synthetic.cached_tcx(trackpoints)
+
+    def time_parse(self, trackpoints):
+        TCXPandas(self.path).parse()
+
+    def time_parse_chunks(self, trackpoints):
+        for _ in TCXPandas(self.path).parse_chunks():
+            pass
+
+
+class FITRecords(object):
+    params = [3600, 100000]
+    param_names = ['trackpoints']
+
+    def setup(self, trackpoints):
+        self.path = synthetic.cached_fit(trackpoints)
+
+    def time_read_records(self, trackpoints):
+        fitrecords.read_records(self.path)
+
+    def time_read_tss_fields(self, trackpoints):
+        fitrecords.read_records(self.path, ['timestamp', 'heart_rate', 'power'])
+
+    def time_load_workout(self, trackpoints):
+        load_workout(self.path)
+
+    def time_load_activity(self, trackpoints):
+        load_activity(self.path)
+
+
+class LapCSV(object):
+    params = [20, 2000]
+    param_names = ['laps']
+
+    def setup(self, laps):
+        self.path = synthetic.cached_laps_csv(laps)
+
+    def time_get_sec(self, laps):
+        # As the report notebooks do
+        laps_df = pd.read_csv(self.path)
+        laps_df['Time (s)'] = laps_df['Time'].apply(helper.get_sec)
+
+    def time_read_laps(self, laps):
+        lapcsv.read_laps(self.path)
@@ -0,0 +1,56 @@
+"""
+Training Stress Score of a workout and the PMC of an archive.
+"""
+
+import datetime
+import os
+import tempfile
+
+import pmc
+import zones
+from loader import load_workout
+
+from . import synthetic
+
+# Files of the PMC archive, 5000 for production sized runs
+ARCHIVE_FILES = int(os.environ.get('BENCH_ARCHIVE_FILES', 200))
+FIRST_DATE = datetime.date(2019, 1, 1)
+LAST_DATE = datetime.date(2040, 1, 1)
+
+
+class TSS(object):
+    params = [3600, 100000]
+    param_names = ['trackpoints']
+
+    def setup(self, trackpoints):
+        self.workout = load_workout(synthetic.cached_fit(trackpoints), pmc.fields)
+
+    def time_get_tss(self, trackpoints):
+        pmc.get_tss(self.workout)
+
+    def time_get_hr_tss(self, trackpoints):
+        pmc.get_hr_tss(self.workout)
+
+    def time_summarize(self, trackpoints):
+        zones.summarize(self.workout)
+
+
+class PMC(object):
+    params = [1, os.cpu_count()]
+    param_names = ['workers']
+    timeout = 600
+
+    def setup(self, workers):
+        self.directory = synthetic.cached_archive(ARCHIVE_FILES)
+        self.ledger = os.path.join(tempfile.mkdtemp(), 'ledger.csv')
+        self.pmc = os.path.join(os.path.dirname(self.ledger), 'pmc.csv')
+        pmc.update_pmc(self.directory, FIRST_DATE, LAST_DATE, max_workers=workers,
+                       ledger_path=self.ledger, pmc_path=self.pmc)
+
+    def time_build_pmc(self, workers):
+        pmc.build_pmc(self.directory, FIRST_DATE, LAST_DATE, max_workers=workers)
+
+    def time_update_pmc_unchanged(self, workers):
+        # Nothing changed since setup, only the ledger is read
+        pmc.update_pmc(self.directory, FIRST_DATE, LAST_DATE, max_workers=workers,
+                       ledger_path=self.ledger, pmc_path=self.pmc)
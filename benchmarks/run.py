@@ -0,0 +1,169 @@
+"""
+Run the benchmarks without asv and track their results over time.
+
+Every time_* method of the classes of the bench_* modules is timed
+(best of REPEAT calls) for each of its params. The results are
+appended to a JSON lines history with the commit and the machine,
+and compared with the previous run of the same machine: a benchmark
+slower than --threshold times its previous time is a regression.
+A benchmark that raises is reported as failed and left out of the
+history, without stopping the others.
+
+Usage: python -m benchmarks.run [-k filter] [--quick] [--history file]
+"""
+
+import argparse
+import datetime
+import importlib
+import inspect
+import itertools
+import json
+import os
+import pkgutil
+import platform
+import subprocess
+import sys
+import timeit
+
+REPEAT = 5
+THRESHOLD = 1.25  # Slowdown ratio reported as a regression
+HISTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results', 'history.jsonl')
+
+
+def _commit_():
+
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def discover():
+    """
+    Yield (name, class, None) of every benchmark class, in module
+    order, or (module name, None, error) of a module failing to import.
+    """
+    package = os.path.dirname(os.path.abspath(__file__))
+    for module_info in sorted(pkgutil.iter_modules([package]), key=lambda info: info.name):
+        if not module_info.name.startswith('bench_'):
+            continue
+        try:
+            module = importlib.import_module(__package__ + '.' + module_info.name)
+        except Exception as err:  # pylint: disable=broad-except
+            yield module_info.name, None, err
+            continue
+        for name, cls in inspect.getmembers(module, inspect.isclass):
+            if cls.__module__ == module.__name__ and any(attr.startswith('time_') for attr in dir(cls)):
+                yield module_info.name + '.' + name, cls, None
+
+
+def run(cls, name, pattern=None, quick=False, repeat=REPEAT):
+    """
+    Yield (benchmark name, params, best seconds, None) of the time_*
+    methods of a benchmark class, or (benchmark name, params, None,
+    error) of those raising, in setup or when timed. quick only runs
+    the first params.
+    """
+    params = getattr(cls, 'params', None)
+    if params is None:
+        combinations = [()]
+    else:
+        grid = params if params and isinstance(params[0], (list, tuple)) else [params]
+        combinations = list(itertools.product(*grid))
+    if quick:
+        combinations = combinations[:1]
+
+    methods = [attr for attr in sorted(dir(cls)) if attr.startswith('time_')
+               and (pattern is None or pattern in name + '.' + attr)]
+    if not methods:
+        return
+    for combination in combinations:
+        benchmark = cls()
+        try:
+            if hasattr(benchmark, 'setup'):
+                benchmark.setup(*combination)
+        except Exception as err:  # pylint: disable=broad-except
+            for method in methods:
+                yield '%s.%s' % (name, method), list(combination), None, err
+            continue
+        try:
+            for method in methods:
+                function = getattr(benchmark, method)
+                try:
+                    seconds = min(timeit.repeat(lambda: function(*combination), number=1, repeat=repeat))
+                except Exception as err:  # pylint: disable=broad-except
+                    yield '%s.%s' % (name, method), list(combination), None, err
+                    continue
+                yield '%s.%s' % (name, method), list(combination), seconds, None
+        finally:
+            if hasattr(benchmark, 'teardown'):
+                benchmark.teardown(*combination)
+
+
+def load_previous(history, machine):
+    """
+    Return the {(benchmark, params): seconds} of the last run on machine.
+    """
+    last_run, previous = None, {}
+    if not os.path.exists(history):
+        return previous
+    with open(history) as history_file:
+        for line in history_file:
+            result = json.loads(line)
+            if result['machine'] != machine:
+                continue
+            if result['run'] != last_run:
+                last_run, previous = result['run'], {}
+            previous[(result['benchmark'], json.dumps(result['params']))] = result['seconds']
+    return previous
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run the benchmarks and track their results.')
+    parser.add_argument('-k', dest='pattern', help='only the benchmarks whose name contains it')
+    parser.add_argument('--quick', action='store_true', help='only the smallest params')
+    parser.add_argument('--repeat', type=int, default=REPEAT)
+    parser.add_argument('--history', default=HISTORY, help='JSON lines results history')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD)
+    parser.add_argument('--no-save', action='store_true', help='do not append to the history')
+    args = parser.parse_args(argv)
+
+    machine = platform.node()
+    previous = load_previous(args.history, machine)
+    run_id = datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds')
+    commit = _commit_()
+
+    results, regressions, failures = [], [], []
+    for name, cls, error in discover():
+        if error is not None:
+            failures.append(name)
+            print('%-50s %-12s FAILED %s: %s' % (name, '', type(error).__name__, error))
+            continue
+        for benchmark, params, seconds, error in run(cls, name, args.pattern, args.quick, args.repeat):
+            if error is not None:
+                failures.append(benchmark)
+                print('%-50s %-12s FAILED %s: %s' % (benchmark, ','.join(map(str, params)),
+                                                     type(error).__name__, error))
+                sys.stdout.flush()
+                continue
+            before = previous.get((benchmark, json.dumps(params)))
+            ratio = '' if before is None else '%5.2fx' % (seconds / before)
+            if before is not None and seconds > before * args.threshold:
+                regressions.append(benchmark)
+                ratio += ' REGRESSION'
+            print('%-50s %-12s %10.4f s %s' % (benchmark, ','.join(map(str, params)), seconds, ratio))
+            sys.stdout.flush()
+            results.append({'run': run_id, 'commit': commit, 'machine': machine,
+                            'python': platform.python_version(), 'benchmark': benchmark,
+                            'params': params, 'seconds': seconds})
+
+    if not args.no_save and results:
+        os.makedirs(os.path.dirname(os.path.abspath(args.history)), exist_ok=True)
+        with open(args.history, 'a') as history_file:
+            history_file.writelines(json.dumps(result) + '\n' for result in results)
+    return 1 if regressions or failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
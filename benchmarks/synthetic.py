@@ -0,0 +1,352 @@
+"""
+Deterministic generators of synthetic activities.
+
+TCX, FIT and Garmin lap CSV files of any size are written from a
+seeded random ride (1 Hz samples with smart recording gaps and a
+pause), so benchmarks run on production sized inputs without
+shipping them. The same arguments always produce the same bytes,
+and cached_* return a generated file, creating it only once.
+
+Usage: python -m benchmarks.synthetic {tcx,fit,csv,archive} PATH [-n SIZE]
+"""
+
+import argparse
+import datetime
+import os
+import struct
+import tempfile
+
+import numpy as np
+
+DATA_DIR = os.environ.get('BENCH_DATA', os.path.join(tempfile.gettempdir(), 'garmin-parser-bench'))
+START = datetime.datetime(2020, 1, 1, 6, 0, tzinfo=datetime.timezone.utc)
+ORIGIN = (-15.7939, -47.8828)  # Brasília
+LAP_SECONDS = 600
+
+FIT_EPOCH = 631065600  # 1989-12-31 00:00 UTC as a unix timestamp
+SEMICIRCLES = 2 ** 31 / 180.0
+
+# FIT messages written: (local number, global number, fields as (number, numpy type, base type))
+FIT_FILE_ID = (0, 0, [(0, 'u1', 0x00), (1, '<u2', 0x84), (4, '<u4', 0x86)])
+FIT_RECORD = (1, 20, [(253, '<u4', 0x86), (0, '<i4', 0x85), (1, '<i4', 0x85), (2, '<u2', 0x84),
+                      (3, 'u1', 0x02), (4, 'u1', 0x02), (5, '<u4', 0x86), (6, '<u2', 0x84),
+                      (7, '<u2', 0x84)])
+FIT_LAP = (2, 19, [(253, '<u4', 0x86), (2, '<u4', 0x86), (7, '<u4', 0x86), (9, '<u4', 0x86)])
+FIT_SESSION = (3, 18, [(253, '<u4', 0x86), (2, '<u4', 0x86), (5, 'u1', 0x00)])
+FIT_CYCLING = 2  # Sport enum value
+
+# CRC-16 of the FIT protocol, one table entry per byte
+CRC_TABLE = []
+for _byte in range(256):
+    _crc = _byte
+    for _ in range(8):
+        _crc = (_crc >> 1) ^ 0xA001 if _crc & 1 else _crc >> 1
+    CRC_TABLE.append(_crc)
+
+LAP_COLUMNS = {
+    'cycling': ['Laps', 'Time', 'Cumulative Time', 'Distance', 'Avg Speed', 'Avg HR', 'Max HR', 'Elev Gain',
+                'Elev Loss', 'Calories', 'Max Speed', 'Moving Time', 'Avg Moving Speed'],
+    'rowing': ['Laps', 'Time', 'Cumulative Time', 'Distance', 'Avg Pace', 'Avg HR', 'Max HR', 'Avg Stroke Rate',
+               'Max Stroke Rate', 'Calories', 'Moving Time'],
+    'stairs': ['Laps', 'Time', 'Cumulative Time', 'Distance', 'Avg Speed', 'Avg HR', 'Max HR', 'Calories',
+               'Moving Time'],
+}
+
+
+def ride(trackpoints, seed=0, start=START):
+    """
+    Return a synthetic ride of trackpoints samples as a dict of arrays:
+    'time' (unix seconds), 'latitude', 'longitude' (degrees), 'altitude',
+    'distance' (m), 'speed' (m/s), 'hr', 'cadence' and 'power'.
+    """
+    random = np.random.RandomState(seed)
+    # 1 s samples, some 2-3 s smart recording gaps and a 5 minute pause
+    steps = random.choice([1, 1, 1, 1, 1, 1, 2, 3], size=trackpoints)
+    steps[trackpoints // 2] = 300
+    steps[0] = 0
+    time = int(start.timestamp()) + np.cumsum(steps)
+
+    def smooth(scale, size=trackpoints):
+        walk = np.cumsum(random.randn(size)) * scale
+        return walk - np.linspace(0, walk[-1], size)
+
+    speed = np.clip(8.0 + smooth(0.05), 1.0, 18.0)
+    distance = np.cumsum(speed * np.minimum(steps, 3))
+    heading = np.cumsum(random.randn(trackpoints) * 0.05)
+    north = np.cumsum(np.cos(heading) * speed * np.minimum(steps, 3))
+    east = np.cumsum(np.sin(heading) * speed * np.minimum(steps, 3))
+    latitude = ORIGIN[0] + north / 111320.0
+    longitude = ORIGIN[1] + east / (111320.0 * np.cos(np.radians(ORIGIN[0])))
+    power = np.clip(120 + 18 * speed + smooth(0.8) + random.randn(trackpoints) * 15, 0, 1200)
+
+    return {
+        'time': time,
+        'latitude': latitude,
+        'longitude': longitude,
+        'altitude': 1100.0 + smooth(0.2),
+        'distance': distance,
+        'speed': speed,
+        'hr': np.clip(np.round(120 + 3 * speed + smooth(0.3) + random.randn(trackpoints)), 60, 200).astype(int),
+        'cadence': np.clip(np.round(85 + random.randn(trackpoints) * 4), 0, 150).astype(int),
+        'power': np.round(power).astype(int),
+    }
+
+
+def _laps_(time):
+
+    # Index of the first sample of every lap of LAP_SECONDS
+    elapsed = time - time[0]
+    return np.flatnonzero(np.diff(elapsed // LAP_SECONDS, prepend=-1))
+
+
+def _isoformat_(seconds):
+
+    return np.datetime_as_string(seconds.astype('datetime64[s]'), unit='s')
+
+
+def write_tcx(path, trackpoints, seed=0, start=START, sport='Biking'):
+    """
+    Write a TCX activity of trackpoints samples in laps of LAP_SECONDS,
+    with position, altitude, distance, HR, cadence, speed and power.
+    """
+    data = ride(trackpoints, seed, start)
+    times = _isoformat_(data['time'])
+    starts = list(_laps_(data['time'])) + [trackpoints]
+
+    with open(path, 'w', encoding='utf-8') as tcx:
+        tcx.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                  '<TrainingCenterDatabase'
+                  ' xmlns="http://www.garmin.com/xmlschemas/TrainingCenterDatabase/v2"'
+                  ' xmlns:ns3="http://www.garmin.com/xmlschemas/ActivityExtension/v2">\n'
+                  '  <Activities>\n    <Activity Sport="%s">\n      <Id>%s.000Z</Id>\n' % (sport, times[0]))
+        for first, last in zip(starts[:-1], starts[1:]):
+            lap = slice(first, last)
+            seconds = int(data['time'][last - 1] - data['time'][first])
+            tcx.write('      <Lap StartTime="%s.000Z">\n'
+                      '        <TotalTimeSeconds>%d.0</TotalTimeSeconds>\n'
+                      '        <DistanceMeters>%.1f</DistanceMeters>\n'
+                      '        <MaximumSpeed>%.3f</MaximumSpeed>\n'
+                      '        <Calories>%d</Calories>\n'
+                      '        <AverageHeartRateBpm><Value>%d</Value></AverageHeartRateBpm>\n'
+                      '        <MaximumHeartRateBpm><Value>%d</Value></MaximumHeartRateBpm>\n'
+                      '        <Intensity>Active</Intensity>\n'
+                      '        <TriggerMethod>Manual</TriggerMethod>\n'
+                      '        <Track>\n'
+                      % (times[first], seconds, data['distance'][last - 1] - data['distance'][first],
+                         data['speed'][lap].max(), data['power'][lap].sum() / 1000, data['hr'][lap].mean(),
+                         data['hr'][lap].max()))
+            tcx.writelines(
+                '          <Trackpoint>\n'
+                '            <Time>%s.000Z</Time>\n'
+                '            <Position><LatitudeDegrees>%.7f</LatitudeDegrees>'
+                '<LongitudeDegrees>%.7f</LongitudeDegrees></Position>\n'
+                '            <AltitudeMeters>%.1f</AltitudeMeters>\n'
+                '            <DistanceMeters>%.2f</DistanceMeters>\n'
+                '            <HeartRateBpm><Value>%d</Value></HeartRateBpm>\n'
+                '            <Cadence>%d</Cadence>\n'
+                '            <Extensions><ns3:TPX><ns3:Speed>%.3f</ns3:Speed>'
+                '<ns3:Watts>%d</ns3:Watts></ns3:TPX></Extensions>\n'
+                '          </Trackpoint>\n' % row
+                for row in zip(times[lap], data['latitude'][lap], data['longitude'][lap],
+                               data['altitude'][lap], data['distance'][lap], data['hr'][lap],
+                               data['cadence'][lap], data['speed'][lap], data['power'][lap]))
+            tcx.write('        </Track>\n      </Lap>\n')
+        tcx.write('    </Activity>\n  </Activities>\n</TrainingCenterDatabase>\n')
+    return path
+
+
+def fit_crc(data, crc=0):
+    """
+    Return the FIT CRC-16 of data, continuing from crc.
+    """
+    for byte in data:
+        crc = (crc >> 8) ^ CRC_TABLE[(crc ^ byte) & 0xFF]
+    return crc
+
+
+def _fit_definition_(message):
+
+    local, global_number, fields = message
+    definition = struct.pack('<BBBHB', 0x40 | local, 0, 0, global_number, len(fields))
+    for number, type_code, base_type in fields:
+        definition += struct.pack('BBB', number, np.dtype(type_code).itemsize, base_type)
+    return definition
+
+
+def _fit_messages_(message, columns):
+
+    local, _, fields = message
+    dtype = np.dtype([('header', 'u1')] + [('f%d' % number, type_code) for number, type_code, _ in fields])
+    rows = np.zeros(len(columns[0]), dtype=dtype)
+    rows['header'] = local
+    for (number, _, _), column in zip(fields, columns):
+        rows['f%d' % number] = column
+    return rows.tobytes()
+
+
+def write_fit(path, trackpoints, seed=0, start=START):
+    """
+    Write a FIT activity of trackpoints record messages (timestamp,
+    position, altitude, HR, cadence, distance, speed and power),
+    with a lap message every LAP_SECONDS and a cycling session message.
+    """
+    data = ride(trackpoints, seed, start)
+    timestamps = data['time'] - FIT_EPOCH
+    records = [timestamps,
+               np.round(data['latitude'] * SEMICIRCLES), np.round(data['longitude'] * SEMICIRCLES),
+               np.round((data['altitude'] + 500) * 5), data['hr'], data['cadence'],
+               np.round(data['distance'] * 100), np.round(data['speed'] * 1000), data['power']]
+
+    body = [_fit_definition_(FIT_FILE_ID), _fit_messages_(FIT_FILE_ID, [[4], [1], [timestamps[0]]]),
+            _fit_definition_(FIT_RECORD), _fit_definition_(FIT_LAP)]
+    starts = list(_laps_(data['time'])) + [trackpoints]
+    for first, last in zip(starts[:-1], starts[1:]):
+        body.append(_fit_messages_(FIT_RECORD, [column[first:last] for column in records]))
+        body.append(_fit_messages_(FIT_LAP, [[timestamps[last - 1]], [timestamps[first]],
+                                             [(timestamps[last - 1] - timestamps[first]) * 1000],
+                                             [round((data['distance'][last - 1] - data['distance'][first]) * 100)]]))
+    body.append(_fit_definition_(FIT_SESSION))
+    body.append(_fit_messages_(FIT_SESSION, [[timestamps[-1]], [timestamps[0]], [FIT_CYCLING]]))
+    body = b''.join(body)
+
+    header = struct.pack('<BBHI4s', 14, 0x10, 2093, len(body), b'.FIT')
+    header += struct.pack('<H', fit_crc(header))
+    with open(path, 'wb') as fit:
+        fit.write(header)
+        fit.write(body)
+        fit.write(struct.pack('<H', fit_crc(body, fit_crc(header))))
+    return path
+
+
+def _duration_(seconds):
+
+    seconds = int(round(seconds))
+    if seconds >= 3600:
+        return '%d:%02d:%02d' % (seconds // 3600, seconds // 60 % 60, seconds % 60)
+    return '%d:%02d' % (seconds // 60, seconds % 60)
+
+
+def write_laps_csv(path, laps, seed=0, sport='cycling'):
+    """
+    Write a Garmin lap CSV export of laps laps (plus the Summary row)
+    with the columns of the sport export.
+    """
+    random = np.random.RandomState(seed)
+    seconds = random.uniform(240, 1500, laps)
+    distance = seconds * random.uniform(4, 9, laps) / 1000
+    hr = random.uniform(110, 170, laps)
+    calories = seconds * random.uniform(0.1, 0.3, laps)
+    values = {
+        'Time': seconds,
+        'Cumulative Time': np.cumsum(seconds),
+        'Moving Time': seconds * 0.98,
+        'Distance': distance,
+        'Avg Speed': distance / seconds * 3600,
+        'Avg Moving Speed': distance / seconds * 3600 * 1.02,
+        'Max Speed': distance / seconds * 3600 * random.uniform(1.2, 2.5, laps),
+        'Avg Pace': seconds / np.maximum(distance * 2, 0.01),
+        'Avg HR': hr,
+        'Max HR': hr + random.uniform(5, 25, laps),
+        'Elev Gain': random.uniform(0, 90, laps),
+        'Elev Loss': random.uniform(0, 90, laps),
+        'Avg Stroke Rate': random.uniform(20, 30, laps),
+        'Max Stroke Rate': random.uniform(30, 45, laps),
+        'Calories': calories,
+    }
+    summary = {name: column.sum() if name in ('Time', 'Distance', 'Calories', 'Elev Gain', 'Elev Loss',
+                                              'Moving Time') else column.max() if name.startswith('Max')
+               else column[-1] if name == 'Cumulative Time' else column.mean()
+               for name, column in values.items()}
+
+    columns = LAP_COLUMNS[sport]
+    with open(path, 'w') as csv:
+        csv.write(','.join('"%s"' % name for name in columns) + '\n')
+        for label, row in [(str(lap + 1), {name: column[lap] for name, column in values.items()})
+                           for lap in range(laps)] + [('Summary', summary)]:
+            cells = [label]
+            for name in columns[1:]:
+                if name in ('Time', 'Cumulative Time', 'Moving Time', 'Avg Pace'):
+                    cells.append(_duration_(row[name]))
+                elif name in ('Avg HR', 'Max HR', 'Calories', 'Elev Gain', 'Elev Loss',
+                              'Avg Stroke Rate', 'Max Stroke Rate'):
+                    cells.append('%d' % round(row[name]))
+                else:
+                    cells.append('%.2f' % row[name] if name == 'Distance' else '%.1f' % row[name])
+            csv.write(','.join('"%s"' % cell for cell in cells) + '\n')
+    return path
+
+
+def write_archive(directory, files, trackpoints=3600, fmt='fit', seed=0, start=START):
+    """
+    Write an archive of files activities (about one a day from start)
+    in the fmt format ('fit', 'tcx' or 'csv' for lap exports),
+    and return their paths.
+    """
+    writers = {'fit': write_fit, 'tcx': write_tcx}
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for index in range(files):
+        day = start + datetime.timedelta(hours=int(index * 20.5))
+        path = os.path.join(directory, '%d.%s' % (100000000 + index, fmt))
+        if fmt == 'csv':
+            write_laps_csv(path, max(trackpoints // LAP_SECONDS, 1), seed + index)
+        else:
+            writers[fmt](path, trackpoints, seed + index, day)
+        paths.append(path)
+    return paths
+
+
+def _cached_(name, write, *args):
+
+    path = os.path.join(DATA_DIR, name)
+    if not os.path.exists(path):
+        os.makedirs(DATA_DIR, exist_ok=True)
+        tmp_path = path + '.tmp%d' % os.getpid()
+        write(tmp_path, *args)
+        os.replace(tmp_path, path)
+    return path
+
+
+def cached_tcx(trackpoints, seed=0):
+    return _cached_('ride_%d_%d.tcx' % (trackpoints, seed), write_tcx, trackpoints, seed)
+
+
+def cached_fit(trackpoints, seed=0):
+    return _cached_('ride_%d_%d.fit' % (trackpoints, seed), write_fit, trackpoints, seed)
+
+
+def cached_laps_csv(laps, seed=0, sport='cycling'):
+    return _cached_('laps_%s_%d_%d.csv' % (sport, laps, seed), write_laps_csv, laps, seed, sport)
+
+
+def cached_archive(files, trackpoints=3600, fmt='fit', seed=0):
+    directory = os.path.join(DATA_DIR, 'archive_%s_%d_%d_%d' % (fmt, files, trackpoints, seed))
+    done = os.path.join(directory, '.complete')
+    if not os.path.exists(done):
+        write_archive(directory, files, trackpoints, fmt, seed)
+        open(done, 'w').close()
+    return directory
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Write synthetic activities.')
+    parser.add_argument('kind', choices=['tcx', 'fit', 'csv', 'archive'])
+    parser.add_argument('path', help='file, or directory of the archive')
+    parser.add_argument('-n', '--size', type=int, default=3600, help='trackpoints, or laps of a CSV')
+    parser.add_argument('--files', type=int, default=5000, help='archive files')
+    parser.add_argument('--format', default='fit', choices=['fit', 'tcx', 'csv'], help='archive format')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    if args.kind == 'tcx':
+        write_tcx(args.path, args.size, args.seed)
+    elif args.kind == 'fit':
+        write_fit(args.path, args.size, args.seed)
+    elif args.kind == 'csv':
+        write_laps_csv(args.path, args.size, args.seed)
+    else:
+        write_archive(args.path, args.files, args.size, args.format, args.seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+"""
+Command line entry point: garmin-parser parse|pmc|sync|report|ingest|query
+
+Every subcommand imports its modules when it runs, so the
+start up only pays for the libraries the subcommand needs.
+--metrics (or GARMIN_METRICS) prints the instrument summary
+of the run at the end.
+"""
+
+import argparse
+import datetime
+import os
+import sys
+
+
+def parse(args):
+    from loader import get_date, load_workout
+
+    workout = load_workout(args.file, args.fields)
+    if args.output:
+        workout.to_csv(args.output, index=False)
+    print('%s: %d rows, %s, %s' % (args.file, len(workout), get_date(workout), ', '.join(workout.columns)))
+
+
+def pmc(args):
+    import pmc
+
+    pmc_df = pmc.update_pmc(args.directory, args.start, args.end, args.ftp, args.lthr,
+                            max_workers=args.workers, ledger_path=args.ledger, pmc_path=args.output)
+    print(pmc_df[['TSS', 'CTL', 'ATL', 'TSB']].tail(args.days).round(1).to_string())
+    if args.plot:
+        pmc.plot_pmc(pmc_df)
+
+
+def sync(args):
+    from garminconnect import Garmin
+
+    email = args.email or os.environ.get('GARMIN_EMAIL')
+    password = args.password or os.environ.get('GARMIN_PASSWORD')
+    if not email or not password:
+        raise SystemExit('sync needs --email/--password or GARMIN_EMAIL/GARMIN_PASSWORD')
+
+    client = Garmin(email, password, session_file=args.session_file)
+    client.connect()
+    state_file = os.path.join(args.directory, args.state_file)
+    activities = client.sync_activities(state_file, save=False)
+    dl_fmts = [Garmin.ActivityDownloadFormat[name.upper()] for name in args.formats]
+    results = client.download_activities([activity['activityId'] for activity in activities],
+                                         args.directory, dl_fmts, max_workers=args.workers)
+    failed = [job for job, result in results.items() if isinstance(result, Exception)]
+    # The activities of failed downloads are listed again by the next sync
+    client.save_sync(state_file, activities, [activity_id for activity_id, _ in failed])
+    print('%d new activities, %d downloads failed' % (len(activities), len(failed)))
+    return 1 if failed else 0
+
+
+def report(args):
+    import report
+
+    return report.main(args.args)
+
+
+def ingest(args):
+    import archive
+
+    results = archive.ingest(args.directory, args.root, args.athlete, args.sport, max_workers=args.workers)
+    failed = [(activity_id, error) for activity_id, _, _, _, error in results if error is not None]
+    for activity_id, error in failed:
+        print('%s failed: %s' % (activity_id, error))
+    print('%d activities ingested into %s' % (len(results) - len(failed), args.root))
+    return 1 if failed else 0
+
+
+def query(args):
+    import archive
+
+    rows = archive.query(args.root, args.columns, args.start, args.end, args.sport, args.athlete,
+                         heart_rate=(args.min_hr, args.max_hr), power=(args.min_power, args.max_power),
+                         table=args.table)
+    if args.output:
+        rows.to_csv(args.output, index=False)
+    print(rows.to_string(max_rows=args.rows))
+
+
+def _date_(text):
+
+    return datetime.date.fromisoformat(text)
+
+
+def main(argv=None):
+    # --metrics is accepted before or after the subcommand
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--metrics', default=argparse.SUPPRESS,
+                        help='memory, jsonl:<path> or prometheus:<path> (or GARMIN_METRICS)')
+    parser = argparse.ArgumentParser(prog='garmin-parser', description=__doc__.strip().splitlines()[0],
+                                     parents=[common])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    command = commands.add_parser('parse', parents=[common], help='load a FIT/TCX/CSV activity')
+    command.add_argument('file')
+    command.add_argument('--fields', nargs='+', help='FIT record fields to decode')
+    command.add_argument('-o', '--output', help='write the trackpoints to a CSV file')
+    command.set_defaults(run=parse)
+
+    command = commands.add_parser('pmc', parents=[common],
+                                  help='update the Performance Management Chart of a directory')
+    command.add_argument('directory')
+    command.add_argument('--start', type=_date_, default=datetime.date(2019, 1, 1))
+    command.add_argument('--end', type=_date_, default=datetime.date.today())
+    command.add_argument('--ftp', type=float)
+    command.add_argument('--lthr', type=float)
+    command.add_argument('-w', '--workers', type=int, default=os.cpu_count())
+    command.add_argument('--ledger', default='pmc_ledger.csv')
+    command.add_argument('-o', '--output', default='pmc.csv')
+    command.add_argument('--days', type=int, default=7, help='days printed')
+    command.add_argument('--plot', action='store_true')
+    command.set_defaults(run=pmc)
+
+    command = commands.add_parser('sync', parents=[common], help='download the new Garmin Connect activities')
+    command.add_argument('directory')
+    command.add_argument('--email')
+    command.add_argument('--password')
+    command.add_argument('--session-file', default=os.path.expanduser('~/.garminconnect_session.json'))
+    command.add_argument('--state-file', default='sync.json', help='in directory')
+    command.add_argument('--formats', nargs='+', default=['tcx'], help='tcx, csv, gpx, original')
+    command.add_argument('-w', '--workers', type=int, default=4)
+    command.set_defaults(run=sync)
+
+    command = commands.add_parser('ingest', parents=[common],
+                                  help='add the activities of a directory to the Parquet archive')
+    command.add_argument('root', help='archive directory')
+    command.add_argument('directory')
+    command.add_argument('--athlete', default='me')
+    command.add_argument('--sport', help='instead of the sport of the files')
+    command.add_argument('-w', '--workers', type=int, default=os.cpu_count())
+    command.set_defaults(run=ingest)
+
+    command = commands.add_parser('query', parents=[common],
+                                  help='read trackpoints or laps from the Parquet archive')
+    command.add_argument('root', help='archive directory')
+    command.add_argument('--table', default='trackpoints', choices=['trackpoints', 'laps'])
+    command.add_argument('--columns', nargs='+')
+    command.add_argument('--start', type=_date_)
+    command.add_argument('--end', type=_date_)
+    command.add_argument('--sport', nargs='+')
+    command.add_argument('--athlete', nargs='+')
+    command.add_argument('--min-hr', type=float)
+    command.add_argument('--max-hr', type=float)
+    command.add_argument('--min-power', type=float)
+    command.add_argument('--max-power', type=float)
+    command.add_argument('-o', '--output', help='write the rows to a CSV file')
+    command.add_argument('--rows', type=int, default=20, help='rows printed')
+    command.set_defaults(run=query)
+
+    command = commands.add_parser('report', parents=[common],
+                                  help='render the reports of a directory of activities',
+                                  add_help=False)
+    command.set_defaults(run=report)
+
+    args, extra = parser.parse_known_args(sys.argv[1:] if argv is None else argv)
+    if args.command == 'report':
+        # The report options (see python report.py --help) are parsed by report.main
+        args.args = extra
+    elif extra:
+        parser.error('unrecognized arguments: %s' % ' '.join(extra))
+
+    metrics = getattr(args, 'metrics', None) or os.environ.get('GARMIN_METRICS')
+    if metrics:
+        import instrument
+        instrument.configure(metrics)
+
+    try:
+        return args.run(args) or 0
+    finally:
+        if metrics:
+            print(instrument.summary(), file=sys.stderr)
+            instrument.disable()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,21 +1,252 @@
-import seaborn as sns
+"""
+Correlation of activity metrics.
+
+get_number correlates the log returns of a DataFrame of laps at once.
+Correlation accumulates the covariance of any number of batches (the
+laps or trackpoints of one activity at a time) in a single pass,
+updated with Welford/Chan merges, so adding an activity to an archive
+wide correlation only costs the new rows, and the accumulators of
+worker processes merge into one:
+
+    total = Correlation(columns)
+    for laps in activities:
+        total.update(log_returns(laps[columns]))
+    heatmap(total.corr())
+
+Like DataFrame.corr, every pair of columns is computed over the rows
+where both are present; NaN and infinite values are missing.
+"""
+
+import os
+
 import numpy as np
-import matplotlib.pyplot as plt
+
+
+def log_returns(df):
+
+    return np.log(df / df.shift(1))
 
 
 def get_number(df):
-    log_returns = np.log(df / df.shift(1))
-    return log_returns.corr()
+    return log_returns(df).corr()
+
+
+class Correlation(object):
+    """
+    Online covariance and correlation matrices of columns.
+
+    For every pair (i, j) of columns the accumulator keeps the count
+    of rows where both are present, the means of i and j over them
+    (mean[i, j] and mean[j, i]), the sums of squared deviations
+    (m2[i, j] of i, m2[j, i] of j) and their co-moment.
+
+    Parameters
+    ----------
+    columns : list of the column names
+
+    """
+
+    def __init__(self, columns):
+        self.columns = list(columns)
+        shape = (len(self.columns), len(self.columns))
+        self.count = np.zeros(shape)
+        self.mean = np.zeros(shape)
+        self.m2 = np.zeros(shape)
+        self.comoment = np.zeros(shape)
+
+    def update(self, values):
+        """
+        Add a batch of rows: a DataFrame with the columns, or a 2D
+        array of them in order. Return self.
+        """
+        # pandas is only imported by the functions using it
+        import pandas as pd
+
+        if isinstance(values, pd.DataFrame):
+            values = values[self.columns].to_numpy(dtype=np.float64)
+        values = np.asarray(values, dtype=np.float64).reshape(-1, len(self.columns))
+        valid = np.isfinite(values)
+        if not valid.any():
+            return self
+
+        # Centered on the column means for a stable single pass
+        counts = valid.sum(axis=0)
+        totals = np.where(valid, values, 0.0).sum(axis=0)
+        shift = np.where(counts > 0, totals / np.maximum(counts, 1), 0.0)
+        centered = np.where(valid, values - shift, 0.0)
+        present = valid.astype(np.float64)
+
+        count = present.T @ present
+        sums = centered.T @ present  # sums[i, j]: of i over the rows with j
+        squares = (centered ** 2).T @ present
+        products = centered.T @ centered
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(count > 0, sums / count, 0.0)
+            m2 = np.where(count > 0, squares - sums * mean, 0.0)
+            comoment = np.where(count > 0, products - sums * sums.T / count, 0.0)
+
+        return self._merge_(count, mean + shift[:, None], np.maximum(m2, 0.0), comoment)
+
+    def merge(self, other):
+        """
+        Add the rows of another accumulator of the same columns
+        (e.g. of a worker process). Return self.
+        """
+        self._check_(other)
+        return self._merge_(other.count, other.mean, other.m2, other.comoment)
+
+    def subtract(self, other):
+        """
+        Remove the rows of an accumulator previously merged or
+        updated into this one, for windows sliding over batches.
+        Return self.
+        """
+        self._check_(other)
+        count = self.count - other.count
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(count > 0, (self.count * self.mean - other.count * other.mean) / count, 0.0)
+            delta = other.mean - mean
+            weight = np.where(count > 0, count * other.count / self.count, 0.0)
+        m2 = self.m2 - other.m2 - delta ** 2 * weight
+        comoment = self.comoment - other.comoment - delta * delta.T * weight
+
+        empty = count <= 0
+        self.count = np.where(empty, 0.0, count)
+        self.mean = np.where(empty, 0.0, mean)
+        self.m2 = np.where(empty, 0.0, np.maximum(m2, 0.0))
+        self.comoment = np.where(empty, 0.0, comoment)
+        return self
 
+    def copy(self):
+        duplicate = Correlation(self.columns)
+        duplicate.count, duplicate.mean = self.count.copy(), self.mean.copy()
+        duplicate.m2, duplicate.comoment = self.m2.copy(), self.comoment.copy()
+        return duplicate
+
+    def cov(self, min_periods=2):
+        """
+        The sample covariance matrix, as DataFrame.cov.
+        """
+        import pandas as pd
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            cov = self.comoment / (self.count - 1)
+        cov[self.count < max(min_periods, 2)] = np.nan
+        return pd.DataFrame(cov, index=self.columns, columns=self.columns)
+
+    def corr(self, min_periods=2):
+        """
+        The Pearson correlation matrix, as DataFrame.corr,
+        ready for heatmap.
+        """
+        import pandas as pd
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            corr = self.comoment / np.sqrt(self.m2 * self.m2.T)
+        corr = np.clip(corr, -1.0, 1.0)
+        corr[self.count < max(min_periods, 2)] = np.nan
+        return pd.DataFrame(corr, index=self.columns, columns=self.columns)
+
+    def save(self, path):
+        """
+        Write the accumulator to a .npz file, through a temporary file.
+        """
+        tmp_path = path + '.tmp.npz'
+        np.savez(tmp_path, columns=np.array(self.columns, dtype=str), count=self.count, mean=self.mean,
+                 m2=self.m2, comoment=self.comoment)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            accumulator = cls(data['columns'].tolist())
+            accumulator.count, accumulator.mean = data['count'], data['mean']
+            accumulator.m2, accumulator.comoment = data['m2'], data['comoment']
+        return accumulator
+
+    def _check_(self, other):
+
+        if other.columns != self.columns:
+            raise ValueError("Accumulators of different columns %s and %s" % (self.columns, other.columns))
+
+    def _merge_(self, count, mean, m2, comoment):
+
+        total = self.count + count
+        with np.errstate(invalid='ignore', divide='ignore'):
+            delta = mean - self.mean
+            share = np.where(total > 0, count / total, 0.0)
+        self.mean = self.mean + delta * share
+        # Chan et al. pairwise update of the deviations
+        weight = self.count * share
+        self.m2 = self.m2 + m2 + delta ** 2 * weight
+        self.comoment = self.comoment + comoment + delta * delta.T * weight
+        self.count = total
+        return self
+
+
+def combine(accumulators):
+    """
+    Merge accumulators of the same columns into a new one.
+    """
+    accumulators = list(accumulators)
+    if not accumulators:
+        raise ValueError("No accumulators to combine")
+    total = accumulators[0].copy()
+    for accumulator in accumulators[1:]:
+        total.merge(accumulator)
+    return total
+
+
+def rolling_corr(batches, window, min_periods=2):
+    """
+    Correlation matrices of the batches within a sliding time window.
+
+    Every batch is merged and subtracted once, so the cost is linear
+    in the number of batches, whatever the window.
+
+    Parameters
+    ----------
+    batches : iterable of (time, Correlation), e.g. one per activity
+    window : pd.Timedelta or string, e.g. '42D', ending at every batch
+    min_periods : int, rows of a pair below which it is NaN
+
+    Returns
+    -------
+    DataFrame of the matrix at every batch time, indexed by
+    (time, column) as DataFrame.rolling().corr()
+    """
+    import pandas as pd
+
+    window = pd.Timedelta(window)
+    batches = sorted(((pd.Timestamp(time), accumulator) for time, accumulator in batches), key=lambda item: item[0])
+    if not batches:
+        return pd.DataFrame()
+
+    total = Correlation(batches[0][1].columns)
+    matrices = []
+    first = 0
+    for time, accumulator in batches:
+        total.merge(accumulator)
+        while batches[first][0] <= time - window:
+            total.subtract(batches[first][1])
+            first += 1
+        matrices.append(total.corr(min_periods))
+    return pd.concat(matrices, keys=[time for time, _ in batches])
+
+
+def heatmap(correlacao, ax=None):
+    # The plotting libraries are only imported for the heatmap
+    import seaborn as sns
+    import matplotlib.pyplot as plt
 
-def heatmap(correlacao):
     sns.set()
 
-    f, ax = plt.subplots(figsize=(10, 6))
+    if ax is None:
+        f, ax = plt.subplots(figsize=(10, 6))
     cmap = sns.diverging_palette(220, 10, as_cmap=True)
-    mask = np.zeros_like(correlacao, dtype=np.bool)
+    mask = np.zeros_like(correlacao, dtype=bool)
     mask[np.triu_indices_from(mask)] = True
 
     sns.heatmap(correlacao, mask=mask, cmap=cmap, vmax=1, center=0.5,
-                square=True, linewidths=.5, cbar_kws={"shrink": .5})
-
+                square=True, linewidths=.5, cbar_kws={"shrink": .5}, ax=ax)
+    return ax
@@ -0,0 +1,141 @@
+"""
+Visual-fidelity downsampling of long series before plotting.
+
+Both methods return the indices of the samples to keep, always
+including the first and last samples and the global minimum and
+maximum (e.g. max HR), so peaks survive any point budget:
+
+- 'lttb'   : Largest-Triangle-Three-Buckets, keeps the sample of every
+             bucket forming the largest triangle with its neighbours
+- 'minmax' : min-max envelope, keeps the extremes of every bucket
+"""
+
+import numpy as np
+import pandas as pd
+
+MAX_POINTS = 5000  # Point budget of a series
+METHODS = ('lttb', 'minmax')
+
+
+def _numeric_(x):
+
+    if pd.api.types.is_datetime64_any_dtype(x):
+        # Naive or timezone aware
+        return pd.to_datetime(x, utc=True).asi8.astype(float)
+    x = np.asarray(x)
+    if np.issubdtype(x.dtype, np.timedelta64):
+        return x.astype('timedelta64[ns]').astype(np.int64).astype(float)
+    if not np.issubdtype(x.dtype, np.number):
+        # Labels are plotted evenly spaced
+        return np.arange(len(x), dtype=float)
+    return x.astype(float)
+
+
+def _edges_(size, buckets):
+
+    return np.linspace(0, size, buckets + 1).astype(np.int64)
+
+
+def lttb(x, y, threshold):
+    """
+    Return the indices of threshold samples of (x, y) picked by
+    Largest-Triangle-Three-Buckets. x must be sorted.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    size = len(y)
+    if threshold >= size or threshold < 3:
+        return np.arange(size)
+
+    # The first and last samples are buckets of their own
+    edges = _edges_(size - 2, threshold - 2) + 1
+    starts, ends = edges[:-1], edges[1:]
+    valid = ~np.isnan(y)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        counts = np.add.reduceat(valid, starts)
+        mean_x = np.add.reduceat(x, starts) / (ends - starts)
+        mean_y = np.add.reduceat(np.where(valid, y, 0.0), starts) / counts
+    mean_x = np.append(mean_x, x[-1])
+    mean_y = np.append(mean_y, y[-1])
+
+    indices = np.empty(threshold, dtype=np.int64)
+    indices[0], indices[-1] = 0, size - 1
+    selected = 0
+    with np.errstate(invalid='ignore'):
+        for bucket, (start, end) in enumerate(zip(starts, ends)):
+            ax, ay = x[selected], y[selected]
+            areas = np.abs((ax - mean_x[bucket + 1]) * (y[start:end] - ay)
+                           - (ax - x[start:end]) * (mean_y[bucket + 1] - ay))
+            selected = start + np.argmax(np.where(np.isnan(areas), -1.0, areas))
+            indices[bucket + 1] = selected
+    return indices
+
+
+def minmax(y, threshold):
+    """
+    Return the indices of the minimum and maximum of threshold // 2
+    equal buckets of y.
+    """
+    y = np.asarray(y, dtype=float)
+    size = len(y)
+    buckets = threshold // 2
+    if threshold >= size or buckets < 1:
+        return np.arange(size)
+
+    width = -(-size // buckets)
+    padded = np.full(buckets * width, np.nan)
+    padded[:size] = y
+    padded = padded.reshape(buckets, width)
+    offsets = np.arange(buckets) * width
+    lows = offsets + np.argmin(np.where(np.isnan(padded), np.inf, padded), axis=1)
+    highs = offsets + np.argmax(np.where(np.isnan(padded), -np.inf, padded), axis=1)
+    return np.unique(np.minimum(np.concatenate((lows, highs)), size - 1))
+
+
+def downsample(x, y, max_points=MAX_POINTS, method='lttb'):
+    """
+    Return the sorted indices of at most about max_points samples
+    of (x, y) to plot, keeping the global extremes of y.
+    """
+    if method not in METHODS:
+        raise ValueError("Unknown downsampling method %s" % method)
+    y = np.asarray(y, dtype=float)
+    if max_points is None or len(y) <= max_points:
+        return np.arange(len(y))
+
+    if method == 'lttb':
+        indices = lttb(_numeric_(x), y, max_points)
+    else:
+        indices = minmax(y, max_points)
+
+    extremes = [0, len(y) - 1]
+    if not np.isnan(y).all():
+        extremes += [np.nanargmin(y), np.nanargmax(y)]
+    return np.union1d(indices, extremes)
+
+
+def downsample_frame(df, max_points=MAX_POINTS, method='lttb'):
+    """
+    Return the rows of a DataFrame (or Series) along its index to plot,
+    sharing the point budget between its numeric columns.
+    """
+    if max_points is None or len(df) <= max_points:
+        return df
+    frame = df.to_frame() if isinstance(df, pd.Series) else df
+    columns = frame.select_dtypes(include=[np.number]).columns
+    if len(columns) == 0:
+        return df
+
+    budget = max(max_points // len(columns), 3)
+    x = _numeric_(frame.index)
+    order = None
+    if not (np.diff(x) >= 0).all():
+        order = np.argsort(x, kind='stable')
+        x = x[order]
+
+    rows = slice(None) if order is None else order
+    indices = np.unique(np.concatenate([downsample(x, frame[column].to_numpy(dtype=float)[rows], budget, method)
+                                        for column in columns]))
+    if order is not None:
+        indices = np.sort(order[indices])
+    return df.iloc[indices]
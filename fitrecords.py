@@ -0,0 +1,292 @@
+"""
+Deterministic FIT record reader.
+
+A single pass over the message headers locates every record
+(and lap or session) message, then only the wanted fields are gathered from the raw
+bytes into typed NumPy columns, one vectorized read per field
+and message definition.
+"""
+
+import struct
+from collections import namedtuple
+
+import numpy as np
+
+import helper
+import instrument
+
+FIT_EPOCH = 631065600  # 1989-12-31 00:00 UTC as a unix timestamp
+SESSION = 18  # Global message numbers of session, lap and record messages
+LAP = 19
+RECORD = 20
+TIMESTAMP = 253
+
+# Field name: (field number, scale, offset, output dtype)
+RECORD_FIELDS = {
+    'timestamp': (TIMESTAMP, 1, 0, 'datetime64[s]'),
+    'position_lat': (0, 1, 0, np.float64),
+    'position_long': (1, 1, 0, np.float64),
+    'altitude': (2, 5, 500, np.float64),
+    'heart_rate': (3, 1, 0, np.float32),
+    'cadence': (4, 1, 0, np.float32),
+    'distance': (5, 100, 0, np.float64),
+    'speed': (6, 1000, 0, np.float64),
+    'power': (7, 1, 0, np.float32),
+    'temperature': (13, 1, 0, np.float32),
+    'fractional_cadence': (53, 128, 0, np.float32),
+    'enhanced_speed': (73, 1000, 0, np.float64),
+    'enhanced_altitude': (78, 5, 500, np.float64),
+}
+
+# Record fields decoded from the field expanded into them as a
+# component, when not stored: same scale and offset, more bits
+COMPONENTS = {
+    'enhanced_speed': 'speed',
+    'enhanced_altitude': 'altitude',
+}
+
+# Lap field name, as RECORD_FIELDS
+LAP_FIELDS = {
+    'timestamp': (TIMESTAMP, 1, 0, 'datetime64[s]'),
+    'start_time': (2, 1, 0, 'datetime64[s]'),
+    'total_elapsed_time': (7, 1000, 0, np.float64),
+    'total_timer_time': (8, 1000, 0, np.float64),
+    'total_distance': (9, 100, 0, np.float64),
+    'total_calories': (11, 1, 0, np.float32),
+    'avg_heart_rate': (15, 1, 0, np.float32),
+    'max_heart_rate': (16, 1, 0, np.float32),
+}
+
+SESSION_FIELDS = {
+    'timestamp': (TIMESTAMP, 1, 0, 'datetime64[s]'),
+    'start_time': (2, 1, 0, 'datetime64[s]'),
+    'sport': (5, 1, 0, np.float32),  # SPORTS
+}
+
+# The sport enum values of the TCX Activity Sport attribute
+SPORTS = {1: 'Running', 2: 'Biking'}
+
+MESSAGE_FIELDS = {RECORD: RECORD_FIELDS, LAP: LAP_FIELDS, SESSION: SESSION_FIELDS}
+MESSAGE_NAMES = {RECORD: 'record', LAP: 'lap', SESSION: 'session'}
+
+# FIT base type: (NumPy type, invalid value)
+BASE_TYPES = {
+    0x00: ('u1', 0xFF),
+    0x01: ('i1', 0x7F),
+    0x02: ('u1', 0xFF),
+    0x83: ('i2', 0x7FFF),
+    0x84: ('u2', 0xFFFF),
+    0x85: ('i4', 0x7FFFFFFF),
+    0x86: ('u4', 0xFFFFFFFF),
+    0x88: ('f4', None),
+    0x89: ('f8', None),
+    0x0A: ('u1', 0x00),
+    0x8B: ('u2', 0x0000),
+    0x8C: ('u4', 0x00000000),
+    0x8E: ('i8', 0x7FFFFFFFFFFFFFFF),
+    0x8F: ('u8', 0xFFFFFFFFFFFFFFFF),
+    0x90: ('u8', 0x0000000000000000),
+}
+
+# fields maps a field number to its (byte offset, size, base type)
+Definition = namedtuple('Definition', ['global_number', 'endian', 'size', 'fields'])
+
+
+def read_records(source, fields=None):
+    """
+    Decode the record messages of a FIT file.
+
+    Parameters
+    ----------
+    source : path, bytes or binary file object (see helper.open_activity)
+    fields : list of RECORD_FIELDS names to decode, all of them if None
+
+    Returns
+    -------
+    dict of field name to NumPy array, one element per record message,
+    for the wanted fields defined in the file (or their COMPONENTS
+    source). Invalid values are NaN (NaT for the timestamp).
+    """
+    return read_messages(source, {RECORD: fields})[RECORD]
+
+
+def read_laps(source, fields=None):
+    """
+    Decode the lap messages of a FIT file, like read_records
+    with the LAP_FIELDS names.
+    """
+    return read_messages(source, {LAP: fields})[LAP]
+
+
+def read_messages(source, messages):
+    """
+    Decode several message types of a FIT file in a single pass.
+
+    Parameters
+    ----------
+    source : path, bytes or binary file object (see helper.open_activity)
+    messages : dict of global message number (RECORD, LAP, SESSION) to the list
+               of its MESSAGE_FIELDS names to decode, all of them if None
+
+    Returns
+    -------
+    dict of global message number to the columns of its messages,
+    see read_records
+    """
+    wanted = {}
+    for message, fields in messages.items():
+        table = MESSAGE_FIELDS[message]
+        fields = list(table) if fields is None else list(fields)
+        unknown = set(fields) - set(table)
+        if unknown:
+            raise ValueError("Unknown %s fields %s" % (MESSAGE_NAMES[message], sorted(unknown)))
+        wanted[message] = fields
+
+    with helper.open_activity(source, suffix='.fit') as fit_file:
+        data = fit_file.read()
+
+    with instrument.span('fit.scan'):
+        scanned = _scan_(data, wanted)
+    instrument.count('fit.records', scanned[RECORD][2] if RECORD in scanned else 0)
+    buffer = np.frombuffer(data, dtype=np.uint8)
+
+    return {message: _decode_(buffer, MESSAGE_FIELDS[message], fields, *scanned[message])
+            for message, fields in wanted.items()}
+
+
+def _decode_(buffer, table, fields, groups, header_timestamps, count):
+
+    columns = {}
+    for name in fields:
+        number, scale, offset, dtype = table[name]
+        numbers = [number]
+        if name in COMPONENTS and COMPONENTS[name] in table:
+            numbers.append(table[COMPONENTS[name]][0])
+        if not any(candidate in definition.fields for definition, _, _ in groups for candidate in numbers):
+            # Not defined in this file
+            if name != 'timestamp' or not header_timestamps:
+                continue
+
+        values = np.full(count, np.nan)
+        for definition, offsets, indices in groups:
+            defined = [candidate for candidate in numbers if candidate in definition.fields]
+            if not defined:
+                continue
+            values[indices] = _gather_(buffer, definition, defined[0], offsets)
+
+        if dtype == 'datetime64[s]':
+            if name == 'timestamp':
+                for index, seconds in header_timestamps.items():
+                    if np.isnan(values[index]):
+                        values[index] = seconds
+            missing = np.isnan(values)
+            seconds = np.where(missing, 0, values).astype(np.int64) + FIT_EPOCH
+            column = seconds.astype('datetime64[s]')
+            column[missing] = np.datetime64('NaT')
+        else:
+            column = (values / scale - offset).astype(dtype)
+
+        columns[name] = column
+
+    return columns
+
+
+def _gather_(buffer, definition, number, offsets):
+
+    field_offset, size, base_type = definition.fields[number]
+    type_code, invalid = BASE_TYPES.get(base_type, (None, None))
+    if type_code is None:
+        return np.nan
+    dtype = np.dtype(definition.endian + type_code)
+    if size < dtype.itemsize:
+        return np.nan
+
+    # Only the first element of array fields is read
+    positions = np.asarray(offsets)[:, None] + field_offset + np.arange(dtype.itemsize)
+    raw = buffer[positions].view(dtype).ravel()
+
+    values = raw.astype(np.float64)
+    if invalid is not None:
+        values[raw == invalid] = np.nan
+    return values
+
+
+def _scan_(data, messages=(RECORD,)):
+
+    if len(data) < 12 or data[8:12] != b'.FIT':
+        raise ValueError("Not a FIT file")
+
+    header_size = data[0]
+    data_size, = struct.unpack_from('<I', data, 4)
+    end = min(header_size + data_size, len(data))
+
+    definitions = {}
+    # Global message number -> [{id(definition): (definition, offsets, indices)}, header timestamps, count]
+    scanned = {message: [{}, {}, 0] for message in messages}
+    last_timestamp = None
+
+    offset = header_size
+    while offset < end:
+        record_header = data[offset]
+        offset += 1
+
+        if record_header & 0x80:
+            # Compressed timestamp header
+            definition = definitions[(record_header >> 5) & 0x03]
+            time_offset = record_header & 0x1F
+            if last_timestamp is not None:
+                timestamp = (last_timestamp & ~0x1F) + time_offset
+                if time_offset < (last_timestamp & 0x1F):
+                    timestamp += 0x20
+                last_timestamp = timestamp
+                if definition.global_number in scanned:
+                    state = scanned[definition.global_number]
+                    state[1][state[2]] = timestamp
+        elif record_header & 0x40:
+            definition, offset = _definition_(data, offset, record_header & 0x20)
+            definitions[record_header & 0x0F] = definition
+            continue
+        else:
+            definition = definitions[record_header & 0x0F]
+
+        if TIMESTAMP in definition.fields:
+            field_offset, size, _ = definition.fields[TIMESTAMP]
+            if size == 4:
+                last_timestamp, = struct.unpack_from(definition.endian + 'I', data, offset + field_offset)
+
+        if definition.global_number in scanned:
+            state = scanned[definition.global_number]
+            group = state[0].setdefault(id(definition), (definition, [], []))
+            group[1].append(offset)
+            group[2].append(state[2])
+            state[2] += 1
+
+        offset += definition.size
+
+    return {message: (list(groups.values()), header_timestamps, count)
+            for message, (groups, header_timestamps, count) in scanned.items()}
+
+
+def _definition_(data, offset, developer):
+
+    endian = '>' if data[offset + 1] == 1 else '<'
+    global_number, = struct.unpack_from(endian + 'H', data, offset + 2)
+    field_count = data[offset + 4]
+    offset += 5
+
+    fields = {}
+    size = 0
+    for _ in range(field_count):
+        number, field_size, base_type = data[offset], data[offset + 1], data[offset + 2]
+        fields[number] = (size, field_size, base_type)
+        size += field_size
+        offset += 3
+
+    if developer:
+        developer_count = data[offset]
+        offset += 1
+        for _ in range(developer_count):
+            size += data[offset + 1]
+            offset += 3
+
+    return Definition(global_number, endian, size, fields), offset
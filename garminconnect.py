@@ -1,16 +1,36 @@
 # -*- coding: utf-8 -*-
 """Python 3 API wrapper for Garmin Connect to get your statistics."""
+import datetime
+import hashlib
 import logging
 import json
+import os
 import re
+import threading
+import time
 import requests
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
 from enum import Enum, auto
 
+try:
+    import fcntl
+except ImportError:  # Windows, sessions are then only locked per process
+    fcntl = None
+
+import helper
+import instrument
+
 BASE_URL = 'https://connect.garmin.com'
 SSO_URL = 'https://sso.garmin.com/sso'
 MODERN_URL = 'https://connect.garmin.com/modern'
 SIGNIN_URL = 'https://sso.garmin.com/sso/signin'
 
+POOL_SIZE = 16  # Pooled connections per host, above the range fan-out
+RANGE_WORKERS = 8  # Concurrent requests of the *_range methods
+RANGE_RATE = 4.0  # Requests per second of the *_range methods, before any 429
+RANGE_RETRIES = 5  # Attempts of a day rate limited by 429 responses
+
 
 class Garmin(object):
     """
@@ -36,17 +56,43 @@ class Garmin(object):
         'origin': 'https://sso.garmin.com'
     }
 
-    def __init__(self, email, password):
+    def __init__(self, email, password, cache=None, session_file=None):
         """
-        Init module
+        Init module, optionally with a ResponseCache
+        (or any object with its get/put/ttl) for the daily data
+        and a session_file persisting the login across processes
         """
         self.email = email
         self.password = password
+        self.cache = cache
+        self.session_file = session_file
         self.req = requests.session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+        self.req.mount('https://', adapter)
+        self.req.mount('http://', adapter)
         self.logger = logging.getLogger(__name__)
         self.display_name = ""
         self.full_name = ""
         self.unit_system = ""
+        self.user_prefs = None
+        self.social_profile = None
+        # Bumped on every (re)login, so concurrent requests
+        # rejected by the same expired session relogin once
+        self.session_generation = 0
+        self.session_loaded = 0.0
+        self.login_lock = threading.Lock()
+        # RateLimiter of the requests of the current thread, if paced
+        self.pacing = threading.local()
+
+    def connect(self):
+        """
+        Reuse the saved session if there is one, else login.
+        The saved session is not validated here: it is replaced
+        lazily, when the server rejects it.
+        """
+        if self.session_file is not None and self.load_session():
+            return
+        self.login()
 
     def login(self):
         """
@@ -95,7 +141,7 @@ class Garmin(object):
         except requests.exceptions.HTTPError as err:
             raise GarminConnectConnectionError("Error connecting") from err
 
-        self.logger.debug("Response is %s", response.text)
+        self.logger.debug("Login response of %s characters", len(response.text))
         response_url = re.search(r'"(https:[^"]+?ticket=[^"]+)"', response.text)
 
         if not response_url:
@@ -112,7 +158,7 @@ class Garmin(object):
         except requests.exceptions.HTTPError as err:
             raise GarminConnectConnectionError("Error connecting") from err
 
-        self.logger.debug("Profile info is %s", response.text)
+        self.logger.debug("Profile info response code %s, %s characters", response.status_code, len(response.text))
 
         self.user_prefs = self.parse_json(response.text, 'VIEWER_USERPREFERENCES')
         self.unit_system = self.user_prefs['measurementSystem']
@@ -124,6 +170,90 @@ class Garmin(object):
         self.logger.debug("Display name is %s", self.display_name)
         self.logger.debug("Fullname is %s", self.full_name)
 
+        self.session_generation += 1
+        if self.session_file is not None:
+            self.save_session()
+
+    def relogin(self, generation):
+        """
+        Login again after the session of generation was rejected,
+        unless another thread or process already did it.
+        """
+        with self.login_lock:
+            if generation != self.session_generation:
+                return
+
+            if self.session_file is None:
+                self.login()
+                return
+
+            with open(self.session_file + '.lock', 'w') as lock_file:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    if os.path.exists(self.session_file) and \
+                            os.path.getmtime(self.session_file) > self.session_loaded:
+                        # Another worker logged in meanwhile
+                        self.logger.debug("Reusing session saved by another worker")
+                        self.load_session()
+                    else:
+                        self.login()
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def save_session(self):
+        """
+        Save the cookies and profile fields to session_file
+        """
+        session = {
+            'cookies': [{
+                'name': cookie.name,
+                'value': cookie.value,
+                'domain': cookie.domain,
+                'path': cookie.path,
+                'expires': cookie.expires,
+                'secure': cookie.secure,
+            } for cookie in self.req.cookies],
+            'display_name': self.display_name,
+            'full_name': self.full_name,
+            'unit_system': self.unit_system,
+            'user_prefs': self.user_prefs,
+            'social_profile': self.social_profile,
+        }
+        tmp_path = self.session_file + '.tmp'
+        # The cookies authenticate the account, keep them private
+        with open(os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as session_file:
+            json.dump(session, session_file)
+        os.replace(tmp_path, self.session_file)
+        self.session_loaded = os.path.getmtime(self.session_file)
+
+    def load_session(self):
+        """
+        Load the cookies and profile fields from session_file,
+        return False if there is no usable saved session
+        """
+        try:
+            with open(self.session_file) as session_file:
+                session = json.load(session_file)
+            loaded = os.path.getmtime(self.session_file)
+        except (OSError, ValueError):
+            return False
+
+        self.req.cookies.clear()
+        for cookie in session['cookies']:
+            self.req.cookies.set(cookie['name'], cookie['value'], domain=cookie['domain'],
+                                 path=cookie['path'], expires=cookie['expires'], secure=cookie['secure'])
+        self.display_name = session['display_name']
+        self.full_name = session['full_name']
+        self.unit_system = session['unit_system']
+        self.user_prefs = session['user_prefs']
+        self.social_profile = session['social_profile']
+        self.session_generation += 1
+        self.session_loaded = loaded
+        self.logger.debug("Session of %s loaded from %s", self.display_name, self.session_file)
+        return True
+
     def parse_json(self, html, key):
         """
         Find and return json data
@@ -133,24 +263,27 @@ class Garmin(object):
             text = found.group(1).replace('\\"', '"')
             return json.loads(text)
 
-    def fetch_data(self, url):
+    def fetch_response(self, url, headers=None):
         """
-        Fetch and return data
+        Fetch and return the response, relogin once on error
         """
+        headers = {**self.headers, **(headers or {})}
+        generation = self.session_generation
         try:
-            response = self.req.get(url, headers=self.headers)
+            response = self._get_(url, headers)
             if response.status_code == 429:
-                raise GarminConnectTooManyRequestsError("Too many requests")
+                raise GarminConnectTooManyRequestsError("Too many requests", retry_after(response))
 
             self.logger.debug("Fetch response code %s", response.status_code)
             response.raise_for_status()
         except requests.exceptions.HTTPError as err:
             self.logger.debug("Exception occurred during data retrieval - perhaps session expired - trying relogin: %s" % err)
-            self.login()
+            instrument.count('http.relogins')
+            self.relogin(generation)
             try:
-                response = self.req.get(url, headers=self.headers)
+                response = self._get_(url, headers)
                 if response.status_code == 429:
-                    raise GarminConnectTooManyRequestsError("Too many requests")
+                    raise GarminConnectTooManyRequestsError("Too many requests", retry_after(response))
 
                 self.logger.debug("Fetch response code %s", response.status_code)
                 response.raise_for_status()
@@ -158,10 +291,102 @@ class Garmin(object):
                 self.logger.debug("Exception occurred during data retrieval, relogin without effect: %s" % err)
                 raise GarminConnectConnectionError("Error connecting") from err
 
-        resp_json = response.json()
-        self.logger.debug("Fetch response json %s", resp_json)
-        return resp_json
+        return response
+
+    def _get_(self, url, headers, **kwargs):
+        limiter = getattr(self.pacing, 'limiter', None)
+        if limiter is not None:
+            limiter.acquire()
+        start = time.perf_counter()
+        response = self.req.get(url, headers=headers, **kwargs)
+        instrument.observe('http.request', time.perf_counter() - start)
+        instrument.count('http.requests')
+        if response.status_code == 429:
+            instrument.count('http.429')
+            if limiter is not None:
+                limiter.backoff(retry_after(response))
+        elif limiter is not None:
+            limiter.success()
+        return response
+
+    def paced(self, limiter, function, *args, retries=RANGE_RETRIES):
+        """
+        Call function with the requests of this thread paced by limiter,
+        which backs off on 429 responses, retrying up to retries times
+        """
+        self.pacing.limiter = limiter
+        try:
+            for _ in range(retries - 1):
+                try:
+                    return function(*args)
+                except GarminConnectTooManyRequestsError as err:
+                    self.logger.debug("Rate limited, retry after %s", err.retry_after)
+                    instrument.count('http.retries')
+            return function(*args)
+        finally:
+            self.pacing.limiter = None
+
+    def fetch_data(self, url):
+        """
+        Fetch and return data
+        """
+        response = self.fetch_response(url)
+        self.logger.debug("Fetch response of %s bytes", len(response.content))
+        return response.json()
+
+    def fetch_daily(self, endpoint, cdate, url, expired=None):
+        """
+        Fetch and return the data of one day, through the cache if set.
+        Entries stored after the day ended are final and served from
+        the cache, others (e.g. stored while the day was running) are
+        revalidated after the cache ttl, with a conditional request
+        when the server sent an ETag/Last-Modified.
+        expired tells a response of an expired session (e.g. the
+        privacyProtected statistics), which is fetched again after a
+        relogin and never cached.
+        """
+        key = (endpoint, self.display_name, cdate)
+        entry = None if self.cache is None else self.cache.get(key)
+        if entry is not None and (is_final(cdate, entry['stored'])
+                                  or time.time() - entry['stored'] < self.cache.ttl):
+            self.logger.debug("Cache hit for %s %s", endpoint, cdate)
+            return entry['json']
+
+        headers = {}
+        if entry is not None and entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry is not None and entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+
+        generation = self.session_generation
+        response = self.fetch_response(url, headers)
+        if response.status_code == 304 and entry is not None:
+            self.logger.debug("Not modified %s %s", endpoint, cdate)
+            resp_json = entry['json']
+        else:
+            resp_json = response.json()
+            self.logger.debug("Fetch response of %s bytes", len(response.content))
+
+        if expired is not None and expired(resp_json):
+            self.logger.debug("Session expired - trying relogin")
+            instrument.count('http.relogins')
+            self.relogin(generation)
+            response = self.fetch_response(url)
+            resp_json = response.json()
+            self.logger.debug("Fetch response of %s bytes", len(response.content))
+            if expired(resp_json):
+                return resp_json
 
+        if self.cache is not None:
+            # A 304 may leave out the validators of the entry it confirms
+            previous = entry if response.status_code == 304 and entry is not None else {}
+            self.cache.put(key, {
+                'json': resp_json,
+                'stored': time.time(),
+                'etag': response.headers.get('ETag') or previous.get('etag'),
+                'last_modified': response.headers.get('Last-Modified') or previous.get('last_modified'),
+            })
+        return resp_json
 
     def get_full_name(self):
         """
@@ -188,35 +413,8 @@ class Garmin(object):
         """
         summaryurl = self.url_user_summary + self.display_name + '?' + 'calendarDate=' + cdate
         self.logger.debug("Fetching statistics %s", summaryurl)
-        try:
-            response = self.req.get(summaryurl, headers=self.headers)
-            if response.status_code == 429:
-                raise GarminConnectTooManyRequestsError("Too many requests")
-
-            self.logger.debug("Statistics response code %s", response.status_code)
-            response.raise_for_status()
-        except requests.exceptions.HTTPError as err:
-            raise GarminConnectConnectionError("Error connecting") from err
-
-        resp_json = response.json()
-        if resp_json['privacyProtected'] is True:
-            self.logger.debug("Session expired - trying relogin")
-            self.login()
-            try:
-                response = self.req.get(summaryurl, headers=self.headers)
-                if response.status_code == 429:
-                    raise GarminConnectTooManyRequestsError("Too many requests")
 
-                self.logger.debug("Statistics response code %s", response.status_code)
-                response.raise_for_status()
-            except requests.exceptions.HTTPError as err:
-                self.logger.debug("Exception occurred during statistics retrieval, relogin without effect: %s" % err)
-                raise GarminConnectConnectionError("Error connecting") from err
-            else:
-                resp_json = response.json()
-
-        self.logger.debug("Statistics response json %s", resp_json)
-        return resp_json
+        return self.fetch_daily('stats', cdate, summaryurl, expired=privacy_protected)
 
     def get_heart_rates(self, cdate):   # cDate = 'YYYY-mm-dd'
         """
@@ -225,7 +423,7 @@ class Garmin(object):
         hearturl = self.url_heartrates + self.display_name + '?date=' + cdate
         self.logger.debug("Fetching heart rates with url %s", hearturl)
 
-        return self.fetch_data(hearturl)
+        return self.fetch_daily('heart_rates', cdate, hearturl)
 
     def get_sleep_data(self, cdate):   # cDate = 'YYYY-mm-dd'
         """
@@ -234,7 +432,7 @@ class Garmin(object):
         sleepurl = self.url_sleepdata + self.display_name + '?date=' + cdate
         self.logger.debug("Fetching sleep data with url %s", sleepurl)
 
-        return self.fetch_data(sleepurl)
+        return self.fetch_daily('sleep_data', cdate, sleepurl)
 
     def get_steps_data(self, cdate):   # cDate = 'YYYY-mm-dd'
         """
@@ -243,7 +441,7 @@ class Garmin(object):
         steps_url = self.url_user_summary_chart + self.display_name + '?date=' + cdate
         self.logger.debug("Fetching steps data with url %s", steps_url)
 
-        return self.fetch_data(steps_url)
+        return self.fetch_daily('steps_data', cdate, steps_url)
 
     def get_body_composition(self, cdate):   # cDate = 'YYYY-mm-dd'
         """
@@ -252,7 +450,103 @@ class Garmin(object):
         bodycompositionurl = self.url_body_composition + '?startDate=' + cdate + '&endDate=' + cdate
         self.logger.debug("Fetching body composition with url %s", bodycompositionurl)
 
-        return self.fetch_data(bodycompositionurl)
+        return self.fetch_daily('body_composition', cdate, bodycompositionurl)
+
+    def get_body_composition_range(self, start_date, end_date):
+        """
+        Fetch the body composition of every day between start_date and
+        end_date ('YYYY-mm-dd' or dates) in a single request, as a
+        dataframe indexed by date
+        """
+        start_date, end_date = str(start_date), str(end_date)
+        bodycompositionurl = self.url_body_composition + '?startDate=' + start_date + '&endDate=' + end_date
+        self.logger.debug("Fetching body composition range with url %s", bodycompositionurl)
+
+        import pandas as pd
+
+        weights = self.fetch_data(bodycompositionurl).get('dateWeightList') or []
+        body_df = daily_frame(weights)
+        if len(body_df):
+            if 'calendarDate' in body_df:
+                dates = pd.to_datetime(body_df['calendarDate'])
+            else:
+                dates = pd.to_datetime(body_df['date'], unit='ms')
+            body_df.index = pd.DatetimeIndex(dates.dt.normalize().values, name='date')
+        return body_df
+
+    def get_stats_range(self, start_date, end_date, max_workers=RANGE_WORKERS, limiter=None):
+        """
+        Fetch the activity data of every day between start_date and end_date
+        """
+        return self.fetch_range(self.get_stats, start_date, end_date, max_workers, limiter)
+
+    def get_heart_rates_range(self, start_date, end_date, max_workers=RANGE_WORKERS, limiter=None):
+        """
+        Fetch the daily heart rate summaries between start_date and end_date
+        """
+        return self.fetch_range(self.get_heart_rates, start_date, end_date, max_workers, limiter)
+
+    def get_sleep_data_range(self, start_date, end_date, max_workers=RANGE_WORKERS, limiter=None):
+        """
+        Fetch the daily sleep summaries between start_date and end_date
+        """
+        return self.fetch_range(self.get_sleep_data, start_date, end_date, max_workers, limiter)
+
+    def get_stats_and_body_range(self, start_date, end_date, max_workers=RANGE_WORKERS, limiter=None):
+        """
+        Return activity data and body composition of every day between
+        start_date and end_date, body composition in a single request
+        (left out if it fails or has no weigh-in) and of the last
+        weigh-in of the days with several
+        """
+        import pandas as pd
+
+        limiter = RateLimiter(RANGE_RATE, burst=max_workers) if limiter is None else limiter
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            body = executor.submit(self.paced, limiter, self.get_body_composition_range, start_date, end_date)
+            stats_df = self.fetch_range(self.get_stats, start_date, end_date, max_workers, limiter)
+            try:
+                body_df = body.result()
+            except RANGE_ERRORS as err:
+                self.logger.warning("Body composition from %s to %s failed: %s", start_date, end_date, err)
+                return stats_df
+        if body_df.empty or not isinstance(body_df.index, pd.DatetimeIndex):
+            return stats_df
+
+        if 'date' in body_df:
+            body_df = body_df.iloc[body_df['date'].to_numpy().argsort(kind='stable')]
+        body_df = body_df[~body_df.index.duplicated(keep='last')]
+        return stats_df.join(body_df, rsuffix='_body')
+
+    def fetch_range(self, fetch_day, start_date, end_date, max_workers=RANGE_WORKERS, limiter=None):
+        """
+        Call fetch_day for every day between start_date and end_date
+        concurrently over the pooled session, and return the results
+        as a dataframe indexed by date (list valued fields left out).
+        Requests are paced by a shared RateLimiter and retried on 429
+        responses; the days that still fail are logged and left out.
+        """
+        # pandas is only needed by the date range helpers
+        import pandas as pd
+
+        limiter = RateLimiter(RANGE_RATE, burst=max_workers) if limiter is None else limiter
+        dates = pd.date_range(start_date, end_date)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(self.paced, limiter, fetch_day, cdate)
+                       for cdate in dates.strftime('%Y-%m-%d')]
+            fetched, days = [], []
+            for date, future in zip(dates, futures):
+                try:
+                    days.append(future.result())
+                except RANGE_ERRORS as err:
+                    self.logger.warning("Fetch of %s failed: %s", date.date(), err)
+                    instrument.count('http.days_failed')
+                    continue
+                fetched.append(date)
+
+        day_df = daily_frame(days)
+        day_df.index = pd.DatetimeIndex(fetched, name='date')
+        return day_df
 
     def get_activities(self, start, limit):
         """
@@ -263,6 +557,73 @@ class Garmin(object):
 
         return self.fetch_data(activitiesurl)
 
+    def iter_activities(self, page_size=100, until_id=None, until_start=None):
+        """
+        Iterate over the activities, newest first, fetching the
+        next page in the background while the current one is consumed.
+        Stops at the activity until_id, or at the first activity
+        started (startTimeGMT) at or before until_start.
+        """
+        until_id = None if until_id is None else str(until_id)
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            start = 0
+            page = executor.submit(self.get_activities, start, page_size)
+            while True:
+                activities = page.result()
+                if not activities:
+                    return
+                start += len(activities)
+                if len(activities) == page_size:
+                    page = executor.submit(self.get_activities, start, page_size)
+
+                for activity in activities:
+                    if until_id is not None and str(activity['activityId']) == until_id:
+                        return
+                    if until_start is not None and activity['startTimeGMT'] <= until_start:
+                        return
+                    yield activity
+
+                if len(activities) < page_size:
+                    return
+
+    def sync_activities(self, state_file, page_size=100, save=True):
+        """
+        Return the activities (newest first) added since the last sync
+        recorded in state_file, followed by the ones still pending
+        because their download failed. The first sync lists the whole
+        history. With save the sync is recorded at once, otherwise
+        call save_sync once the activities are downloaded.
+        """
+        state = load_sync_state(state_file)
+        activities = list(self.iter_activities(page_size, state.get('activity_id'), state.get('start_time')))
+        self.logger.debug("%s new activities since %s", len(activities), state.get('start_time'))
+
+        listed = {str(activity['activityId']) for activity in activities}
+        activities += [activity for activity in state.get('pending', [])
+                       if str(activity['activityId']) not in listed]
+        if save:
+            self.save_sync(state_file, activities)
+        return activities
+
+    def save_sync(self, state_file, activities, failed_ids=()):
+        """
+        Record the newest of the synced activities in state_file, and
+        keep the ones of failed_ids pending for the next sync.
+        """
+        state = load_sync_state(state_file)
+        failed_ids = {str(activity_id) for activity_id in failed_ids}
+        newest = max(activities, key=lambda activity: activity['startTimeGMT'], default=None)
+        if newest is not None and newest['startTimeGMT'] > state.get('start_time', ''):
+            state['activity_id'] = newest['activityId']
+            state['start_time'] = newest['startTimeGMT']
+        state['pending'] = [{'activityId': activity['activityId'], 'startTimeGMT': activity['startTimeGMT']}
+                            for activity in activities if str(activity['activityId']) in failed_ids]
+
+        tmp_path = state_file + '.tmp'
+        with open(tmp_path, 'w') as sync_file:
+            json.dump(state, sync_file)
+        os.replace(tmp_path, state_file)
+
     def get_excercise_sets(self, activity_id):
         activity_id = str(activity_id)
         exercisesetsurl = f"{self.url_exercise_sets}{activity_id}/exerciseSets"
@@ -280,7 +641,26 @@ class Garmin(object):
     def download_activity(self, activity_id, dl_fmt=ActivityDownloadFormat.TCX):
         """
         Downloads activity in requested format and returns the raw bytes. For
-        "Original" will return the zip file content, up to user to extract it.
+        "Original" will return the zip file content, which helper.open_activity
+        reads directly without extracting it.
+        """
+        url = self.download_url(activity_id, dl_fmt)
+
+        self.logger.debug(f"Downloading from {url}")
+        try:
+            response = self._get_(url, self.headers)
+            if response.status_code == 429:
+                raise GarminConnectTooManyRequestsError("Too many requests", retry_after(response))
+
+            response.raise_for_status()
+        except requests.exceptions.HTTPError as err:
+            raise GarminConnectConnectionError("Error connecting") from err
+        instrument.count('http.bytes_downloaded', len(response.content))
+        return response.content
+
+    def download_url(self, activity_id, dl_fmt):
+        """
+        Return the download url of an activity in the requested format
         """
         activity_id = str(activity_id)
         urls = {
@@ -292,16 +672,330 @@ class Garmin(object):
         }
         if dl_fmt not in urls:
             raise ValueError(f"Unexpected value {dl_fmt} for dl_fmt")
-        url = urls[dl_fmt]
+        return urls[dl_fmt]
 
-        self.logger.debug(f"Downloading from {url}")
+    def download_activity_to(self, activity_id, target, dl_fmt=ActivityDownloadFormat.TCX,
+                             size=None, sha256=None, extract_fit=False, chunk_size=64 * 1024):
+        """
+        Downloads activity in requested format straight into target, a path
+        or a binary file object, a chunk at a time. Paths are written through
+        a temporary file renamed on success. The downloaded bytes are checked
+        against size and the sha256 hex digest if given (and Content-Length).
+        With extract_fit the FIT member of an "Original" zip is written
+        instead, decompressed on the fly. Returns the bytes downloaded.
+        """
+        url = self.download_url(activity_id, dl_fmt)
+
+        self.logger.debug("Streaming download from %s", url)
         try:
-            response = self.req.get(url, headers=self.headers)
+            response = self._get_(url, self.headers, stream=True)
             if response.status_code == 429:
-                raise GarminConnectTooManyRequestsError("Too many requests")
+                response.close()
+                raise GarminConnectTooManyRequestsError("Too many requests", retry_after(response))
+
+            response.raise_for_status()
         except requests.exceptions.HTTPError as err:
-            raise GarminConnectConnectionError("Error connecting")
-        return response.content
+            response.close()
+            raise GarminConnectConnectionError("Error connecting") from err
+
+        if size is None and 'Content-Encoding' not in response.headers and 'Content-Length' in response.headers:
+            size = int(response.headers['Content-Length'])
+        digest = hashlib.sha256()
+        downloaded = 0
+
+        def counted(chunks):
+            nonlocal downloaded
+            for chunk in chunks:
+                downloaded += len(chunk)
+                digest.update(chunk)
+                yield chunk
+
+        with response, instrument.span('http.download'):
+            raw = counted(response.iter_content(chunk_size))
+            chunks = helper.iter_zip_member(raw, '.fit') if extract_fit else raw
+
+            is_path = isinstance(target, (str, os.PathLike))
+            tmp_path = os.fspath(target) + '.part' if is_path else None
+            target_file = open(tmp_path, 'wb') if is_path else target
+            try:
+                for chunk in chunks:
+                    target_file.write(chunk)
+                # Read what is left after the zip member, to verify it
+                for _ in raw:
+                    pass
+            except BaseException:
+                if is_path:
+                    target_file.close()
+                    os.remove(tmp_path)
+                raise
+            if is_path:
+                target_file.close()
+
+        instrument.count('http.bytes_downloaded', downloaded)
+        error = None
+        if size is not None and downloaded != size:
+            error = f"Downloaded {downloaded} bytes instead of {size}"
+        elif sha256 is not None and digest.hexdigest() != sha256.lower():
+            error = "Downloaded sha256 mismatch"
+        if error is not None:
+            if is_path:
+                os.remove(tmp_path)
+            raise GarminConnectConnectionError(error)
+
+        if is_path:
+            os.replace(tmp_path, target)
+        return downloaded
+
+    download_extensions = {
+        ActivityDownloadFormat.ORIGINAL: 'zip',
+        ActivityDownloadFormat.TCX: 'tcx',
+        ActivityDownloadFormat.GPX: 'gpx',
+        ActivityDownloadFormat.CSV: 'csv',
+        ActivityDownloadFormat.JSON: 'json',
+    }
+
+    def download_activities(self, activity_ids, directory, dl_fmts=(ActivityDownloadFormat.TCX,),
+                            max_workers=4, limiter=None, retries=5):
+        """
+        Downloads many activities concurrently into directory, as
+        <activity_id>.<extension> files, and returns a dict of
+        (activity_id, dl_fmt) to the file path or the raised error.
+        Requests are paced by a shared RateLimiter, which backs off on
+        429 responses, and completed downloads are recorded in a
+        manifest in directory so an interrupted backfill resumes
+        where it stopped.
+        """
+        limiter = RateLimiter() if limiter is None else limiter
+        manifest = DownloadManifest(os.path.join(directory, 'manifest.jsonl'))
+        os.makedirs(directory, exist_ok=True)
+
+        jobs = [(str(activity_id), dl_fmt) for activity_id in activity_ids for dl_fmt in dl_fmts]
+        results = {}
+        for activity_id, dl_fmt in jobs:
+            path = os.path.join(directory, f"{activity_id}.{self.download_extensions[dl_fmt]}")
+            if (activity_id, dl_fmt.name) in manifest and os.path.exists(path):
+                results[(activity_id, dl_fmt)] = path
+
+        def download(job):
+            activity_id, dl_fmt = job
+            path = os.path.join(directory, f"{activity_id}.{self.download_extensions[dl_fmt]}")
+            for attempt in range(retries):
+                limiter.acquire()
+                try:
+                    self.download_activity_to(activity_id, path, dl_fmt)
+                except GarminConnectTooManyRequestsError as err:
+                    self.logger.debug("Rate limited downloading %s, retry after %s", activity_id, err.retry_after)
+                    instrument.count('http.retries')
+                    limiter.backoff(err.retry_after)
+                    continue
+                limiter.success()
+                manifest.add(activity_id, dl_fmt.name)
+                return path
+            raise GarminConnectTooManyRequestsError("Too many requests")
+
+        pending = [job for job in jobs if job not in results]
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {job: executor.submit(download, job) for job in pending}
+            for job, future in futures.items():
+                try:
+                    results[job] = future.result()
+                except (GarminConnectConnectionError, GarminConnectTooManyRequestsError,
+                        requests.exceptions.RequestException, OSError) as err:
+                    self.logger.debug("Download of %s %s failed: %s", job[0], job[1].name, err)
+                    results[job] = err
+        return results
+
+
+def daily_frame(records):
+    """
+    Flatten per-day JSON records one level deep into a dataframe,
+    leaving out the list valued fields (e.g. time series)
+    """
+    import pandas as pd
+
+    day_df = pd.json_normalize([record or {} for record in records], max_level=1)
+    nested = [column for column in day_df if day_df[column].map(lambda value: isinstance(value, list)).any()]
+    return day_df.drop(columns=nested)
+
+
+def load_sync_state(state_file):
+    """
+    Return the sync state saved by save_sync, empty before the first sync
+    """
+    if not os.path.exists(state_file):
+        return {}
+    with open(state_file) as sync_file:
+        return json.load(sync_file)
+
+
+def is_final(cdate, stored):
+    """
+    Whether data stored at the stored time (seconds since the epoch)
+    is final for cdate ('YYYY-mm-dd'): stored after the day ended,
+    in local time
+    """
+    day_end = datetime.datetime.combine(datetime.date.fromisoformat(cdate) + datetime.timedelta(days=1),
+                                        datetime.time())
+    return stored >= day_end.timestamp()
+
+
+def privacy_protected(resp_json):
+    """
+    Whether statistics were withheld, as for an expired session
+    """
+    return isinstance(resp_json, dict) and resp_json.get('privacyProtected') is True
+
+
+def retry_after(response):
+    """
+    Return the seconds to wait from a Retry-After header, or None
+    """
+    value = response.headers.get('Retry-After')
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class RateLimiter(object):
+    """
+    Token bucket shared by concurrent requests.
+    The rate is halved on every 429 response (waiting for the
+    Retry-After if given) and grows back by increase on success.
+    """
+
+    def __init__(self, rate=1.0, burst=2, min_rate=0.05, increase=0.05):
+        self.rate = self.max_rate = rate  # Requests per second
+        self.burst = burst
+        self.min_rate = min_rate
+        self.increase = increase
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Block until a request may be sent
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                elif self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                else:
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def backoff(self, retry_after=None):
+        """
+        Slow down after a 429 response
+        """
+        with self.lock:
+            self.rate = max(self.rate / 2, self.min_rate)
+            self.tokens = 0.0
+            pause = retry_after if retry_after is not None else 1 / self.rate
+            self.paused_until = max(self.paused_until, time.monotonic() + pause)
+
+    def success(self):
+        """
+        Speed up again after a successful request
+        """
+        with self.lock:
+            self.rate = min(self.rate + self.increase, self.max_rate)
+
+
+class ResponseCache(object):
+    """
+    On-disk cache of daily responses, one JSON file per key,
+    evicting the least recently used files above max_bytes.
+    Entries stored before the end of their day expire after ttl seconds.
+    """
+
+    def __init__(self, directory, ttl=600, max_bytes=64 * 1024 * 1024):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.size = sum(entry.stat().st_size for entry in os.scandir(directory)
+                        if entry.name.endswith('.json'))
+
+    def _path_(self, key):
+        digest = hashlib.sha1(json.dumps(key).encode()).hexdigest()
+        return os.path.join(self.directory, digest + '.json')
+
+    def get(self, key):
+        path = self._path_(key)
+        try:
+            with open(path) as cache_file:
+                entry = json.load(cache_file)
+            # Mark as recently used
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return entry
+
+    def put(self, key, entry):
+        path = self._path_(key)
+        data = json.dumps(entry)
+        with self.lock:
+            previous = os.path.getsize(path) if os.path.exists(path) else 0
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'w') as cache_file:
+                cache_file.write(data)
+            os.replace(tmp_path, path)
+            self.size += len(data) - previous
+            if self.size > self.max_bytes:
+                self._evict_()
+
+    def _evict_(self):
+
+        entries = sorted((entry for entry in os.scandir(self.directory) if entry.name.endswith('.json')),
+                         key=lambda entry: entry.stat().st_mtime)
+        self.size = sum(entry.stat().st_size for entry in entries)
+        for entry in entries:
+            if self.size <= self.max_bytes:
+                break
+            self.size -= entry.stat().st_size
+            os.remove(entry.path)
+
+
+class DownloadManifest(object):
+    """
+    Append-only JSON lines record of completed downloads
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.completed = set()
+        if os.path.exists(path):
+            with open(path) as manifest_file:
+                for line in manifest_file:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.completed.add((entry['activity_id'], entry['format']))
+
+    def __contains__(self, key):
+        return key in self.completed
+
+    def add(self, activity_id, dl_fmt):
+        with self.lock:
+            with open(self.path, 'a') as manifest_file:
+                manifest_file.write(json.dumps({'activity_id': activity_id, 'format': dl_fmt}) + '\n')
+            self.completed.add((activity_id, dl_fmt))
 
 
 class GarminConnectConnectionError(Exception):
@@ -316,10 +1010,11 @@ class GarminConnectConnectionError(Exception):
 class GarminConnectTooManyRequestsError(Exception):
     """Raised when rate limit is exceeded."""
 
-    def __init__(self, status):
+    def __init__(self, status, retry_after=None):
         """Initialize."""
         super(GarminConnectTooManyRequestsError, self).__init__(status)
         self.status = status
+        self.retry_after = retry_after
 
 
 class GarminConnectAuthenticationError(Exception):
@@ -329,3 +1024,8 @@ class GarminConnectAuthenticationError(Exception):
         """Initialize."""
         super(GarminConnectAuthenticationError, self).__init__(status)
         self.status = status
+
+
+# Errors of a day left out by the *_range methods
+RANGE_ERRORS = (GarminConnectConnectionError, GarminConnectTooManyRequestsError,
+                requests.exceptions.RequestException, ValueError)
@@ -0,0 +1,192 @@
+"""
+Vectorized geodesic distance, bearing and speed over whole
+latitude/longitude arrays (decimal degrees), for cross-checking
+the Garmin distance column of TCXPandas.
+
+Segment i goes from point i - 1 to point i, so segment arrays
+are aligned with the trackpoints: the first one is NaN, and so
+is every segment touching a point without a Position.
+"""
+
+import numpy as np
+
+EARTH_RADIUS = 6371008.8  # Mean earth radius in meters
+
+# Semi-major axis (m) and flattening, as in geopy
+ELLIPSOIDS = {
+    'WGS-84': (6378137.0, 1 / 298.257223563),
+    'GRS-80': (6378137.0, 1 / 298.257222101),
+    'Airy (1830)': (6377563.396, 1 / 299.3249646),
+    'Intl 1924': (6378388.0, 1 / 297.0),
+    'Clarke (1880)': (6378249.145, 1 / 293.465),
+    'GRS-67': (6378160.0, 1 / 298.25),
+}
+
+VINCENTY_ITERATIONS = 200
+VINCENTY_TOLERANCE = 1e-12
+
+
+def _segments_(latitude, longitude):
+
+    latitude = np.radians(np.asarray(latitude, dtype=float))
+    longitude = np.radians(np.asarray(longitude, dtype=float))
+    return latitude[:-1], longitude[:-1], latitude[1:], longitude[1:]
+
+
+def _aligned_(values):
+
+    return np.concatenate(([np.nan], values))
+
+
+def haversine(lat1, lon1, lat2, lon2, radius=EARTH_RADIUS):
+    """
+    Great circle distance in meters between points in radians.
+    """
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * radius * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def vincenty(lat1, lon1, lat2, lon2, ellipsoid='WGS-84'):
+    """
+    Vincenty inverse distance in meters between points in radians,
+    iterated on all the pairs at once. Pairs that do not converge
+    (nearly antipodal points) are NaN.
+    """
+    a, f = ELLIPSOIDS[ellipsoid]
+    b = (1 - f) * a
+
+    u1 = np.arctan((1 - f) * np.tan(lat1))
+    u2 = np.arctan((1 - f) * np.tan(lat2))
+    sin_u1, cos_u1 = np.sin(u1), np.cos(u1)
+    sin_u2, cos_u2 = np.sin(u2), np.cos(u2)
+
+    delta = lon2 - lon1
+    lam = delta.copy()
+    converged = np.zeros(lam.shape, dtype=bool)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for _ in range(VINCENTY_ITERATIONS):
+            sin_lam, cos_lam = np.sin(lam), np.cos(lam)
+            sin_sigma = np.sqrt((cos_u2 * sin_lam) ** 2 + (cos_u1 * sin_u2 - sin_u1 * cos_u2 * cos_lam) ** 2)
+            cos_sigma = sin_u1 * sin_u2 + cos_u1 * cos_u2 * cos_lam
+            sigma = np.arctan2(sin_sigma, cos_sigma)
+            sin_alpha = np.where(sin_sigma == 0, 0.0, cos_u1 * cos_u2 * sin_lam / sin_sigma)
+            cos2_alpha = 1 - sin_alpha ** 2
+            # Equatorial lines have cos2_alpha == 0
+            cos_2sigma_m = np.where(cos2_alpha == 0, 0.0, cos_sigma - 2 * sin_u1 * sin_u2 / cos2_alpha)
+            c = f / 16 * cos2_alpha * (4 + f * (4 - 3 * cos2_alpha))
+            previous = lam
+            lam = delta + (1 - c) * f * sin_alpha * (
+                sigma + c * sin_sigma * (cos_2sigma_m + c * cos_sigma * (-1 + 2 * cos_2sigma_m ** 2)))
+            converged = np.abs(lam - previous) < VINCENTY_TOLERANCE
+            if converged[~np.isnan(lam)].all():
+                break
+
+        u2_ = cos2_alpha * (a ** 2 - b ** 2) / b ** 2
+        big_a = 1 + u2_ / 16384 * (4096 + u2_ * (-768 + u2_ * (320 - 175 * u2_)))
+        big_b = u2_ / 1024 * (256 + u2_ * (-128 + u2_ * (74 - 47 * u2_)))
+        delta_sigma = big_b * sin_sigma * (cos_2sigma_m + big_b / 4 * (
+            cos_sigma * (-1 + 2 * cos_2sigma_m ** 2)
+            - big_b / 6 * cos_2sigma_m * (-3 + 4 * sin_sigma ** 2) * (-3 + 4 * cos_2sigma_m ** 2)))
+        distance = b * big_a * (sigma - delta_sigma)
+
+    distance = np.where(sin_sigma == 0, 0.0, distance)
+    return np.where(converged, distance, np.nan)
+
+
+def segment_distances(latitude, longitude, method='haversine', ellipsoid='WGS-84', radius=EARTH_RADIUS):
+    """
+    Return the distance in meters of every segment of a track,
+    method 'haversine' (sphere of radius) or 'vincenty' (ellipsoid).
+    """
+    lat1, lon1, lat2, lon2 = _segments_(latitude, longitude)
+    if method == 'haversine':
+        distances = haversine(lat1, lon1, lat2, lon2, radius)
+    elif method == 'vincenty':
+        distances = vincenty(lat1, lon1, lat2, lon2, ellipsoid)
+    else:
+        raise ValueError("Unknown method %s" % method)
+    return _aligned_(distances)
+
+
+def cumulative_distance(segments, start=0.0):
+    """
+    Return the cumulative distance of segment distances,
+    where gaps (NaN segments) add nothing.
+    """
+    return start + np.cumsum(np.nan_to_num(segments))
+
+
+def bearings(latitude, longitude):
+    """
+    Return the initial bearing in degrees [0, 360) of every segment.
+    """
+    lat1, lon1, lat2, lon2 = _segments_(latitude, longitude)
+    delta = lon2 - lon1
+    y = np.sin(delta) * np.cos(lat2)
+    x = np.cos(lat1) * np.sin(lat2) - np.sin(lat1) * np.cos(lat2) * np.cos(delta)
+    return _aligned_(np.degrees(np.arctan2(y, x)) % 360)
+
+
+def speeds(segments, time):
+    """
+    Return the speed in m/s of every segment, from the trackpoint times
+    (datetime64 or anything pandas converts to it).
+    """
+    time = np.asarray(time, dtype='datetime64[ns]')
+    seconds = _aligned_(np.diff(time) / np.timedelta64(1, 's'))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(seconds > 0, segments / seconds, np.nan)
+
+
+class TrackStream(object):
+    """
+    Segment distances, bearings, cumulative distance and speeds
+    over a track read in chunks (e.g. TCXPandas.parse_chunks),
+    carrying the last point of each chunk over to the next.
+
+    Parameters
+    ----------
+    method, ellipsoid, radius : as in segment_distances
+
+    """
+
+    def __init__(self, method='haversine', ellipsoid='WGS-84', radius=EARTH_RADIUS):
+        self.method = method
+        self.ellipsoid = ellipsoid
+        self.radius = radius
+        self.last = None
+        self.distance = 0.0
+
+    def update(self, latitude, longitude, time=None):
+        """
+        Return a dict of the chunk 'segment', 'bearing', 'cumulative'
+        and (with time) 'speed' arrays, aligned with its points.
+        """
+        latitude = np.asarray(latitude, dtype=float)
+        longitude = np.asarray(longitude, dtype=float)
+        time = None if time is None else np.asarray(time, dtype='datetime64[ns]')
+        size = len(latitude)
+        if size == 0:
+            empty = np.empty(0)
+            return {'segment': empty, 'bearing': empty, 'cumulative': empty, 'speed': empty}
+
+        if self.last is None:
+            lats, lons, times = latitude, longitude, time
+        else:
+            last_lat, last_lon, last_time = self.last
+            lats = np.concatenate(([last_lat], latitude))
+            lons = np.concatenate(([last_lon], longitude))
+            times = None if time is None else np.concatenate(([last_time], time))
+
+        segments = segment_distances(lats, lons, self.method, self.ellipsoid, self.radius)
+        metrics = {
+            'segment': segments[-size:],
+            'bearing': bearings(lats, lons)[-size:],
+            'cumulative': cumulative_distance(segments[-size:], self.distance),
+        }
+        if times is not None:
+            metrics['speed'] = speeds(segments, times)[-size:]
+
+        self.distance = metrics['cumulative'][-1]
+        self.last = (latitude[-1], longitude[-1], None if time is None else time[-1])
+        return metrics
@@ -1,9 +1,34 @@
-import matplotlib.pyplot as plt
 import numpy as np
 
+from downsample import MAX_POINTS, downsample, downsample_frame
 
-def overlay(x, y1, y2):
-    fig, ax = plt.subplots(figsize=(16, 4))
+
+def _axes_(ax, figsize=None):
+    # Draw on the given axes (e.g. reused by a batch report)
+    # or on a new figure that is shown at the end
+    if ax is not None:
+        return ax, False
+    # pyplot is only imported once something is plotted
+    import matplotlib.pyplot as plt
+    fig, ax = plt.subplots(figsize=figsize)
+    return ax, True
+
+
+def _show_(show):
+    if show:
+        import matplotlib.pyplot as plt
+        plt.show()
+
+
+def _grid_(ax):
+    ax.set_axisbelow(True)
+    ax.minorticks_on()
+    ax.grid(which='major', linestyle='-', linewidth='0.5', color='red')
+    ax.grid(which='minor', linestyle=':', linewidth='0.5', color='black')
+
+
+def overlay(x, y1, y2, ax=None):
+    ax, show = _axes_(ax, figsize=(16, 4))
 
     ax.plot(x, y1, color="red", marker="o")
 
@@ -17,74 +42,77 @@ def overlay(x, y1, y2):
     ax2.plot(x, y2, color="blue", marker="o")
     ax2.set_ylabel(y2.name, color="blue", fontsize=14)
 
-    plt.show()
+    _show_(show)
+    return ax
 
     # save the plot as a file
     # fig.savefig('twinx.jpg', format='jpeg', dpi=100, bbox_inches='tight')
 
 
-def overlay_hist(df):
-    fig, ax = plt.subplots()
+def overlay_hist(df, ax=None):
+    ax, show = _axes_(ax)
     # df.plot.hist(bins=100, alpha=0.5, range=(0, 400), ax=ax)
     df.plot.hist(bins=50, alpha=0.5, ax=ax)
     ax.legend()
-    ax.set_axisbelow(True)
-    ax.minorticks_on()
-    ax.grid(which='major', linestyle='-', linewidth='0.5', color='red')
-    ax.grid(which='minor', linestyle=':', linewidth='0.5', color='black')
-    plt.show()
+    _grid_(ax)
+    _show_(show)
+    return ax
 
 
-def mean(df_dropped):
+def mean(df_dropped, ax=None):
     means = df_dropped.mean()
     errors = df_dropped.std()
-    fig, ax = plt.subplots(figsize=(16, 4))
+    ax, show = _axes_(ax, figsize=(16, 4))
     means.plot.bar(yerr=errors, ax=ax)
-    ax.set_axisbelow(True)
-    ax.minorticks_on()
-    ax.grid(which='major', linestyle='-', linewidth='0.5', color='red')
-    ax.grid(which='minor', linestyle=':', linewidth='0.5', color='black')
-    plt.show()
+    _grid_(ax)
+    _show_(show)
+    return ax
 
 
-def overlay_timeseries(df):
-    fig, ax = plt.subplots(figsize=(16, 4))
+def overlay_timeseries(df, max_points=MAX_POINTS, ax=None):
+    ax, show = _axes_(ax, figsize=(16, 4))
+    df = downsample_frame(df, max_points)
     df.plot(ax=ax)
     ax.legend()
     # plt.xlabel("Seconds")
-    ax.set_axisbelow(True)
-    ax.minorticks_on()
-    ax.grid(which='major', linestyle='-', linewidth='0.5', color='red')
-    ax.grid(which='minor', linestyle=':', linewidth='0.5', color='black')
-    plt.show()
+    _grid_(ax)
+    _show_(show)
+    return ax
 
 
-def heartrate(df, title=''):
-    fig, ax = plt.subplots()
-    df.plot(ax=ax, figsize=(16, 8))
+def heartrate(df, title='', max_points=MAX_POINTS, ax=None):
+    ax, show = _axes_(ax, figsize=(16, 8))
+    df = downsample_frame(df, max_points)
+    df.plot(ax=ax)
     ax.legend()
-    ax.set_axisbelow(True)
-    ax.minorticks_on()
-    ax.grid(which='major', linestyle='-', linewidth='0.5', color='red')
-    ax.grid(which='minor', linestyle=':', linewidth='0.5', color='black')
-    plt.title(title)
-    plt.show()
+    _grid_(ax)
+    ax.set_title(title)
+    _show_(show)
+    return ax
 
 
-def scatter(df1, df2=None):
-    colors = np.random.rand(len(df1))
-
+def scatter(df1, df2=None, max_points=MAX_POINTS, ax=None):
     if df2 is None:
         df2 = df1
         df1 = df2.index
 
-    plt.figure(figsize=(17, 6))
-    plt.scatter(x=df1, y=df2, c=colors, alpha=0.5)
-    plt.gcf().autofmt_xdate()
-    plt.show()
+    # Downsample along x, keeping the peaks of y
+    x, y = np.asarray(df1), np.asarray(df2, dtype=float)
+    order = np.argsort(x, kind='stable')
+    keep = order[downsample(x[order], y[order], max_points)]
+    df1, df2 = x[keep], y[keep]
+    colors = np.random.rand(len(df1))
+
+    ax, show = _axes_(ax, figsize=(17, 6))
+    ax.scatter(x=df1, y=df2, c=colors, alpha=0.5)
+    ax.figure.autofmt_xdate()
+    _show_(show)
+    return ax
 
 
 def two_scatters(df1, df2):
+    import matplotlib.pyplot as plt
+
     x = df1
     y = df2
     z = np.sqrt(x ** 2 + y ** 2)
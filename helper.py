@@ -1,3 +1,15 @@
+import contextlib
+import gzip
+import io
+import os
+import struct
+import zipfile
+import zlib
+
+GZIP_MAGIC = b'\x1f\x8b'
+ZIP_MAGIC = b'PK\x03\x04'
+ZIP_DESCRIPTOR_MAGIC = b'PK\x07\x08'
+ZIP_HEADER_SIZE = 30
 
 
 def get_sec(time_str):
@@ -10,3 +22,121 @@ def get_sec(time_str):
     except ValueError:
         m, s = time_str.split(':')
         return int(float(m)) * 60 + int(float(s))
+
+
+@contextlib.contextmanager
+def open_activity(source, suffix=None):
+    """
+    Open an activity file for binary reading.
+
+    The source may be a path, raw bytes (e.g. the return of
+    Garmin.download_activity) or a binary file object. Gzip
+    and zip content is detected by its magic number and
+    decompressed on the fly, without extracting to disk.
+    For zip archives the first member ending with suffix
+    (e.g. '.fit') is opened, or the first member if None.
+    """
+    with contextlib.ExitStack() as stack:
+        if isinstance(source, (bytes, bytearray)):
+            fileobj = io.BytesIO(source)
+        elif isinstance(source, (str, os.PathLike)):
+            fileobj = stack.enter_context(open(source, 'rb'))
+        else:
+            fileobj = source
+
+        magic = _peek_(fileobj, len(ZIP_MAGIC))
+
+        if magic.startswith(GZIP_MAGIC):
+            fileobj = stack.enter_context(gzip.GzipFile(fileobj=fileobj, mode='rb'))
+        elif magic == ZIP_MAGIC:
+            archive = stack.enter_context(zipfile.ZipFile(fileobj))
+            fileobj = stack.enter_context(archive.open(_zip_member_(archive, suffix)))
+
+        yield fileobj
+
+
+def _peek_(fileobj, size):
+
+    if hasattr(fileobj, 'peek'):
+        return fileobj.peek(size)[:size]
+
+    position = fileobj.tell()
+    magic = fileobj.read(size)
+    fileobj.seek(position)
+    return magic
+
+
+def _zip_member_(archive, suffix):
+
+    names = [info.filename for info in archive.infolist() if not info.is_dir()]
+    if suffix is not None:
+        names = [name for name in names if name.lower().endswith(suffix.lower())]
+    if not names:
+        raise ValueError("No %s member in zip archive" % (suffix or 'file'))
+    return names[0]
+
+
+def iter_zip_member(chunks, suffix=None):
+    """
+    Yield the decompressed content of the first zip member ending
+    with suffix (or the first member), reading the zip as an
+    iterable of byte chunks, e.g. a streamed HTTP response.
+    Only the local file headers are used, so the archive never
+    has to be complete, seekable or held in memory.
+    """
+    chunks = iter(chunks)
+    buffer = bytearray()
+
+    def fill(size):
+        while len(buffer) < size:
+            chunk = next(chunks, None)
+            if chunk is None:
+                return False
+            buffer.extend(chunk)
+        return True
+
+    while fill(ZIP_HEADER_SIZE) and buffer[:4] == ZIP_MAGIC:
+        flags, method = struct.unpack_from('<HH', buffer, 6)
+        compressed_size, = struct.unpack_from('<I', buffer, 18)
+        name_size, extra_size = struct.unpack_from('<HH', buffer, 26)
+        if not fill(ZIP_HEADER_SIZE + name_size + extra_size):
+            break
+        name = bytes(buffer[ZIP_HEADER_SIZE:ZIP_HEADER_SIZE + name_size]).decode('utf-8', 'replace')
+        del buffer[:ZIP_HEADER_SIZE + name_size + extra_size]
+
+        wanted = not name.endswith('/') and (suffix is None or name.lower().endswith(suffix.lower()))
+        has_descriptor = flags & 0x08
+
+        if method == zipfile.ZIP_DEFLATED:
+            decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+            while not decompressor.eof:
+                if not buffer and not fill(1):
+                    raise ValueError("Truncated zip member %s" % name)
+                data = decompressor.decompress(bytes(buffer))
+                buffer[:] = decompressor.unused_data
+                if wanted and data:
+                    yield data
+            if wanted:
+                return
+        elif method == zipfile.ZIP_STORED and not has_descriptor:
+            remaining = compressed_size
+            while remaining:
+                if not buffer and not fill(1):
+                    raise ValueError("Truncated zip member %s" % name)
+                data = bytes(buffer[:remaining])
+                del buffer[:len(data)]
+                remaining -= len(data)
+                if wanted:
+                    yield data
+            if wanted:
+                return
+        else:
+            raise ValueError("Unsupported zip member %s" % name)
+
+        if has_descriptor:
+            fill(4)
+            descriptor_size = 16 if buffer[:4] == ZIP_DESCRIPTOR_MAGIC else 12
+            fill(descriptor_size)
+            del buffer[:descriptor_size]
+
+    raise ValueError("No %s member in zip archive" % (suffix or 'file'))
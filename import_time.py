@@ -0,0 +1,76 @@
+"""
+Cold start import time check.
+
+Every module is imported in a fresh interpreter (best of REPEAT runs)
+and must stay under its budget, in seconds, without loading the
+plotting libraries, which only the plotting functions import.
+
+Usage: python import_time.py (exits 1 over budget),
+or through pytest in tests/test_import_time.py
+"""
+
+import subprocess
+import sys
+
+REPEAT = 3
+PLOTTING = ('matplotlib', 'seaborn')
+
+BUDGETS = {
+    'cli': 0.05,
+    'helper': 0.05,
+    'instrument': 0.05,
+    'zones': 0.3,
+    'resample': 0.3,
+    'fitrecords': 0.3,
+    'geodesy': 0.3,
+    'correlation': 0.3,
+    'garminconnect': 0.4,
+    'lapcsv': 0.8,
+    'tcxtools': 0.8,
+    'loader': 0.8,
+    'activity': 0.8,
+    'archive': 0.8,
+    'pmc': 0.8,
+    'graph': 0.8,
+    'report': 1.0,
+}
+
+PROBE = """
+import sys, time
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+print(seconds, ','.join(name for name in {plotting!r} if name in sys.modules))
+"""
+
+
+def import_time(module):
+    """
+    Return the best cold import time of a module in seconds
+    and the plotting libraries it loaded.
+    """
+    best, loaded = None, ''
+    for _ in range(REPEAT):
+        output = subprocess.run([sys.executable, '-c', PROBE.format(module=module, plotting=PLOTTING)],
+                                check=True, capture_output=True, text=True).stdout.split()
+        seconds, loaded = float(output[0]), output[1] if len(output) > 1 else ''
+        best = seconds if best is None else min(best, seconds)
+    return best, loaded
+
+
+def main():
+    failed = 0
+    for module, budget in BUDGETS.items():
+        seconds, loaded = import_time(module)
+        status = 'ok'
+        if seconds > budget:
+            status = 'OVER BUDGET'
+        elif loaded:
+            status = 'LOADS ' + loaded
+        failed += status != 'ok'
+        print('%-14s %6.3f s / %.2f s  %s' % (module, seconds, budget, status))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
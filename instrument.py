@@ -0,0 +1,286 @@
+"""
+Lightweight instrumentation of the hot paths.
+
+Stages are timed with span() and events counted with count()
+(trackpoints parsed, bytes read, files skipped, HTTP requests,
+429 responses, bytes downloaded, ...). Nothing is recorded until
+a sink is enabled: span() then returns a shared no-op context and
+count() returns after a single global check, so the calls stay in
+the hot paths at no measurable cost.
+
+Sinks aggregate the spans (calls, total, max seconds) and counters
+of the process; JSONLinesSink also appends every event to a file,
+which forked worker processes (e.g. the PMC pool) share, and
+PrometheusSink writes the aggregates in the Prometheus text format.
+
+    instrument.configure('jsonl:metrics.jsonl')
+    ...
+    print(instrument.summary())
+"""
+
+import json
+import os
+import threading
+import time
+
+PREFIX = 'garmin_parser'
+
+_sink_ = None
+
+
+class _NullSpan(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_SPAN = _NullSpan()
+
+
+class _Span(object):
+    __slots__ = ('sink', 'name', 'start')
+
+    def __init__(self, sink, name):
+        self.sink = sink
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.sink.record_span(self.name, time.perf_counter() - self.start)
+        return False
+
+
+def span(name):
+    """
+    Return a context manager timing the stage name.
+    """
+    if _sink_ is None:
+        return NULL_SPAN
+    return _Span(_sink_, name)
+
+
+def count(name, value=1):
+    """
+    Add value to the counter name.
+    """
+    if _sink_ is not None:
+        _sink_.record_count(name, value)
+
+
+def observe(name, seconds):
+    """
+    Record a duration measured elsewhere (e.g. an HTTP request) as a span.
+    """
+    if _sink_ is not None:
+        _sink_.record_span(name, seconds)
+
+
+def enabled():
+    return _sink_ is not None
+
+
+def enable(sink):
+    """
+    Record into sink from now on, return it.
+    """
+    global _sink_
+    disable()
+    _sink_ = sink
+    return sink
+
+
+def disable():
+    """
+    Stop recording, flush and return the sink (None if disabled).
+    """
+    global _sink_
+    sink, _sink_ = _sink_, None
+    if sink is not None:
+        sink.close()
+    return sink
+
+
+def get_sink():
+    return _sink_
+
+
+def configure(spec):
+    """
+    Enable a sink from a specification: 'memory', 'jsonl:<path>'
+    or 'prometheus:<path>'. None or '' disables recording.
+    """
+    if not spec:
+        return disable()
+    kind, _, path = spec.partition(':')
+    if kind == 'memory':
+        return enable(MemorySink())
+    if kind == 'jsonl' and path:
+        return enable(JSONLinesSink(path))
+    if kind == 'prometheus' and path:
+        return enable(PrometheusSink(path))
+    raise ValueError("Unknown metrics sink %s" % spec)
+
+
+class MemorySink(object):
+    """
+    Aggregates the spans and counters of the process.
+    """
+
+    def __init__(self):
+        self.spans = {}  # name -> [calls, total seconds, max seconds]
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def record_span(self, name, seconds):
+        with self.lock:
+            stats = self.spans.get(name)
+            if stats is None:
+                self.spans[name] = [1, seconds, seconds]
+            else:
+                stats[0] += 1
+                stats[1] += seconds
+                stats[2] = max(stats[2], seconds)
+
+    def record_count(self, name, value):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.flush()
+
+
+class JSONLinesSink(MemorySink):
+    """
+    Appends every span and count to path as a JSON line, and
+    aggregates them like MemorySink. Each process opens the file
+    itself, so the events of forked workers land in it too.
+
+    Parameters
+    ----------
+    path : string, the JSON lines file, appended to
+
+    """
+
+    def __init__(self, path):
+        super(JSONLinesSink, self).__init__()
+        self.path = path
+        self.file = None
+        self.pid = None
+        # Where the events of this run start
+        self.offset = os.path.getsize(path) if os.path.exists(path) else 0
+
+    def _write_(self, event):
+        with self.lock:
+            if self.pid != os.getpid():
+                # Do not share the parent buffer after a fork
+                self.file = open(self.path, 'a', buffering=1)
+                self.pid = os.getpid()
+            self.file.write(json.dumps(event) + '\n')
+
+    def record_span(self, name, seconds):
+        super(JSONLinesSink, self).record_span(name, seconds)
+        self._write_({'span': name, 'seconds': seconds, 'pid': os.getpid(), 'time': time.time()})
+
+    def record_count(self, name, value):
+        super(JSONLinesSink, self).record_count(name, value)
+        self._write_({'count': name, 'value': value, 'pid': os.getpid(), 'time': time.time()})
+
+    def flush(self):
+        with self.lock:
+            if self.file is not None and self.pid == os.getpid():
+                self.file.flush()
+
+    def close(self):
+        with self.lock:
+            if self.file is not None and self.pid == os.getpid():
+                self.file.close()
+            self.file = self.pid = None
+
+
+class PrometheusSink(MemorySink):
+    """
+    Aggregates like MemorySink and writes the aggregates to path
+    in the Prometheus text exposition format (for the node exporter
+    textfile collector) on flush and close.
+    """
+
+    def __init__(self, path):
+        super(PrometheusSink, self).__init__()
+        self.path = path
+
+    def flush(self):
+        with self.lock:
+            spans = sorted(self.spans.items())
+            counters = sorted(self.counters.items())
+
+        lines = ['# TYPE %s_span_seconds summary' % PREFIX]
+        for name, (calls, total, _) in spans:
+            lines.append('%s_span_seconds_count{span="%s"} %d' % (PREFIX, _label_(name), calls))
+            lines.append('%s_span_seconds_sum{span="%s"} %r' % (PREFIX, _label_(name), total))
+        lines.append('# TYPE %s_span_seconds_max gauge' % PREFIX)
+        for name, (_, _, longest) in spans:
+            lines.append('%s_span_seconds_max{span="%s"} %r' % (PREFIX, _label_(name), longest))
+        lines.append('# TYPE %s_events_total counter' % PREFIX)
+        for name, value in counters:
+            lines.append('%s_events_total{event="%s"} %r' % (PREFIX, _label_(name), value))
+
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as metrics_file:
+            metrics_file.write('\n'.join(lines) + '\n')
+        os.replace(tmp_path, self.path)
+
+
+def _label_(value):
+
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def read_jsonl(path, offset=0):
+    """
+    Aggregate the events of a JSON lines file from offset,
+    written by every process of a batch run, into a MemorySink.
+    """
+    sink = MemorySink()
+    with open(path) as events:
+        events.seek(offset)
+        for line in events:
+            event = json.loads(line)
+            if 'span' in event:
+                sink.record_span(event['span'], event['seconds'])
+            else:
+                sink.record_count(event['count'], event['value'])
+    return sink
+
+
+def summary(sink=None):
+    """
+    Return a text report of the spans and counters of sink
+    (the enabled one by default).
+    """
+    sink = _sink_ if sink is None else sink
+    if sink is None:
+        return 'Instrumentation disabled'
+    if isinstance(sink, JSONLinesSink) and os.path.exists(sink.path):
+        # Including the events of the worker processes
+        sink.flush()
+        sink = read_jsonl(sink.path, sink.offset)
+    with sink.lock:
+        spans = sorted(sink.spans.items(), key=lambda item: -item[1][1])
+        counters = sorted(sink.counters.items())
+
+    lines = ['%-32s %8s %10s %10s %10s' % ('span', 'calls', 'total s', 'mean ms', 'max ms')]
+    lines += ['%-32s %8d %10.3f %10.2f %10.2f' % (name, calls, total, total / calls * 1000, longest * 1000)
+              for name, (calls, total, longest) in spans]
+    lines.append('%-32s %8s' % ('counter', 'value'))
+    lines += ['%-32s %8s' % (name, value) for name, value in counters]
+    return '\n'.join(lines)
@@ -0,0 +1,140 @@
+"""
+Vectorized reader of the Garmin Connect lap/split CSV exports.
+
+Duration and pace columns ('19:18', '1:07:15', '00:02:49.037',
+'0:05:36  ') are parsed into float seconds with column-wide
+string operations, '--' placeholders are read as NaN and the
+derived Power (w) and Energy (kj) columns are computed in bulk.
+"""
+
+import numpy as np
+import pandas as pd
+
+from tcxtools import POWER_CONSTANT
+
+# Per-sport layout of the exports, as in the sample files:
+# the duration columns (renamed '<column> (s)') and the numeric ones
+SCHEMAS = {
+    'cycling': {
+        'durations': ['Time', 'Cumulative Time', 'Moving Time'],
+        'numbers': ['Distance', 'Avg Speed', 'Avg HR', 'Max HR', 'Elev Gain', 'Elev Loss',
+                    'Calories', 'Max Speed', 'Avg Moving Speed'],
+    },
+    'rowing': {
+        'durations': ['Time', 'Cumulative Time', 'Avg Pace', 'Moving Time'],
+        'numbers': ['Distance', 'Avg HR', 'Max HR', 'Avg Stroke Rate', 'Max Stroke Rate', 'Calories'],
+    },
+    'stairs': {
+        'durations': ['Time', 'Cumulative Time', 'Moving Time'],
+        'numbers': ['Distance', 'Avg Speed', 'Avg HR', 'Max HR', 'Calories'],
+    },
+    'running': {
+        'durations': ['Time', 'Moving Time', 'Avg Pace', 'Avg Moving Paces', 'Best Pace'],
+        'numbers': ['Distance', 'Elevation Gain', 'Elev Loss', 'Avg Run Cadence', 'Max Run Cadence',
+                    'Avg Stride Length', 'Avg HR', 'Max HR', 'Avg Temperature', 'Calories'],
+    },
+}
+
+NA_VALUES = ['--', '']
+
+
+def detect_sport(columns):
+    """
+    Return the SCHEMAS sport whose duration columns are all in the
+    header, the one sharing the most columns with it (then missing
+    the fewest) when several are, or None
+    """
+    columns = set(columns)
+    best, best_score = None, None
+    for sport, schema in SCHEMAS.items():
+        if not set(schema['durations']) <= columns:
+            continue
+        known = set(schema['durations']) | set(schema['numbers'])
+        score = (len(known & columns), -len(known - columns))
+        if best_score is None or score > best_score:
+            best, best_score = sport, score
+    return best
+
+
+def label_column(columns):
+    """
+    Return the lap label column of an export: 'Laps' or 'Split'
+    """
+    return 'Split' if 'Split' in columns else 'Laps'
+
+
+def to_seconds(durations):
+    """
+    Convert a Series of '[[h:]m:]s[.f]' strings to float seconds,
+    NaN for missing values.
+    """
+    text = durations.astype('string').str.strip()
+    parts = text.str.split(':', n=2, expand=True)
+    parts = parts.reindex(columns=range(3))
+    parts = parts.apply(pd.to_numeric, errors='coerce').to_numpy(dtype=float)
+    colons = text.str.count(':').to_numpy(dtype=float, na_value=np.nan)
+
+    # Right align the parts as hours, minutes and seconds
+    seconds = np.where(colons == 2, parts[:, 0] * 3600 + parts[:, 1] * 60 + parts[:, 2],
+                       np.where(colons == 1, parts[:, 0] * 60 + parts[:, 1], parts[:, 0]))
+    return pd.Series(seconds, index=durations.index)
+
+
+def read_laps(filepath_or_buffer, sport=None):
+    """
+    Read a Garmin lap CSV export into a typed DataFrame.
+
+    Parameters
+    ----------
+    filepath_or_buffer : anything pd.read_csv accepts
+    sport : string, a SCHEMAS key, detected from the header if None
+
+    Returns
+    -------
+    DataFrame with the lap label column as text, the durations as
+    float seconds in '<column> (s)' columns, the other columns as
+    numbers (NaN for '--'), or as text when a column unknown to the
+    layout is not numeric, and the derived 'Power (w)' and
+    'Energy (kj)' columns (NaN without Calories).
+    """
+    laps_df = pd.read_csv(filepath_or_buffer, dtype=str, na_values=NA_VALUES, keep_default_na=False)
+    sport = detect_sport(laps_df.columns) if sport is None else sport
+    if sport is None:
+        raise ValueError("Unknown lap CSV layout %s" % list(laps_df.columns))
+    schema = SCHEMAS[sport]
+
+    columns = {label_column(laps_df.columns): laps_df[label_column(laps_df.columns)]}
+    for name in laps_df.columns:
+        if name in schema['durations']:
+            columns[name + ' (s)'] = to_seconds(laps_df[name])
+        elif name in schema['numbers']:
+            columns[name] = pd.to_numeric(laps_df[name].str.strip(), errors='coerce')
+        elif name not in columns:
+            columns[name] = _numeric_or_text_(laps_df[name].str.strip())
+    laps_df = pd.DataFrame(columns)
+
+    # Calculating Power in watts
+    calories = laps_df['Calories'] if 'Calories' in laps_df else np.nan
+    laps_df['Power (w)'] = calories * POWER_CONSTANT / laps_df['Time (s)']
+    # Calculating Energy in kilojoules
+    laps_df['Energy (kj)'] = (laps_df['Power (w)'] * laps_df['Time (s)']) / 1000
+
+    return laps_df
+
+
+def _numeric_or_text_(values):
+
+    numbers = pd.to_numeric(values, errors='coerce')
+    if numbers.isnull().equals(values.isnull()):
+        return numbers
+    return values
+
+
+def read_many(paths, sport=None):
+    """
+    Read many lap CSV exports into one DataFrame, with a 'file' column
+    """
+    frames = [read_laps(path, sport).assign(file=str(path)) for path in paths]
+    if not frames:
+        return pd.DataFrame()
+    return pd.concat(frames, ignore_index=True)
@@ -0,0 +1,240 @@
+"""
+Load FIT, TCX and Garmin CSV activity files
+into Pandas DataFrames, with a fast "peek" path
+that reads only the head of a file to find the
+activity date.
+"""
+
+import datetime
+import io
+import os
+import re
+import struct
+
+import pandas as pd
+from lxml import etree
+
+import fitrecords
+import helper
+import instrument
+from tcxtools import TCXNS, TCXPandas
+
+FIT = 'fit'
+TCX = 'tcx'
+CSV = 'csv'
+
+EXTENSIONS = {'.fit': FIT, '.tcx': TCX, '.csv': CSV}
+
+# Bytes read from the start of a file when peeking its date
+PEEK_SIZE = 4096
+
+# FIT timestamps count seconds since 1989-12-31 00:00 UTC
+FIT_EPOCH = datetime.datetime(1989, 12, 31, tzinfo=datetime.timezone.utc)
+FIT_FILE_ID = 0
+FIT_TIME_CREATED = 4
+FIT_TIMESTAMP = 253
+
+# TCXPandas column names translated to the FIT record field names
+TCX_COLUMNS = {
+    'time': 'timestamp',
+    'hr': 'heart_rate',
+    'speed (m/s)': 'speed',
+}
+
+
+def is_activity_file(filename):
+    """
+    Whether the file name looks like a loadable activity,
+    optionally .gz compressed or an original Garmin .zip
+    """
+    name = filename.lower()
+    if name.endswith('.zip'):
+        return True
+    if name.endswith('.gz'):
+        name = name[:-len('.gz')]
+    return os.path.splitext(name)[1] in EXTENSIONS
+
+
+def find_activities(directory, prefer='.tcx'):
+    """
+    Group the activity files of a directory by activity id.
+    When an activity has several track files, the one with
+    the prefer extension (e.g. '.fit') is kept.
+    :return dict of activity id to {'track': path, 'laps': path}:
+    """
+    activities = {}
+    for name in sorted(os.listdir(directory)):
+        if not is_activity_file(name):
+            continue
+        match = re.search(r'\d+', name)
+        activity_id = match.group() if match else os.path.splitext(name)[0]
+        base = name[:-len('.gz')] if name.lower().endswith('.gz') else name
+        kind = 'laps' if EXTENSIONS.get(os.path.splitext(base)[1].lower()) == CSV else 'track'
+        files = activities.setdefault(activity_id, {})
+        if kind not in files or base.lower().endswith(prefer):
+            files[kind] = os.path.join(directory, name)
+    return activities
+
+
+def sniff_format(head):
+    """
+    Return FIT, TCX or CSV from the first (decompressed) bytes of a file.
+    """
+    if len(head) >= 12 and head[8:12] == b'.FIT':
+        return FIT
+    if head.lstrip(b'\xef\xbb\xbf \t\r\n').startswith(b'<'):
+        return TCX
+    return CSV
+
+
+def peek_date(source):
+    """
+    Return the activity date reading only the first PEEK_SIZE bytes:
+    the FIT file_id time_created (or the first timestamp) or the
+    TCX Activity Id. Returns None when the date cannot be found,
+    which is always the case for Garmin lap CSV exports.
+    """
+    with helper.open_activity(source) as activity_file:
+        head = activity_file.read(PEEK_SIZE)
+    instrument.count('peek.bytes', len(head))
+
+    fmt = sniff_format(head)
+    if fmt == FIT:
+        timestamp = _peek_fit_timestamp_(head)
+    elif fmt == TCX:
+        timestamp = _peek_tcx_timestamp_(head)
+    else:
+        timestamp = None
+
+    return None if timestamp is None else timestamp.date()
+
+
+def load_workout(source, fields=None):
+    """
+    Load an activity into a DataFrame of records, one row per sample,
+    using the FIT field names (timestamp, heart_rate, power, ...).
+    If fields is given only those columns are loaded, which for FIT
+    files means only those fields are decoded.
+    Garmin CSV exports have no samples, their laps are returned as is.
+    """
+    with instrument.span('load.read'), helper.open_activity(source) as activity_file:
+        data = activity_file.read()
+    instrument.count('load.files')
+    instrument.count('load.bytes', len(data))
+
+    fmt = sniff_format(data[:PEEK_SIZE])
+    if fmt == FIT:
+        return pd.DataFrame(fitrecords.read_records(data, fields))
+    if fmt == TCX:
+        workout = _load_tcx_(data)
+        if fields is not None:
+            workout = workout[[name for name in fields if name in workout]]
+        return workout
+    return pd.read_csv(io.BytesIO(data))
+
+
+def load_activity(source):
+    """
+    Load a FIT or TCX activity into a compact activity.Activity.
+    """
+    from activity import Activity
+
+    with instrument.span('load.read'), helper.open_activity(source) as activity_file:
+        data = activity_file.read()
+    instrument.count('load.files')
+    instrument.count('load.bytes', len(data))
+
+    fmt = sniff_format(data[:PEEK_SIZE])
+    if fmt == FIT:
+        return Activity.from_fit(data)
+    if fmt == TCX:
+        return Activity.from_tcx(data)
+    raise ValueError("Garmin CSV exports have no trackpoints")
+
+
+def get_date(workout):
+    """
+    Return the date of a workout loaded with load_workout,
+    or None if it has no timestamp.
+    """
+    if 'timestamp' not in workout or workout['timestamp'].isnull().all():
+        return None
+    return workout['timestamp'].dropna().iloc[0].date()
+
+
+def _load_tcx_(data):
+
+    traverse_dataframe, _ = TCXPandas(data).parse()
+    workout = traverse_dataframe.rename(columns=TCX_COLUMNS)
+    # FIT timestamps are naive UTC datetimes
+    workout['timestamp'] = workout['timestamp'].dt.tz_convert(None)
+    return workout
+
+
+def _peek_fit_timestamp_(head):
+
+    header_size = head[0]
+    offset = header_size
+    definitions = {}
+
+    try:
+        while offset < len(head):
+            record_header = head[offset]
+            offset += 1
+
+            if record_header & 0x80:
+                # Compressed timestamp header, data message only
+                definition = definitions[(record_header >> 5) & 0x03]
+            elif record_header & 0x40:
+                # Definition message
+                architecture = head[offset + 1]
+                endian = '>' if architecture == 1 else '<'
+                global_number, = struct.unpack_from(endian + 'H', head, offset + 2)
+                field_count = head[offset + 4]
+                offset += 5
+
+                fields = []
+                for _ in range(field_count):
+                    number, size = head[offset], head[offset + 1]
+                    fields.append((number, size))
+                    offset += 3
+
+                developer_size = 0
+                if record_header & 0x20:
+                    developer_count = head[offset]
+                    offset += 1
+                    for _ in range(developer_count):
+                        developer_size += head[offset + 1]
+                        offset += 3
+
+                definitions[record_header & 0x0F] = (endian, global_number, fields, developer_size)
+                continue
+            else:
+                definition = definitions[record_header & 0x0F]
+
+            endian, global_number, fields, developer_size = definition
+            for number, size in fields:
+                if size == 4 and (number == FIT_TIMESTAMP or
+                                  (global_number == FIT_FILE_ID and number == FIT_TIME_CREATED)):
+                    seconds, = struct.unpack_from(endian + 'I', head, offset)
+                    if seconds != 0xFFFFFFFF and seconds != 0:
+                        return FIT_EPOCH + datetime.timedelta(seconds=seconds)
+                offset += size
+            offset += developer_size
+    except (KeyError, IndexError, struct.error):
+        # Truncated head or unsupported layout
+        return None
+
+    return None
+
+
+def _peek_tcx_timestamp_(head):
+
+    parser = etree.XMLPullParser(events=('end',), tag=TCXNS + 'Id', recover=True)
+    parser.feed(head)
+    for _, element in parser.read_events():
+        parent = element.getparent()
+        if parent is not None and parent.tag == TCXNS + 'Activity' and element.text:
+            return pd.Timestamp(element.text.strip()).to_pydatetime()
+
+    return None
@@ -16,96 +16,347 @@ Zone 5c More than 106% of LTHR | 140 TSS/hr
 
 import os
 import datetime
-from fitparse import FitFile
+import functools
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
 from tqdm import tqdm
 
+import instrument
+import zones
+from loader import find_activities, get_date, load_workout, peek_date
+
 
 lthr = 171.0  # Lactat Threshold Heart Rate Value
 my_ftp = 311  # Functional Threshold Power
 start_date = datetime.date(2019, 1, 1)
 end_date = datetime.date.today()
 directory = 'fitfiles'
+workers = os.cpu_count()  # Processes parsing the workouts
+fields = ['timestamp', 'heart_rate', 'power']  # Record fields used by the TSS
+chunksize = 16  # Files submitted to a worker at once
+ledger_file = 'pmc_ledger.csv'  # Per-activity TSS of previous runs
+pmc_file = 'pmc.csv'  # Daily PMC of the previous run
+
+CTL_DAYS = 42  # Chronic Training Load window
+ATL_DAYS = 7  # Acute Training Load window
+
+LEDGER_COLUMNS = ['path', 'size', 'mtime', 'date', 'tss', 'ftp', 'lthr']
 
 
-def get_tss(workout_df):
+def get_tss(workout_df, ftp=None):
     """
     Calculates the TSS based on Power.
     :param workout_df:
+    :param ftp: defaults to my_ftp, may be a vector of candidates
     :return tss:
     """
-    # Normalized Power
-    norm_power = np.sqrt(np.sqrt(np.mean(workout_df['power'].rolling(30).mean() ** 4)))
-    # Intensity
-    intensity = norm_power / my_ftp
-    # Moving time in seconds
-    moving_time = int((workout_df['timestamp'].values[-1] - workout_df['timestamp'].values[0]) / 1000000000)
-    # Trainings Stress Score
-    workout_tss = (moving_time * norm_power * intensity) / (my_ftp * 3600.0) * 100.0
-    return workout_tss
+    ftp = my_ftp if ftp is None else ftp
+    with instrument.span('pmc.tss'):
+        # Normalized Power of the power resampled to 1 Hz
+        power = zones.power_1hz(workout_df['timestamp'].values, workout_df['power'].values)
+        norm_power = zones.normalized_power(power)
+        # Moving time in seconds
+        moving_time = zones.moving_time(workout_df['timestamp'].values)
+        # Trainings Stress Score
+        return zones.power_tss(norm_power, moving_time, ftp)
 
 
-def get_hr_tss(workout_df):
+def get_hr_tss(workout_df, threshold_hr=None):
     """
     Calculates the TSS based on Heart Rate.
+    The workout dataframe is left untouched.
     :param workout_df:
+    :param threshold_hr: defaults to lthr, may be a vector of candidates
     :return hr_tss:
     """
-    hr_zones = (pd.Series([0, 0.73, 0.77, 0.81, 0.85, 0.89, 0.93, 0.99, 1.03, 1.06, 2]) * lthr).to_list()
-    workout_df['hrZone'] = pd.cut(workout_df['heart_rate'], hr_zones, labels=['Z1 low', 'Z1', 'Z1 high', 'Z2 low',
-                                                                              'Z2 high', 'Z3', 'Z4', 'Z5a', 'Z5b',
-                                                                              'Z5c'])
-    workout_df['hrTSS'] = pd.cut(workout_df['heart_rate'], hr_zones,
-                                 labels=[20, 30, 40, 50, 60, 70, 80, 100, 120, 140])
-    workout_df['hrTSS'] = workout_df['hrTSS'].astype(int)
-    hr_tss = np.sum(workout_df['hrTSS'].values) / 3600
-    return hr_tss
-
-
-# Create a PMC dataframe
-# based on date range
-date_range = pd.date_range(start_date, end_date).date
-df = pd.DataFrame(index=date_range)
-
-df['date'] = df.index
-df['TSS'] = 0
-
-# Loop through
-# fitfile directory
-for filename in tqdm(os.listdir(directory)):
-    if filename.endswith('.fit'):
-        workout = load_workout((os.path.join(directory, filename)))
-        date = get_date(workout)
-        if date not in df.index:
-            # File not in date range
-            continue
-        if 'power' in workout:
-            df.loc[date, 'TSS'] += get_tss(workout)
-        elif 'heart_rate' in workout:
-            df.loc[date, 'TSS'] += get_hr_tss(workout)
+    threshold_hr = lthr if threshold_hr is None else threshold_hr
+    with instrument.span('pmc.hr_tss'):
+        # One sample per second
+        heart_rate = zones.hr_1hz(workout_df['timestamp'].values, workout_df['heart_rate'].values)
+        return zones.hr_tss(heart_rate, threshold_hr)
+
+
+def score_workout(path, first_date, last_date, ftp=None, threshold_hr=None):
+    """
+    Loads a workout and calculates its TSS.
+    Runs in the worker processes of build_pmc.
+    :return (date, tss, path), None if the workout is out of range:
+    the tss is NaN (and the date None) when it has no power/HR (or no date)
+    """
+    # Read only the head of the file
+    # to skip it before decoding
+    date = peek_date(path)
+    if date is not None and not first_date <= date <= last_date:
+        return None
+    workout = load_workout(path, fields)
+    date = get_date(workout)
+    if date is None:
+        return None, np.nan, path
+    if not first_date <= date <= last_date:
+        return None
+    if 'power' in workout:
+        return date, get_tss(workout, ftp), path
+    elif 'heart_rate' in workout:
+        return date, get_hr_tss(workout, threshold_hr), path
+    # File does not contain power/HR
+    return date, np.nan, path
+
+
+def score_workouts(paths, first_date, last_date, ftp=None, threshold_hr=None,
+                   max_workers=None, chunksize=chunksize):
+    """
+    Scores the workouts in a process pool of max_workers (serially if 1).
+    :return list of score_workout results, in the order of paths:
+    """
+    score = functools.partial(score_workout, first_date=first_date, last_date=last_date,
+                              ftp=ftp, threshold_hr=threshold_hr)
+
+    with instrument.span('pmc.score'):
+        if max_workers == 1:
+            scores = list(tqdm(map(score, paths), total=len(paths)))
         else:
-            # File does not contain power/HR
-            continue
-
-# Plot PMC
-fig, ax = plt.subplots()
-df['CTL'] = df['TSS'].rolling(42, min_periods=1).mean()
-df['ATL'] = df['TSS'].rolling(7, min_periods=1).mean()
-df['TSB'] = df['CTL'] - df['ATL']
-# Plot CTL ATL and TSB
-df[['CTL', 'ATL', 'TSB']].plot(ax=ax, title='Performance Management Chart')
-plt.ylabel('CTL  /  ATL  /  TSB')
-# Second y axis
-ax2 = ax.twinx()
-df[['TSS']].plot(ax=ax2, style='o')
-plt.ylabel('TSS')
-ax.set_axisbelow(True)
-ax.minorticks_on()
-ax.grid(which='major', linestyle='-', linewidth='0.5', color='black')
-ax.grid(which='minor', linestyle=':', linewidth='0.5', color='black')
-# Upper and lower limits
-# for y axis
-plt.ylim(5, max(df['TSS'] + 5))
-plt.show()
\ No newline at end of file
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                scores = list(tqdm(executor.map(score, paths, chunksize=chunksize), total=len(paths)))
+
+    skipped = sum(item is None or np.isnan(item[1]) for item in scores)
+    instrument.count('pmc.files_scored', len(scores) - skipped)
+    instrument.count('pmc.files_skipped', skipped)
+    return scores
+
+
+def daily_tss(scores, first_date, last_date):
+    """
+    Sums (date, tss, path) scores per day, in the order given.
+    Scores without a date or with a NaN tss count for nothing.
+    :return pmc_df:
+    """
+    # Create a PMC dataframe
+    # based on date range
+    date_range = pd.date_range(first_date, last_date).date
+    pmc_df = pd.DataFrame(index=date_range)
+
+    pmc_df['date'] = pmc_df.index
+    pmc_df['TSS'] = 0
+    scores = [item for item in scores if item is not None and pd.notnull(item[0])]
+    if scores:
+        dates, tss, _ = zip(*scores)
+        tss_sum = pd.Series(tss, dtype=float).groupby(list(dates), sort=False).sum()
+        pmc_df['TSS'] = tss_sum.reindex(pmc_df.index, fill_value=0)
+    return pmc_df
+
+
+def workout_paths(directory):
+    """
+    The track file of every activity of a directory, a FIT preferred
+    to the TCX of the same activity so it is only scored once.
+    Lap CSV exports are left out.
+    """
+    activities = find_activities(directory, prefer='.fit')
+    return sorted(files['track'] for files in activities.values() if 'track' in files)
+
+
+def build_pmc(directory, first_date, last_date, ftp=None, threshold_hr=None,
+              max_workers=None, chunksize=chunksize):
+    """
+    Builds the daily TSS dataframe of the PMC.
+    Workouts are summed per day in file name order,
+    so the result does not depend on the number of workers.
+    :return pmc_df:
+    """
+    paths = workout_paths(directory)
+    scores = score_workouts(paths, first_date, last_date, ftp, threshold_hr, max_workers, chunksize)
+    return daily_tss(scores, first_date, last_date)
+
+
+def summarize_workout(path, first_date, last_date):
+    """
+    Loads and summarizes a workout for threshold sweeps.
+    Runs in the worker processes of sweep_pmc.
+    :return (date, zones.Summary, path) or None if the workout is out of range:
+    """
+    date = peek_date(path)
+    if date is not None and not first_date <= date <= last_date:
+        return None
+    workout = load_workout(path, fields)
+    date = get_date(workout)
+    if date is None or not first_date <= date <= last_date:
+        return None
+    return date, zones.summarize(workout), path
+
+
+def sweep_pmc(directory, first_date, last_date, ftps=None, threshold_hrs=None,
+              max_workers=None, chunksize=chunksize):
+    """
+    Builds the daily TSS for many candidate thresholds at once.
+    Every workout is parsed a single time and scored for all
+    the (ftp, threshold_hr) pairs, broadcast against each other.
+    :return dataframe of daily TSS with one (FTP, LTHR) column per candidate:
+    """
+    ftps, threshold_hrs = np.broadcast_arrays(
+        np.atleast_1d(my_ftp if ftps is None else ftps).astype(float),
+        np.atleast_1d(lthr if threshold_hrs is None else threshold_hrs).astype(float))
+    paths = workout_paths(directory)
+    summarize = functools.partial(summarize_workout, first_date=first_date, last_date=last_date)
+
+    if max_workers == 1:
+        summaries = list(tqdm(map(summarize, paths), total=len(paths)))
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            summaries = list(tqdm(executor.map(summarize, paths, chunksize=chunksize), total=len(paths)))
+    summaries = [item for item in summaries if item is not None]
+
+    date_range = pd.date_range(first_date, last_date).date
+    columns = pd.MultiIndex.from_arrays([ftps, threshold_hrs], names=['FTP', 'LTHR'])
+    tss = np.zeros((len(date_range), len(columns)))
+    if summaries:
+        dates, workout_summaries, _ = zip(*summaries)
+        # Workouts without power/HR score NaN and are left out
+        scores = np.nan_to_num(np.array([zones.score(summary, ftps, threshold_hrs)
+                                         for summary in workout_summaries]))
+        rows = pd.Index(date_range).get_indexer(list(dates))
+        np.add.at(tss, rows, scores)
+
+    return pd.DataFrame(tss, index=date_range, columns=columns)
+
+
+def load_ledger(path):
+    """
+    Loads the per-activity TSS ledger, indexed by file path.
+    """
+    if not os.path.exists(path):
+        return pd.DataFrame(columns=LEDGER_COLUMNS).set_index('path')
+    ledger = pd.read_csv(path, index_col='path')
+    ledger['date'] = pd.to_datetime(ledger['date']).dt.date
+    return ledger
+
+
+def save_csv(df, path, **kwargs):
+    """
+    Writes a dataframe through a temporary file,
+    so an interrupted run never leaves it half written.
+    """
+    tmp_path = path + '.tmp'
+    df.to_csv(tmp_path, **kwargs)
+    os.replace(tmp_path, path)
+
+
+def update_pmc(directory, first_date, last_date, ftp=None, threshold_hr=None,
+               max_workers=None, ledger_path=ledger_file, pmc_path=pmc_file):
+    """
+    Incrementally updates the PMC.
+    Only files whose size or modification time changed since
+    the ledger was written (or all of them, if the thresholds
+    changed) are scored again, and CTL/ATL/TSB are recomputed
+    from the earliest affected date forward. Files without
+    power/HR or a date are kept in the ledger with a NaN TSS,
+    so they are not parsed again either.
+    :return pmc_df with the CTL, ATL and TSB columns:
+    """
+    ftp = my_ftp if ftp is None else ftp
+    threshold_hr = lthr if threshold_hr is None else threshold_hr
+
+    ledger = load_ledger(ledger_path)
+    files = {}
+    for path in workout_paths(directory):
+        stat = os.stat(path)
+        files[path] = (stat.st_size, stat.st_mtime_ns)
+
+    stale = [path for path, (size, mtime) in files.items()
+             if path not in ledger.index
+             or (ledger.loc[path, 'size'], ledger.loc[path, 'mtime']) != (size, mtime)
+             or (ledger.loc[path, 'ftp'], ledger.loc[path, 'lthr']) != (ftp, threshold_hr)]
+    dropped = ledger.index.difference(list(files)).union(ledger.index.intersection(stale))
+    changed_dates = list(ledger.loc[dropped, 'date'].dropna())
+
+    ledger = ledger.drop(dropped)
+    instrument.count('pmc.files_unchanged', len(files) - len(stale))
+    scores = score_workouts(stale, first_date, last_date, ftp, threshold_hr, max_workers)
+    scored = [item for item in scores if item is not None]
+    if scored:
+        dates, tss, paths = zip(*scored)
+        added = pd.DataFrame({
+            'size': [files[path][0] for path in paths],
+            'mtime': [files[path][1] for path in paths],
+            'date': dates,
+            'tss': tss,
+            'ftp': ftp,
+            'lthr': threshold_hr,
+        }, index=pd.Index(paths, name='path'))
+        ledger = pd.concat([ledger, added]).sort_index()
+        changed_dates.extend(date for date in dates if date is not None)
+    save_csv(ledger, ledger_path)
+
+    pmc_df = daily_tss(zip(ledger['date'], ledger['tss'], ledger.index), first_date, last_date)
+
+    # Reuse the training load of the previous run
+    # up to the earliest changed (or new) day
+    since = pmc_df.index[0]
+    if os.path.exists(pmc_path):
+        previous = pd.read_csv(pmc_path, index_col=0)
+        previous.index = pd.to_datetime(previous.index).date
+        if len(previous) and previous.index[0] == since:
+            changed_dates.append(previous.index[-1] + datetime.timedelta(days=1))
+            since = max(min(changed_dates), since)
+            kept = previous.index.intersection(pmc_df.index)
+            pmc_df.loc[kept, ['CTL', 'ATL', 'TSB']] = previous.loc[kept, ['CTL', 'ATL', 'TSB']]
+
+    with instrument.span('pmc.training_load'):
+        pmc_df = add_training_load(pmc_df, since)
+    save_csv(pmc_df, pmc_path)
+    return pmc_df
+
+
+def add_training_load(pmc_df, since=None):
+    """
+    Adds the CTL, ATL and TSB columns to the PMC dataframe,
+    recomputing only the days from since forward if given.
+    """
+    start = 0
+    if since is not None:
+        if since > pmc_df.index[-1]:
+            return pmc_df
+        start = max(pmc_df.index.get_loc(since) - (CTL_DAYS - 1), 0)
+
+    window = pmc_df['TSS'].iloc[start:]
+    ctl = window.rolling(CTL_DAYS, min_periods=1).mean()
+    atl = window.rolling(ATL_DAYS, min_periods=1).mean()
+    if since is not None:
+        ctl, atl = ctl.loc[since:], atl.loc[since:]
+
+    pmc_df.loc[ctl.index, 'CTL'] = ctl
+    pmc_df.loc[atl.index, 'ATL'] = atl
+    pmc_df.loc[ctl.index, 'TSB'] = ctl - atl
+    return pmc_df
+
+
+def plot_pmc(df):
+    import matplotlib.pyplot as plt
+
+    # Plot PMC
+    fig, ax = plt.subplots()
+    # Plot CTL ATL and TSB
+    df[['CTL', 'ATL', 'TSB']].plot(ax=ax, title='Performance Management Chart')
+    plt.ylabel('CTL  /  ATL  /  TSB')
+    # Second y axis
+    ax2 = ax.twinx()
+    df[['TSS']].plot(ax=ax2, style='o')
+    plt.ylabel('TSS')
+    ax.set_axisbelow(True)
+    ax.minorticks_on()
+    ax.grid(which='major', linestyle='-', linewidth='0.5', color='black')
+    ax.grid(which='minor', linestyle=':', linewidth='0.5', color='black')
+    # Upper and lower limits
+    # for y axis
+    plt.ylim(5, max(df['TSS'] + 5))
+    plt.show()
+
+
+if __name__ == '__main__':
+    # e.g. GARMIN_METRICS=jsonl:pmc_metrics.jsonl to time the run
+    instrument.configure(os.environ.get('GARMIN_METRICS'))
+    pmc_df = update_pmc(directory, start_date, end_date, max_workers=workers)
+    if instrument.enabled():
+        print(instrument.summary())
+        instrument.disable()
+    plot_pmc(pmc_df)
@@ -0,0 +1,203 @@
+"""
+Headless batch reports of a directory of activities.
+
+The charts of the cycling, rowing and stairs notebooks are rendered
+with the Agg backend for every activity of a directory: its TCX or
+FIT trackpoints and its Garmin lap CSV export, matched by activity
+id ('activity_5173186556.tcx', '5173186556.fit' and
+'activity_5173186556.csv' are one activity). Activities are spread
+over a process pool, and every worker draws all its charts on a few
+reused figures.
+
+Usage: python report.py <directory> [-o reports] [-f html] [-w workers]
+"""
+
+import argparse
+import functools
+import html
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from tqdm import tqdm
+
+import correlation
+import graph
+import instrument
+import lapcsv
+from loader import find_activities, load_workout
+
+FORMATS = ('png', 'html')
+DPI = 100
+WIDE = (16, 4)
+TALL = (16, 8)
+SQUARE = (10, 6)
+LAP_MEANS = {
+    'laps_hr': ['Avg HR', 'Max HR'],
+    'laps_power': ['Power (w)', 'Energy (kj)'],
+    'laps_elevation': ['Elev Gain', 'Elev Loss'],
+}
+CORRELATION_COLUMNS = ['Avg HR', 'Max HR', 'Calories', 'Max Speed', 'Avg Speed',
+                       'Max Stroke Rate', 'Avg Stroke Rate', 'Power (w)', 'Energy (kj)']
+SUMMARY = 'Summary'  # Label of the last row of the lap exports
+
+output = 'reports'
+workers = os.cpu_count()  # Processes rendering the activities
+chunksize = 1  # Activities submitted to a worker at once
+
+# Figures of a worker, by size, cleared and reused by every chart
+_figures_ = {}
+
+
+def render(chart, path, figsize, dpi=DPI):
+    """
+    Draw a chart (a function of the axes) on the reused figure
+    of its size and save it.
+    """
+    from matplotlib.figure import Figure
+
+    figure = _figures_.get(figsize)
+    if figure is None:
+        figure = _figures_[figsize] = Figure(figsize=figsize)
+    figure.clear()
+    with instrument.span('report.draw'):
+        chart(figure.add_subplot())
+    with instrument.span('report.save'):
+        figure.savefig(path, dpi=dpi, bbox_inches='tight')
+    instrument.count('report.charts')
+
+
+def charts(track, laps, title=''):
+    """
+    The charts of an activity as (name, chart, figsize),
+    where chart draws on the axes it is given.
+    """
+    if track is not None and 'heart_rate' in track:
+        heart_rate = track.set_index('timestamp')['heart_rate'].rename('hr')
+        yield 'heartrate', lambda ax: graph.heartrate(heart_rate, title, ax=ax), TALL
+        yield 'hr_histogram', lambda ax: graph.overlay_hist(heart_rate.to_frame(), ax=ax), SQUARE
+    if track is not None and 'speed' in track:
+        speed = (track.set_index('timestamp')['speed'] * 3.6).rename('speed (km/h)')
+        yield 'speed', lambda ax: graph.overlay_timeseries(speed.to_frame(), ax=ax), WIDE
+
+    if laps is None or laps.empty:
+        return
+    for name, columns in LAP_MEANS.items():
+        if set(columns) <= set(laps.columns):
+            yield name, lambda ax, columns=columns: graph.mean(laps[columns], ax=ax), WIDE
+    label = lapcsv.label_column(laps.columns)
+    if {'Power (w)', 'Avg HR'} <= set(laps.columns):
+        yield 'laps_power_hr', lambda ax: graph.overlay(laps[label], laps['Power (w)'], laps['Avg HR'], ax=ax), WIDE
+    columns = [column for column in CORRELATION_COLUMNS if column in laps]
+    # Log returns need three laps for a correlation
+    if len(laps) >= 3 and len(columns) >= 2:
+        corr = correlation.get_number(laps[columns])
+        yield 'correlation', lambda ax: correlation.heatmap(corr, ax=ax), SQUARE
+
+
+def report_activity(activity, directory=output, fmt='html', dpi=DPI):
+    """
+    Render the report of one activity into directory/<activity id>/.
+    Runs in the worker processes of build_reports.
+    :param activity: (activity id, {'track': path, 'laps': path})
+    :return (activity id, list of chart file names, error or None),
+    the track charts still rendered when only the laps failed:
+    """
+    activity_id, files = activity
+    target = os.path.join(directory, activity_id)
+    os.makedirs(target, exist_ok=True)
+    laps, error = None, None
+    if 'laps' in files:
+        try:
+            laps = lapcsv.read_laps(files['laps'])
+            laps = laps[laps[lapcsv.label_column(laps.columns)] != SUMMARY]
+        except Exception as err:  # pylint: disable=broad-except
+            instrument.count('report.laps_failed')
+            laps, error = None, 'laps %s: %s' % (type(err).__name__, err)
+
+    try:
+        track = load_workout(files['track']) if 'track' in files else None
+        names = []
+        for name, chart, figsize in charts(track, laps, title=activity_id):
+            render(chart, os.path.join(target, name + '.png'), figsize, dpi)
+            names.append(name + '.png')
+    except Exception as err:  # pylint: disable=broad-except
+        instrument.count('report.failed')
+        return activity_id, [], '%s: %s' % (type(err).__name__, err)
+
+    if fmt == 'html':
+        _write_page_(os.path.join(target, 'index.html'), activity_id, files, names, laps)
+    return activity_id, names, error
+
+
+def _write_page_(path, activity_id, files, names, laps):
+
+    body = ['<h1>%s</h1>' % html.escape(activity_id)]
+    body += ['<p>%s</p>' % html.escape(os.path.basename(source)) for source in files.values()]
+    if laps is not None:
+        body.append(laps.to_html(index=False, float_format='%.1f', na_rep=''))
+    body += ['<h2>%s</h2><img src="%s">' % (html.escape(name[:-len('.png')]), html.escape(name))
+             for name in names]
+    _write_html_(path, activity_id, body)
+
+
+def _write_html_(path, title, body):
+
+    with open(path, 'w') as page:
+        page.write('<!DOCTYPE html>\n<html><head><meta charset="utf-8"><title>%s</title></head>\n<body>\n%s\n'
+                   '</body></html>\n' % (html.escape(title), '\n'.join(body)))
+
+
+def _init_worker_():
+
+    import matplotlib
+    matplotlib.use('Agg')
+
+
+def build_reports(directory, target=output, fmt='html', max_workers=None, chunksize=chunksize, dpi=DPI):
+    """
+    Render the reports of every activity of a directory in a process
+    pool of max_workers (serially if 1), plus an index.html of all
+    of them for the html format.
+    :return list of report_activity results, in activity id order:
+    """
+    if fmt not in FORMATS:
+        raise ValueError("Unknown report format %s" % fmt)
+    activities = sorted(find_activities(directory).items())
+    report = functools.partial(report_activity, directory=target, fmt=fmt, dpi=dpi)
+    os.makedirs(target, exist_ok=True)
+
+    if max_workers == 1:
+        _init_worker_()
+        results = list(tqdm(map(report, activities), total=len(activities)))
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker_) as executor:
+            results = list(tqdm(executor.map(report, activities, chunksize=chunksize), total=len(activities)))
+
+    if fmt == 'html':
+        items = ['<li><a href="%s/index.html">%s</a>%s</li>'
+                 % (html.escape(activity_id), html.escape(activity_id),
+                    '' if error is None else ' (%s)' % html.escape(error))
+                 for activity_id, _, error in results]
+        _write_html_(os.path.join(target, 'index.html'), 'Activities', ['<ul>'] + items + ['</ul>'])
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Render the reports of a directory of activities.')
+    parser.add_argument('directory', help='directory of TCX/FIT activities and lap CSV exports')
+    parser.add_argument('-o', '--output', default=output, help='report directory (default: %(default)s)')
+    parser.add_argument('-f', '--format', default='html', choices=FORMATS, help='charts only or with pages')
+    parser.add_argument('-w', '--workers', type=int, default=workers, help='worker processes')
+    parser.add_argument('--dpi', type=int, default=DPI)
+    args = parser.parse_args(argv)
+
+    results = build_reports(args.directory, args.output, args.format, args.workers, dpi=args.dpi)
+    failed = [(activity_id, error) for activity_id, _, error in results if error is not None]
+    for activity_id, error in failed:
+        print('%s failed: %s' % (activity_id, error))
+    print('%d reports in %s' % (len(results) - len(failed), args.output))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
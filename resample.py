@@ -0,0 +1,121 @@
+"""
+Uniform time grid resampling of TCX/FIT trackpoints.
+
+Samples are snapped onto a fixed period grid (1 Hz by default)
+with np.searchsorted based interpolation, so rolling metrics
+(Normalized Power, smoothed heart rate) become fixed-stride
+array operations. Gaps longer than max_gap (pauses, lost
+signal) are filled according to the gap mode:
+
+- 'hold'  : repeat the last value before the gap
+- 'zero'  : zero, e.g. no power while stopped
+- 'break' : NaN, and the samples after the gap start a new segment
+"""
+
+import numpy as np
+
+PERIOD = 1.0  # Grid period in seconds
+MAX_GAP = 10.0  # Seconds between samples above which they are a gap
+GAPS = ('hold', 'zero', 'break')
+KINDS = ('linear', 'previous')
+
+NAT = np.iinfo(np.int64).min
+
+
+def resample(time, columns, period=PERIOD, gap='hold', max_gap=MAX_GAP, kind='linear'):
+    """
+    Resample columns of samples onto a uniform time grid.
+
+    Parameters
+    ----------
+    time : array of sample times (datetime64 or convertible)
+    columns : dict of name to array of sample values
+    period : float, grid period in seconds
+    gap : string, one of GAPS, how to fill gaps longer than max_gap
+    max_gap : float, seconds
+    kind : string, 'linear' interpolation or the 'previous' sample value
+
+    Returns
+    -------
+    dict with 'time' (datetime64[ns]), 'segment' (int32, -1 inside
+    'break' gaps) and every column as a float32 array on the grid
+    """
+    if gap not in GAPS:
+        raise ValueError("Unknown gap mode %s" % gap)
+    if kind not in KINDS:
+        raise ValueError("Unknown interpolation %s" % kind)
+
+    times = np.asarray(time, dtype='datetime64[ns]').astype(np.int64)
+    # Sort the valid samples, keeping the last of duplicated times
+    valid = np.flatnonzero(times != NAT)
+    order = valid[np.argsort(times[valid], kind='stable')]
+    times = times[order]
+    keep = np.append(times[1:] != times[:-1], True)
+    order, times = order[keep], times[keep]
+
+    if len(times) == 0:
+        empty = {'time': np.empty(0, dtype='datetime64[ns]'), 'segment': np.empty(0, dtype=np.int32)}
+        empty.update((name, np.empty(0, dtype=np.float32)) for name in columns)
+        return empty
+
+    step = int(round(period * 1e9))
+    grid = np.arange(times[0], times[-1] + 1, step, dtype=np.int64)
+    left = np.searchsorted(times, grid, side='right') - 1
+    right = np.minimum(left + 1, len(times) - 1)
+    span = times[right] - times[left]
+    offset = grid - times[left]
+    weight = np.where(span > 0, offset / np.where(span > 0, span, 1), 0.0)
+
+    large = np.diff(times) > max_gap * 1e9
+    in_gap = (offset > 0) & np.append(large, False)[left]
+    segment = np.concatenate(([0], np.cumsum(large)))[left].astype(np.int32)
+
+    resampled = {'time': grid.astype('datetime64[ns]'), 'segment': segment}
+    for name, values in columns.items():
+        values = np.asarray(values, dtype=float)[order]
+        before, after = values[left], values[right]
+        if kind == 'linear':
+            grid_values = before + (after - before) * weight
+        else:
+            grid_values = before
+
+        if gap == 'hold':
+            grid_values = np.where(in_gap, before, grid_values)
+        elif gap == 'zero':
+            grid_values = np.where(in_gap, 0.0, grid_values)
+        else:
+            grid_values = np.where(in_gap, np.nan, grid_values)
+        resampled[name] = grid_values.astype(np.float32)
+
+    if gap == 'break':
+        resampled['segment'] = np.where(in_gap, -1, segment).astype(np.int32)
+    return resampled
+
+
+def rolling_mean(values, window):
+    """
+    Fixed-stride rolling mean over window samples, aligned like
+    pd.Series.rolling(window).mean(): the first window - 1 values
+    and every window holding a NaN are NaN.
+    """
+    values = np.asarray(values, dtype=float)
+    means = np.full(len(values), np.nan)
+    if len(values) < window:
+        return means
+
+    missing = np.isnan(values)
+    sums = np.concatenate(([0.0], np.cumsum(np.where(missing, 0.0, values))))
+    gaps = np.concatenate(([0], np.cumsum(missing)))
+
+    window_sums = (sums[window:] - sums[:-window]) / window
+    means[window - 1:] = np.where(gaps[window:] - gaps[:-window] == 0, window_sums, np.nan)
+    return means
+
+
+def smoothed(time, values, window=30, period=PERIOD, gap='break', max_gap=MAX_GAP):
+    """
+    Return the grid times and the rolling mean of window grid samples
+    of a column (e.g. smoothed heart rate).
+    """
+    grid = resample(time, {'values': values}, period, gap, max_gap)
+    return grid['time'], rolling_mean(grid['values'], window)
@@ -0,0 +1,22 @@
+from setuptools import setup
+
+setup(
+    name='garmin-parser',
+    version='0.1.0',
+    description='Parse and analyze Garmin TCX, FIT and lap CSV files',
+    python_requires='>=3.7',
+    # The modules stay top level, as the notebooks import them
+    py_modules=[
+        'activity', 'archive', 'cli', 'correlation', 'downsample', 'fitrecords', 'garminconnect', 'geodesy',
+        'graph', 'helper', 'import_time', 'instrument', 'lapcsv', 'loader', 'pmc', 'report',
+        'resample', 'tcxtools', 'zones',
+    ],
+    install_requires=['numpy', 'pandas', 'lxml', 'requests', 'tqdm'],
+    extras_require={
+        'plot': ['matplotlib', 'seaborn'],
+        'archive': ['pyarrow'],
+    },
+    entry_points={
+        'console_scripts': ['garmin-parser = cli:main'],
+    },
+)
@@ -6,12 +6,20 @@ converting to other formats.
 
 import numpy as np
 import pandas as pd
-from lxml import objectify
-import dateutil.parser
-import logging
+from lxml import etree, objectify
 
-TPXNS = "{http://www.garmin.com/xmlschemas/ActivityExtension/v2}TPX"
-LXNS = "{http://www.garmin.com/xmlschemas/ActivityExtension/v2}LX"
+import helper
+import instrument
+
+TCXNS = "{http://www.garmin.com/xmlschemas/TrainingCenterDatabase/v2}"
+AXNS = "{http://www.garmin.com/xmlschemas/ActivityExtension/v2}"
+TPXNS = AXNS + "TPX"
+LXNS = AXNS + "LX"
+
+CHUNKSIZE = 10000
+
+# Sentinel for a missing heart rate in the int16 column
+HR_MISSING = -1
 
 POWER_CONSTANT = 4184
 
@@ -22,8 +30,9 @@ class TCXPandas(object):
 
     Parameters
     ----------
-    tcx_file : string, path object,
-               the path to the tcx file
+    tcx_file : string, path object, bytes or binary file object,
+               the tcx file, optionally gzip compressed or
+               inside a zip archive (see helper.open_activity)
 
     """
 
@@ -33,8 +42,7 @@ class TCXPandas(object):
         self.activity = None
         self.laps_dataframe = None
         self.traverse_dataframe = None
-
-        logging.basicConfig(filename="TCXconversion.log", level=logging.DEBUG)
+        self.lap_offsets = None
 
     def parse(self):
         """
@@ -43,14 +51,55 @@ class TCXPandas(object):
         the self.dataframe object in the TCXParser.
         """
 
-        self.tcx = objectify.parse(open(self.__filehandle__))
-        self.activity = self.tcx.getroot().Activities.Activity
+        with instrument.span('tcx.parse'):
+            with instrument.span('tcx.xml'), helper.open_activity(self.__filehandle__, suffix='.tcx') as tcx_file:
+                self.tcx = objectify.parse(tcx_file)
+            self.activity = self.tcx.getroot().Activities.Activity
 
-        self.traverse_dataframe = pd.DataFrame(self._traverse_laps_())
-        self.laps_dataframe = pd.DataFrame(self._info_laps_())
+            self.traverse_dataframe = self._traverse_laps_()
+            self.laps_dataframe = pd.DataFrame(self._info_laps_())
+        instrument.count('tcx.files')
+        instrument.count('tcx.trackpoints', len(self.traverse_dataframe))
 
         return self.traverse_dataframe, self.laps_dataframe
 
+    def parse_chunks(self, chunksize=CHUNKSIZE):
+        """
+        Stream the TCX file trackpoints as DataFrame chunks.
+
+        Unlike parse(), the document is never held in memory:
+        every Trackpoint is cleared as soon as it is consumed,
+        so arbitrarily large files are read in bounded memory.
+        A first pass finds the columns of the file, so every
+        chunk has the columns of traverse_dataframe (a file
+        object source must be seekable).
+
+        Parameters
+        ----------
+        chunksize : int, the number of trackpoints per DataFrame
+
+        Yields
+        ------
+        DataFrame with the columns of traverse_dataframe, NaN where
+        absent from the chunk, and the heart rate as float64
+        """
+        columns = self._scan_columns_()
+        builder = None
+        for sport, trackpoint in self._iter_trackpoints_():
+            if builder is None:
+                builder = TrackpointBuilder(sport, capacity=chunksize)
+
+            builder.append(trackpoint)
+            if len(builder) == chunksize:
+                instrument.count('tcx.trackpoints', len(builder))
+                yield builder.to_dataframe(columns)
+                builder = TrackpointBuilder(sport, capacity=chunksize)
+
+        if builder is not None and len(builder):
+            instrument.count('tcx.trackpoints', len(builder))
+            yield builder.to_dataframe(columns)
+        instrument.count('tcx.files')
+
     def get_activity_timestamp(self):
         """
         Returns the TCX file timestamp if parsed
@@ -78,6 +127,46 @@ class TCXPandas(object):
         else:
             return self.activity.Lap.items()[0][1]
 
+    def _scan_columns_(self):
+
+        # The columns with a value, by first trackpoint as in to_dataframe
+        source = self.__filehandle__
+        position = source.tell() if hasattr(source, 'seek') else None
+        fields, first = None, {}
+        for index, (sport, trackpoint) in enumerate(self._iter_trackpoints_()):
+            if fields is None:
+                fields = trackpoint_fields(sport)
+            for element in trackpoint.iter():
+                name = fields.get(element.tag)
+                if name is not None and name not in first and element.text:
+                    first[name] = index
+        if position is not None:
+            source.seek(position)
+        # Stable sort: the dtypes order among the columns of a trackpoint
+        return sorted((name for name, _ in TrackpointBuilder.dtypes if name in first), key=first.get)
+
+    def _iter_trackpoints_(self):
+
+        sport = None
+        with helper.open_activity(self.__filehandle__, suffix='.tcx') as tcx_file:
+            context = etree.iterparse(tcx_file, events=('start', 'end'),
+                                      tag=(TCXNS + 'Activity', TCXNS + 'Trackpoint'))
+            for event, element in context:
+                if element.tag == TCXNS + 'Activity':
+                    if event == 'start':
+                        sport = element.get('Sport')
+                    continue
+
+                if event == 'end':
+                    yield sport, element
+
+                    # Release the consumed trackpoint and its siblings
+                    element.clear()
+                    while element.getprevious() is not None:
+                        del element.getparent()[0]
+
+            del context
+
     def _info_laps_(self):
 
         # New iterator method to align with lxml standard
@@ -133,62 +222,151 @@ class TCXPandas(object):
 
     def _traverse_laps_(self):
 
-        # New iterator method to align with lxml standard
-        return_array = []
-        for laps in self.activity.Lap:
-            for tracks in laps.Track:
-                for trackingpoints in tracks.Trackpoint:
-                    return_dict = {}
-
-                    return_dict['time'] = dateutil.parser.parse(str(trackingpoints.Time))
-
-                    try:
-                        return_dict['latitude'] = np.float(trackingpoints.Position.LatitudeDegrees)
-                    except AttributeError:
-                        pass  # TODO log this
-
-                    try:
-                        return_dict['longitude'] = np.float(trackingpoints.Position.LongitudeDegrees)
-                    except AttributeError:
-                        pass  # TODO log this
-
-                    try:
-                        return_dict['altitude'] = np.float(trackingpoints.AltitudeMeters)
-                    except AttributeError:
-                        pass  # TODO log this
-
-                    try:
-                        return_dict['distance'] = np.float(trackingpoints.DistanceMeters)
-                    except AttributeError:
-                        pass  # TODO log this
-
-                    try:
-                        return_dict['hr'] = np.int(trackingpoints.HeartRateBpm.Value)
-                    except AttributeError:
-                        pass  # TODO log this
-
-                    try:
-                        return_dict['speed (m/s)'] = np.float(trackingpoints.Extensions[TPXNS].Speed)
-                        return_dict['speed (km/h)'] = np.float(trackingpoints.Extensions[TPXNS].Speed) * 3.6
-                    except AttributeError:
-                        pass  # TODO log this
-
-                    if self.get_sport == 'Running':
-                        try:
-                            return_dict['cadence'] = np.float(trackingpoints.Extensions[TPXNS].RunCadence)
-                        except AttributeError:
-                            pass  # TODO log this
-                    else:  # self.activity.attrib['Sport'] == 'Biking':
-                        try:
-                            return_dict['cadence'] = np.float(trackingpoints.Cadence)
-                        except AttributeError:
-                            pass  # TODO log this
-
-                        try:
-                            return_dict['power'] = np.float(trackingpoints.Extensions[TPXNS].Watts)
-                        except AttributeError:
-                            pass  # TODO log this
-
-                    return_array.append(return_dict)
+        # Index of the first trackpoint of every lap, plus the end
+        trackpoints = []
+        self.lap_offsets = [0]
+        for lap in self.activity.Lap:
+            trackpoints.extend(lap.iterdescendants(TCXNS + 'Trackpoint'))
+            self.lap_offsets.append(len(trackpoints))
 
-        return return_array
+        builder = TrackpointBuilder(self.get_sport(), capacity=len(trackpoints))
+        for trackpoint in trackpoints:
+            builder.append(trackpoint)
+
+        return builder.to_dataframe()
+
+
+def trackpoint_fields(sport):
+    """
+    Map each trackpoint descendant tag of a sport to its column
+    """
+    fields = {
+        TCXNS + 'LatitudeDegrees': 'latitude',
+        TCXNS + 'LongitudeDegrees': 'longitude',
+        TCXNS + 'AltitudeMeters': 'altitude',
+        TCXNS + 'DistanceMeters': 'distance',
+        TCXNS + 'Value': 'hr',
+        AXNS + 'Speed': 'speed (m/s)',
+    }
+    if sport == 'Running':
+        fields[AXNS + 'RunCadence'] = 'cadence'
+    else:
+        fields[TCXNS + 'Cadence'] = 'cadence'
+        fields[AXNS + 'Watts'] = 'power'
+    return fields
+
+
+class TrackpointBuilder(object):
+    """
+    Columnar builder of the traverse_dataframe.
+
+    Trackpoint values are written straight into preallocated
+    typed arrays (NaN, or HR_MISSING for the heart rate, when
+    absent) and the Time column is converted in one vectorized
+    pass when the DataFrame is built.
+
+    Parameters
+    ----------
+    sport : string, the Sport attribute of the TCX Activity
+    capacity : int, the number of trackpoints to preallocate
+
+    """
+
+    dtypes = [
+        ('latitude', np.float64),
+        ('longitude', np.float64),
+        ('altitude', np.float64),
+        ('distance', np.float64),
+        ('hr', np.int16),
+        ('speed (m/s)', np.float32),
+        ('cadence', np.float32),
+        ('power', np.float32),
+    ]
+
+    def __init__(self, sport=None, capacity=CHUNKSIZE):
+        self.size = 0
+        self.time = np.empty(max(capacity, 1), dtype=object)
+        self.columns = {}
+        for name, dtype in self.dtypes:
+            fill = HR_MISSING if name == 'hr' else np.nan
+            self.columns[name] = np.full(len(self.time), fill, dtype=dtype)
+
+        self.fields = trackpoint_fields(sport)
+
+    def __len__(self):
+        return self.size
+
+    def append(self, trackpoint):
+        """
+        Append one Trackpoint element (plain or objectified lxml).
+        """
+        if self.size == len(self.time):
+            self._grow_()
+
+        index = self.size
+        for element in trackpoint.iter():
+            tag = element.tag
+            if tag == TCXNS + 'Time':
+                self.time[index] = element.text
+                continue
+
+            name = self.fields.get(tag)
+            if name is not None:
+                self.columns[name][index] = element.text
+
+        self.size += 1
+
+    def to_dataframe(self, columns=None):
+        """
+        Return the appended trackpoints as a DataFrame.
+        Columns without any value are left out and a complete
+        heart rate is int64, unless columns (dtypes names, in
+        order) are given: then exactly those are kept, NaN where
+        absent, and the heart rate is float64, as for the chunks
+        of a file. Otherwise the columns are in the order they
+        first appear in the trackpoints, as built by the row by
+        row parser.
+        """
+        size = self.size
+        with instrument.span('tcx.timestamps'):
+            data = {'time': pd.to_datetime(self.time[:size], utc=True)}
+
+        first = {}
+        for name, _ in self.dtypes:
+            column = self.columns[name][:size]
+            present = column != HR_MISSING if name == 'hr' else ~np.isnan(column)
+            if not present.any() if columns is None else name not in columns:
+                continue
+            first[name] = np.argmax(present)
+            if name == 'hr':
+                if present.all() and columns is None:
+                    data[name] = column.astype(np.int64)
+                else:
+                    data[name] = np.where(present, column, np.nan)
+                continue
+
+            data[name] = column.astype(np.float64)
+            if name == 'speed (m/s)':
+                data['speed (km/h)'] = data[name] * 3.6
+
+        if columns is None:
+            # Stable sort: the dtypes order among the columns of a trackpoint
+            columns = sorted(first, key=first.get)
+        else:
+            columns = list(columns)
+        if 'speed (m/s)' in columns:
+            columns.insert(columns.index('speed (m/s)') + 1, 'speed (km/h)')
+        return pd.DataFrame(data, columns=['time'] + columns)
+
+    def _grow_(self):
+
+        capacity = 2 * len(self.time)
+        time = np.empty(capacity, dtype=object)
+        time[:self.size] = self.time[:self.size]
+        self.time = time
+
+        for name, column in self.columns.items():
+            fill = HR_MISSING if name == 'hr' else np.nan
+            grown = np.full(capacity, fill, dtype=column.dtype)
+            grown[:self.size] = column[:self.size]
+            self.columns[name] = grown
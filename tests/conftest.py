@@ -0,0 +1,64 @@
+import datetime
+import os
+import sys
+
+import pytest
+
+# The modules are top level, as the notebooks import them
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture
+def samples():
+    """
+    Directory of the bundled sample activities.
+    """
+    return ROOT
+
+
+TCX_HEAD = '''<?xml version="1.0" encoding="UTF-8"?>
+<TrainingCenterDatabase xmlns="http://www.garmin.com/xmlschemas/TrainingCenterDatabase/v2">
+  <Activities>
+    <Activity Sport="Biking">
+      <Id>%s</Id>
+      <Lap StartTime="%s">
+        <Track>
+'''
+TCX_TRACKPOINT = '''          <Trackpoint>
+            <Time>%s</Time>
+            <DistanceMeters>%.1f</DistanceMeters>%s
+          </Trackpoint>
+'''
+TCX_HEART_RATE = '''
+            <HeartRateBpm>
+              <Value>%d</Value>
+            </HeartRateBpm>'''
+TCX_TAIL = '''        </Track>
+      </Lap>
+    </Activity>
+  </Activities>
+</TrainingCenterDatabase>
+'''
+
+
+@pytest.fixture
+def tcx_file(tmp_path):
+    """
+    Writes a TCX activity of one lap, one trackpoint per second
+    from start, with the heart rates given (None when the sensor
+    dropped out), and returns its path.
+    """
+    def write(name, start, heart_rates):
+        start = datetime.datetime.fromisoformat(start)
+        times = [(start + datetime.timedelta(seconds=second)).strftime('%Y-%m-%dT%H:%M:%S.000Z')
+                 for second in range(len(heart_rates))]
+        path = tmp_path / name
+        with open(str(path), 'w') as tcx:
+            tcx.write(TCX_HEAD % (times[0], times[0]))
+            for second, (time, hr) in enumerate(zip(times, heart_rates)):
+                tcx.write(TCX_TRACKPOINT % (time, 5.0 * second, '' if hr is None else TCX_HEART_RATE % hr))
+            tcx.write(TCX_TAIL)
+        return str(path)
+
+    return write
@@ -0,0 +1,26 @@
+import os
+import shutil
+
+import pytest
+
+import archive
+
+FIT = os.path.join('cycling', '5173186556.fit')
+TCX = os.path.join('cycling', 'activity_5173186556.tcx')
+
+
+def test_activity_is_archived_from_its_fit_file(samples, tmp_path):
+    pytest.importorskip('pyarrow', exc_type=ImportError)
+    directory = tmp_path / 'activities'
+    directory.mkdir()
+    root = str(tmp_path / 'archive')
+    shutil.copy(os.path.join(samples, TCX), str(directory))
+    archive.ingest(str(directory), root, max_workers=1)
+    assert list(archive.load_manifest(root).index) == [str(directory / 'activity_5173186556.tcx')]
+
+    # Downloaded again as FIT: the archive switches to it, as the PMC does
+    shutil.copy(os.path.join(samples, FIT), str(directory))
+    archive.ingest(str(directory), root, max_workers=1)
+    manifest = archive.load_manifest(root)
+    assert list(manifest.index) == [str(directory / '5173186556.fit')]
+    assert len(archive.query(root, ['activity_id']).drop_duplicates()) == 1
@@ -0,0 +1,17 @@
+import os
+
+import pytest
+
+import cli
+import instrument
+
+FIT = os.path.join('cycling', '5173186556.fit')
+
+
+@pytest.mark.parametrize('argv', [['--metrics=memory', 'parse', FIT], ['parse', FIT, '--metrics', 'memory']])
+def test_metrics_before_or_after_the_subcommand(samples, capsys, argv):
+    argv = [os.path.join(samples, arg) if arg == FIT else arg for arg in argv]
+
+    assert cli.main(argv) == 0
+    assert 'fit.records' in capsys.readouterr().err
+    assert not instrument.enabled()
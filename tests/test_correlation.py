@@ -0,0 +1,20 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from correlation import Correlation
+
+COLUMNS = ['hr', 'power', 'cadence']
+
+
+@pytest.mark.filterwarnings('error::RuntimeWarning')
+def test_batch_with_an_empty_column_does_not_warn():
+    rows = np.array([[120.0, 200.0, np.nan],
+                     [130.0, 250.0, np.nan],
+                     [125.0, np.inf, np.nan],
+                     [140.0, 300.0, np.nan]])
+    accumulator = Correlation(COLUMNS).update(rows)
+
+    expected = pd.DataFrame(rows, columns=COLUMNS).replace(np.inf, np.nan).corr()
+    pd.testing.assert_frame_equal(accumulator.corr(), expected)
+    assert np.isnan(accumulator.corr().loc['cadence']).all()
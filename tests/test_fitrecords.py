@@ -0,0 +1,18 @@
+import os
+
+import numpy as np
+import pytest
+
+import fitrecords
+
+FIT = os.path.join('cycling', '5173186556.fit')
+
+
+@pytest.mark.parametrize('field', ['enhanced_speed', 'enhanced_altitude'])
+def test_enhanced_fields_expanded_from_their_components(samples, field):
+    fitparse = pytest.importorskip('fitparse')
+    path = os.path.join(samples, FIT)
+    expected = [message.get_value(field) for message in fitparse.FitFile(path).get_messages('record')]
+
+    values = fitrecords.read_records(path, [field])[field]
+    np.testing.assert_allclose(values, np.array(expected, dtype=float), rtol=1e-6)
@@ -0,0 +1,175 @@
+import datetime
+import json
+import time
+
+import requests
+
+import garminconnect
+from garminconnect import Garmin, ResponseCache
+
+DAY = '2020-07-01'
+DAY_END = datetime.datetime(2020, 7, 2).timestamp()
+
+
+class FakeSession(object):
+    """
+    Stands in for the requests session, answering from a list of
+    (status, json, headers) and recording the requests.
+    """
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def get(self, url, headers=None, **kwargs):
+        self.requests.append((url, headers or {}))
+        return _response_(url, *self.responses.pop(0))
+
+
+def _response_(url, status, body, headers):
+
+    response = requests.Response()
+    response.status_code = status
+    response._content = b'' if body is None else json.dumps(body).encode()
+    response.headers.update(headers)
+    response.url = url
+    return response
+
+
+def _client_(tmp_path, session, ttl=600):
+
+    client = Garmin('email', 'password', cache=ResponseCache(str(tmp_path / 'cache'), ttl=ttl))
+    client.display_name = 'me'
+    client.req = session
+    client.logins = 0
+
+    def login():
+        client.logins += 1
+        client.session_generation += 1
+
+    client.login = login
+    return client
+
+
+def test_entry_stored_during_the_day_is_revalidated(tmp_path):
+    session = FakeSession((304, None, {'ETag': '"v2"'}))
+    client = _client_(tmp_path, session, ttl=0)
+    key = ('heart_rates', 'me', DAY)
+    # Stored an hour before the day ended, with a partial day
+    client.cache.put(key, {'json': {'restingHeartRate': 50}, 'stored': DAY_END - 3600, 'etag': '"v1"'})
+
+    assert client.get_heart_rates(DAY) == {'restingHeartRate': 50}
+    assert session.requests[0][1]['If-None-Match'] == '"v1"'
+    assert garminconnect.is_final(DAY, client.cache.get(key)['stored'])
+
+
+def test_entry_stored_after_the_day_is_final(tmp_path):
+    session = FakeSession()
+    client = _client_(tmp_path, session, ttl=0)
+    client.cache.put(('heart_rates', 'me', DAY), {'json': {'restingHeartRate': 48}, 'stored': DAY_END + 60})
+
+    assert client.get_heart_rates(DAY) == {'restingHeartRate': 48}
+    assert session.requests == []
+
+
+def test_stats_relogin_and_cache_through_fetch_daily(tmp_path):
+    session = FakeSession((200, {'privacyProtected': True}, {}),
+                          (200, {'privacyProtected': False, 'totalSteps': 1000}, {'ETag': '"s1"'}))
+    client = _client_(tmp_path, session)
+
+    assert client.get_stats(DAY)['totalSteps'] == 1000
+    assert client.logins == 1
+    entry = client.cache.get(('stats', 'me', DAY))
+    assert entry['json']['totalSteps'] == 1000 and entry['etag'] == '"s1"'
+    assert entry['stored'] <= time.time()
+
+    # Served from the cache within the ttl
+    assert client.get_stats(DAY)['totalSteps'] == 1000
+    assert len(session.requests) == 2
+
+
+def test_failed_downloads_stay_pending_for_the_next_sync(tmp_path):
+    page = [{'activityId': 2, 'startTimeGMT': '2020-07-02 08:00:00'},
+            {'activityId': 1, 'startTimeGMT': '2020-07-01 08:00:00'}]
+    session = FakeSession((200, page, {}), (200, page, {}))
+    client = _client_(tmp_path, session)
+    state_file = str(tmp_path / 'sync.json')
+
+    activities = client.sync_activities(state_file, save=False)
+    assert [activity['activityId'] for activity in activities] == [2, 1]
+    client.save_sync(state_file, activities, failed_ids=['1'])
+
+    # Nothing new, the failed activity is listed again
+    activities = client.sync_activities(state_file, save=False)
+    assert [activity['activityId'] for activity in activities] == [1]
+    client.save_sync(state_file, activities)
+
+    state = garminconnect.load_sync_state(state_file)
+    assert state['activity_id'] == 2 and state['pending'] == []
+
+
+def test_range_retries_rate_limited_days_and_keeps_the_others(tmp_path):
+    limited = (429, None, {'Retry-After': '0'})
+    session = FakeSession((200, {'restingHeartRate': 50}, {}),
+                          limited, (200, {'restingHeartRate': 51}, {}),
+                          *[limited] * garminconnect.RANGE_RETRIES)
+    client = _client_(tmp_path, session)
+    limiter = garminconnect.RateLimiter(rate=1000.0, burst=1)
+
+    days = client.get_heart_rates_range('2020-07-01', '2020-07-03', max_workers=1, limiter=limiter)
+    assert [str(date.date()) for date in days.index] == ['2020-07-01', '2020-07-02']
+    assert days['restingHeartRate'].tolist() == [50, 51]
+    assert limiter.rate < limiter.max_rate
+    assert session.responses == []
+
+
+class WeightSession(FakeSession):
+    """
+    Answers the body composition request with weights,
+    whichever thread sends it first.
+    """
+
+    def __init__(self, weights, *responses):
+        super().__init__(*responses)
+        self.weights = weights
+
+    def get(self, url, headers=None, **kwargs):
+        if 'weight-service' in url:
+            return _response_(url, 200, {'dateWeightList': self.weights}, {})
+        return super().get(url, headers, **kwargs)
+
+
+def test_stats_and_body_keep_the_last_weigh_in_of_a_day(tmp_path):
+    weights = [{'calendarDate': '2020-07-01', 'date': 1593622800000, 'weight': 70100.0},
+               {'calendarDate': '2020-07-01', 'date': 1593590400000, 'weight': 70500.0}]
+    session = WeightSession(weights, (200, {'totalSteps': 1000}, {}), (200, {'totalSteps': 2000}, {}))
+    client = _client_(tmp_path, session)
+
+    days = client.get_stats_and_body_range('2020-07-01', '2020-07-02', max_workers=1)
+    assert days['totalSteps'].tolist() == [1000, 2000]
+    assert days['weight'].iloc[0] == 70100.0 and days['weight'].isnull().iloc[1]
+
+
+def test_stats_without_weigh_ins_are_returned_unchanged(tmp_path):
+    session = WeightSession([], (200, {'totalSteps': 1000}, {}))
+    client = _client_(tmp_path, session)
+
+    days = client.get_stats_and_body_range('2020-07-01', '2020-07-01', max_workers=1)
+    assert list(days.columns) == ['totalSteps']
+    assert len(days) == 1
+
+
+def test_not_modified_without_validators_keeps_the_stored_ones(tmp_path):
+    session = FakeSession((304, None, {}), (304, None, {}))
+    client = _client_(tmp_path, session, ttl=0)
+    key = ('heart_rates', 'me', DAY)
+    last_modified = 'Wed, 01 Jul 2020 22:00:00 GMT'
+    client.cache.put(key, {'json': {'restingHeartRate': 50}, 'stored': DAY_END - 3600, 'etag': '"v1"',
+                           'last_modified': last_modified})
+    # A partial day entry again, to be revalidated on every call
+    client.cache.put = lambda key, entry, put=client.cache.put: put(key, dict(entry, stored=DAY_END - 60))
+
+    assert client.get_heart_rates(DAY) == {'restingHeartRate': 50}
+    assert client.get_heart_rates(DAY) == {'restingHeartRate': 50}
+    headers = session.requests[1][1]
+    assert headers['If-None-Match'] == '"v1"' and headers['If-Modified-Since'] == last_modified
@@ -0,0 +1,11 @@
+import pytest
+
+import import_time
+
+
+@pytest.mark.parametrize('module', list(import_time.BUDGETS))
+def test_module_imports_within_its_budget(module):
+    seconds, loaded = import_time.import_time(module)
+
+    assert seconds <= import_time.BUDGETS[module]
+    assert loaded == ''
@@ -0,0 +1,44 @@
+import os
+
+import pandas as pd
+
+import lapcsv
+import report
+
+LAPS = os.path.join('cycling', 'activity_5173186556.csv')
+TCX = os.path.join('cycling', 'activity_5173186556.tcx')
+
+
+def _export_(samples, tmp_path, edit):
+
+    laps = edit(pd.read_csv(os.path.join(samples, LAPS), dtype=str))
+    path = str(tmp_path / 'activity_1.csv')
+    laps.to_csv(path, index=False)
+    return path
+
+
+def test_cycling_export_with_extra_columns(samples, tmp_path):
+    path = _export_(samples, tmp_path, lambda laps: laps.assign(**{'Avg Power': '210', 'Avg Bike Cadence': '--',
+                                                                   'Lap Type': 'Manual'}))
+
+    assert lapcsv.detect_sport(pd.read_csv(path).columns) == 'cycling'
+    laps = lapcsv.read_laps(path)
+    assert laps['Avg Power'].dtype.kind == 'i' and laps['Avg Bike Cadence'].isnull().all()
+    assert (laps['Lap Type'] == 'Manual').all()
+    assert laps['Time (s)'].iloc[0] == 19 * 60 + 18
+
+
+def test_export_without_a_column(samples, tmp_path):
+    path = _export_(samples, tmp_path, lambda laps: laps.drop(columns=['Calories', 'Elev Loss']))
+
+    laps = lapcsv.read_laps(path)
+    assert 'Avg Moving Speed' in laps and laps['Power (w)'].isnull().all()
+
+
+def test_unreadable_laps_keep_the_track_charts(samples, tmp_path):
+    path = _export_(samples, tmp_path, lambda laps: laps.drop(columns=['Time']))
+
+    activity_id, names, error = report.report_activity(
+        ('1', {'track': os.path.join(samples, TCX), 'laps': path}), directory=str(tmp_path / 'reports'), dpi=20)
+    assert 'heartrate.png' in names
+    assert error.startswith('laps ValueError')
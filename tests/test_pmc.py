@@ -0,0 +1,54 @@
+import datetime
+import os
+import shutil
+
+import pytest
+
+import pmc
+
+DAY = datetime.date(2020, 7, 1)
+FIT = os.path.join('cycling', '5173186556.fit')
+TCX = os.path.join('cycling', 'activity_5173186556.tcx')
+LAPS = os.path.join('cycling', 'activity_5173186556.csv')
+
+
+def _directory_(samples, tmp_path, *names):
+
+    os.makedirs(str(tmp_path), exist_ok=True)
+    for name in names:
+        shutil.copy(os.path.join(samples, name), tmp_path)
+    return str(tmp_path)
+
+
+def test_fit_and_tcx_of_one_activity_are_scored_once(samples, tmp_path):
+    alone = pmc.build_pmc(_directory_(samples, tmp_path / 'fit', FIT), DAY, DAY, max_workers=1)
+    both = pmc.build_pmc(_directory_(samples, tmp_path / 'both', FIT, TCX, LAPS), DAY, DAY, max_workers=1)
+
+    assert alone.loc[DAY, 'TSS'] > 0
+    assert both.loc[DAY, 'TSS'] == pytest.approx(alone.loc[DAY, 'TSS'])
+
+
+def test_workout_paths_prefer_fit(samples, tmp_path):
+    directory = _directory_(samples, tmp_path, FIT, TCX, LAPS)
+
+    assert pmc.workout_paths(directory) == [os.path.join(directory, '5173186556.fit')]
+
+
+def test_unscored_files_are_not_parsed_again(samples, tmp_path, tcx_file, monkeypatch):
+    directory = _directory_(samples, tmp_path / 'workouts', FIT)
+    # No power or heart rate to score
+    tcx_file(os.path.join('workouts', 'activity_1.tcx'), '2020-07-01T08:00:00', [None] * 10)
+    paths = {'ledger_path': str(tmp_path / 'ledger.csv'), 'pmc_path': str(tmp_path / 'pmc.csv')}
+    loaded = []
+    load_workout = pmc.load_workout
+    monkeypatch.setattr(pmc, 'load_workout', lambda path, fields: loaded.append(path) or load_workout(path, fields))
+
+    first = pmc.update_pmc(directory, DAY, DAY, max_workers=1, **paths)
+    assert len(loaded) == 2
+    ledger = pmc.load_ledger(paths['ledger_path'])
+    assert ledger['tss'].isnull().sum() == 1
+
+    second = pmc.update_pmc(directory, DAY, DAY, max_workers=1, **paths)
+    assert len(loaded) == 2
+    assert second.loc[DAY, 'TSS'] == pytest.approx(first.loc[DAY, 'TSS'])
+    assert first.loc[DAY, 'TSS'] > 0
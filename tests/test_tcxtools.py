@@ -0,0 +1,60 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import instrument
+from tcxtools import TCXPandas
+
+# traverse_dataframe of the samples as parsed before the columnar builder
+BASELINE = os.path.join(os.path.dirname(__file__), 'baseline')
+SAMPLES = [
+    os.path.join('cycling', 'activity_5173186556.tcx'),
+    os.path.join('cycling', 'activity_5331071304.tcx'),
+    os.path.join('ricardo', 'activity_5187261702.tcx'),
+    os.path.join('rowing', 'activity_5348759230.tcx'),
+    os.path.join('stair', 'activity_5272936472.tcx'),
+]
+
+
+@pytest.mark.parametrize('sample', SAMPLES)
+def test_traverse_dataframe_matches_the_baseline(samples, sample):
+    name = os.path.splitext(os.path.basename(sample))[0]
+    expected = pd.read_csv(os.path.join(BASELINE, name + '.csv.gz'))
+    expected['time'] = pd.to_datetime(expected['time'], utc=True)
+
+    traverse_dataframe, _ = TCXPandas(os.path.join(samples, sample)).parse()
+    pd.testing.assert_frame_equal(traverse_dataframe, expected)
+
+
+def test_chunks_keep_their_columns_when_a_sensor_drops_out(tcx_file):
+    # The heart rate strap drops out for the last five seconds
+    path = tcx_file('activity_1.tcx', '2020-07-01T08:00:00', [120, 121, 122, 123, 124] + [None] * 5)
+
+    chunks = list(TCXPandas(path).parse_chunks(chunksize=4))
+    assert [len(chunk) for chunk in chunks] == [4, 4, 2]
+    for chunk in chunks[1:]:
+        pd.testing.assert_series_equal(chunk.dtypes, chunks[0].dtypes)
+    assert chunks[0]['hr'].dtype == np.float64
+    assert chunks[2]['hr'].isnull().all()
+
+    whole, _ = TCXPandas(path).parse()
+    streamed = pd.concat(chunks, ignore_index=True)
+    pd.testing.assert_frame_equal(streamed, whole)
+
+
+@pytest.mark.parametrize('sample', SAMPLES)
+def test_chunks_have_the_columns_of_parse(samples, sample):
+    path = os.path.join(samples, sample)
+    whole, _ = TCXPandas(path).parse()
+
+    sink = instrument.enable(instrument.MemorySink())
+    try:
+        chunks = list(TCXPandas(path).parse_chunks(chunksize=1000))
+    finally:
+        instrument.disable()
+    assert all(list(chunk.columns) == list(whole.columns) for chunk in chunks)
+    pd.testing.assert_frame_equal(pd.concat(chunks, ignore_index=True), whole, check_dtype=False)
+    assert sink.counters['tcx.files'] == 1
+    assert sink.counters['tcx.trackpoints'] == len(whole)
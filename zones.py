@@ -0,0 +1,156 @@
+"""
+Vectorized heart rate zone and TSS engine.
+
+The workout columns are read, never copied into or mutated,
+and every score accepts a vector of candidate thresholds
+(FTP or LTHR), so a season of summarized workouts can be
+re-scored for many thresholds in one pass.
+"""
+
+from collections import namedtuple
+
+import numpy as np
+
+import resample
+
+# Upper bounds of the heart rate zones as fractions of LTHR,
+# a sample belongs to the zone (lower, upper] like pd.cut
+HR_ZONE_FRACTIONS = np.array([0, 0.73, 0.77, 0.81, 0.85, 0.89, 0.93, 0.99, 1.03, 1.06, 2])
+HR_ZONE_LABELS = ['Z1 low', 'Z1', 'Z1 high', 'Z2 low', 'Z2 high', 'Z3', 'Z4', 'Z5a', 'Z5b', 'Z5c']
+HR_ZONE_TSS = np.array([20, 30, 40, 50, 60, 70, 80, 100, 120, 140])  # TSS/hr
+
+NP_WINDOW = 30  # Seconds of the Normalized Power rolling mean
+
+# Everything needed to score a workout for any threshold
+Summary = namedtuple('Summary', ['norm_power', 'moving_time', 'hr_values', 'hr_counts'])
+
+
+def _thresholds_(thresholds):
+
+    thresholds = np.asarray(thresholds, dtype=float)
+    return thresholds.ndim == 0, np.atleast_1d(thresholds)
+
+
+def hr_histogram(heart_rate):
+    """
+    Return the distinct heart rate values and their sample counts,
+    ignoring missing samples.
+    """
+    heart_rate = np.asarray(heart_rate, dtype=float)
+    return np.unique(heart_rate[~np.isnan(heart_rate)], return_counts=True)
+
+
+def hr_zone_seconds(hr_values, hr_counts, lthr):
+    """
+    Return the seconds (1 Hz samples) spent in each heart rate zone,
+    shape (10,) for a scalar lthr or (len(lthr), 10) for a vector.
+    Samples outside (0, 2 * lthr] are not counted.
+    """
+    scalar, lthr = _thresholds_(lthr)
+    edges = lthr[:, None] * HR_ZONE_FRACTIONS  # (k, 11)
+
+    # Zone of every distinct value for every candidate,
+    # as np.searchsorted(edges, value, side='left') - 1
+    zones = (hr_values[None, :, None] > edges[:, None, :]).sum(axis=2) - 1
+    valid = (zones >= 0) & (zones < len(HR_ZONE_TSS))
+
+    rows = np.broadcast_to(np.arange(len(lthr))[:, None], zones.shape)
+    counts = np.broadcast_to(hr_counts, zones.shape)
+    seconds = np.bincount(rows[valid] * len(HR_ZONE_TSS) + zones[valid],
+                          weights=counts[valid],
+                          minlength=len(lthr) * len(HR_ZONE_TSS)).reshape(len(lthr), len(HR_ZONE_TSS))
+
+    return seconds[0] if scalar else seconds
+
+
+def time_in_zone(heart_rate, lthr):
+    """
+    Return the seconds spent in each heart rate zone of a workout.
+    """
+    return hr_zone_seconds(*hr_histogram(heart_rate), lthr)
+
+
+def hr_tss(heart_rate, lthr):
+    """
+    Return the heart rate TSS of a workout for one or many LTHR values.
+    """
+    return time_in_zone(heart_rate, lthr) @ HR_ZONE_TSS / 3600
+
+
+def power_1hz(timestamps, power):
+    """
+    Return the power resampled to 1 Hz, zero while stopped.
+    """
+    return resample.resample(timestamps, {'power': power}, gap='zero')['power']
+
+
+def hr_1hz(timestamps, heart_rate):
+    """
+    Return the heart rate resampled to 1 Hz (holding each sample, so
+    values stay integers), NaN while stopped.
+    """
+    return resample.resample(timestamps, {'hr': heart_rate}, gap='break', kind='previous')['hr']
+
+
+def normalized_power(power, window=NP_WINDOW):
+    """
+    Return the Normalized Power of 1 Hz power: the fourth root of the
+    mean of the fourth power of the rolling mean, skipping windows
+    with gaps.
+    """
+    rolling = resample.rolling_mean(power, window)
+    rolling = rolling[~np.isnan(rolling)]
+    if len(rolling) == 0:
+        return np.nan
+    return np.sqrt(np.sqrt(np.mean(rolling ** 4)))
+
+
+def moving_time(timestamps):
+    """
+    Return the seconds between the first and last timestamp.
+    """
+    timestamps = np.asarray(timestamps, dtype='datetime64[ns]')
+    return int((timestamps[-1] - timestamps[0]) / np.timedelta64(1, 's'))
+
+
+def power_tss(norm_power, seconds, ftp):
+    """
+    Return the TSS of a workout for one or many FTP values.
+    """
+    scalar, ftp = _thresholds_(ftp)
+    intensity = norm_power / ftp
+    tss = (seconds * norm_power * intensity) / (ftp * 3600.0) * 100.0
+    return tss[0] if scalar else tss
+
+
+def summarize(workout_df):
+    """
+    Summarize a workout (FIT field names) once,
+    so it can be scored later without the samples.
+    """
+    norm_power = seconds = np.nan
+    if 'power' in workout_df:
+        norm_power = normalized_power(power_1hz(workout_df['timestamp'].values, workout_df['power'].values))
+        seconds = moving_time(workout_df['timestamp'].values)
+
+    hr_values = hr_counts = np.empty(0)
+    if 'heart_rate' in workout_df:
+        hr_values, hr_counts = hr_histogram(hr_1hz(workout_df['timestamp'].values,
+                                                   workout_df['heart_rate'].values))
+
+    return Summary(norm_power, seconds, hr_values, hr_counts)
+
+
+def score(summary, ftp, lthr):
+    """
+    Return the TSS of a summarized workout for candidate
+    FTP and LTHR values (broadcast against each other):
+    based on power if the workout has it, else on heart rate,
+    else NaN.
+    """
+    ftp, lthr = np.broadcast_arrays(np.asarray(ftp, dtype=float), np.asarray(lthr, dtype=float))
+    if not np.isnan(summary.norm_power):
+        return power_tss(summary.norm_power, summary.moving_time, ftp)
+    if len(summary.hr_values):
+        return hr_zone_seconds(summary.hr_values, summary.hr_counts, lthr) @ HR_ZONE_TSS / 3600
+    return np.full(ftp.shape, np.nan)[()]